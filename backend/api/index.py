@@ -1,16 +1,16 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+# backend/api/index.py
+"""Serverless entry point serving the full API.
 
-app = FastAPI()
+A cold start only imports the web layer: the models are not warmed and no job
+worker processes are started, so the image pipeline and the face models load
+with the first request that needs them. Queued jobs need ``python jobs.py``
+running elsewhere.
+"""
+import os
+import sys
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+os.environ.setdefault("IMAGE_MATCH_WARM_MODELS", "0")
+os.environ.setdefault("IMAGE_MATCH_JOB_WORKERS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-@app.get("/")
-def root():
-    return {"message": "Backend is running 🚀"}
+from main import app
@@ -0,0 +1,425 @@
+# backend/artifact_store.py
+"""Packed, append-only storage for uploads, diffs, cleaned images and reports.
+
+Artifacts keep their names (``uploads/3f/a9/<file>``), which are also their
+URLs, but their bytes are appended to large segment files instead of being
+written one file each. ``index.db`` maps every name to the SHA-256 of its
+content and every content hash to ``(segment, offset, length)``, so identical
+bytes are stored once. Reads slice a memory map of the segment.
+
+Segments are never modified in place. Deleting an artifact (retention, which
+spares anything history, unfinished jobs or the face gallery still point at,
+or an explicit ``delete``) only drops its name; ``compact`` later forgets
+unreferenced content and rewrites segments that are mostly dead into the
+active one. Run it as a background process next to the API:
+
+    python artifact_store.py compact --interval 3600 --retention-days 90
+
+Files written before the store existed are still read (and served) from disk;
+``python artifact_store.py import`` packs them.
+"""
+import argparse
+import fcntl
+import hashlib
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+ARTIFACT_AREAS = ("uploads", "diffs", "cleaned", "reports")
+SEGMENT_BYTES = int(os.environ.get("IMAGE_MATCH_SEGMENT_BYTES", 256 * 1024 * 1024))
+RETENTION_DAYS = float(os.environ.get("IMAGE_MATCH_ARTIFACT_RETENTION_DAYS", 0))
+COMPACT_LIVE_RATIO = 0.5
+
+# ``segment`` and ``offset`` are None for a loose file on disk
+Artifact = namedtuple("Artifact", "path size etag created segment offset")
+
+
+def _key(path: str) -> str:
+    return os.path.normpath(path)
+
+
+class ArtifactStore:
+    """Segment files plus a SQLite index, shared by every process in the directory.
+
+    Appends are serialised across processes with ``flock`` on ``append.lock``;
+    readers never lock. Every name holds a reference on its content, and the
+    counts and byte totals behind ``stats`` are kept up to date by each write,
+    so a metrics scrape never scans the index. Each thread reuses one
+    connection to the index, and each process keeps one read-only map per
+    segment, remapping when a segment has grown past its mapping.
+    """
+
+    def __init__(self, directory=None, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory or os.environ.get("IMAGE_MATCH_ARTIFACT_DIR", "artifacts")
+        self.segment_bytes = segment_bytes
+        self.db_path = os.path.join(self.directory, "index.db")
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._maps_lock = threading.Lock()
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def _connect(self):
+        """This thread's connection to the index, opened on first use and then reused."""
+        conn = getattr(self._local, "conn", None)
+        # A forked child must not share its parent's connection
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        if not self._schema_ready:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        self._local.conn, self._local.pid = conn, os.getpid()
+        if not self._schema_ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS blobs (
+                    content_hash TEXT PRIMARY KEY,
+                    segment INTEGER,
+                    offset INTEGER,
+                    length INTEGER,
+                    refs INTEGER DEFAULT 0
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS names (
+                    path TEXT PRIMARY KEY,
+                    content_hash TEXT,
+                    created REAL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_segment ON blobs(segment)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_names_hash ON names(content_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_names_created ON names(created)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS store_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    names INTEGER,
+                    blobs INTEGER,
+                    indexed_bytes INTEGER,
+                    live_bytes INTEGER,
+                    segment_bytes INTEGER
+                )
+            ''')
+            conn.commit()
+            # Indexes from before the running totals get reference counts and totals once
+            conn.execute("BEGIN IMMEDIATE")
+            if "refs" not in [row[1] for row in conn.execute("PRAGMA table_info(blobs)")]:
+                conn.execute("ALTER TABLE blobs ADD COLUMN refs INTEGER DEFAULT 0")
+                conn.execute("UPDATE blobs SET refs = (SELECT COUNT(*) FROM names WHERE names.content_hash = blobs.content_hash)")
+            if conn.execute("SELECT 1 FROM store_totals WHERE id = 0").fetchone() is None:
+                segment_bytes = sum(os.path.getsize(self._segment_path(s)) for s in self._segments())
+                conn.execute('''
+                    INSERT INTO store_totals (id, names, blobs, indexed_bytes, live_bytes, segment_bytes)
+                    SELECT 0, (SELECT COUNT(*) FROM names), COUNT(*), COALESCE(SUM(length), 0),
+                           COALESCE(SUM(CASE WHEN refs > 0 THEN length ELSE 0 END), 0), ?
+                    FROM blobs
+                ''', (segment_bytes,))
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    @staticmethod
+    def _add_totals(conn, **deltas):
+        assignments = ", ".join(f"{column} = {column} + ?" for column in deltas)
+        conn.execute(f"UPDATE store_totals SET {assignments} WHERE id = 0", list(deltas.values()))
+
+    def _unreference(self, conn, content_hash):
+        """Drop one name's reference to ``content_hash``; its bytes stop counting as live at zero."""
+        conn.execute("UPDATE blobs SET refs = refs - 1 WHERE content_hash = ?", (content_hash,))
+        row = conn.execute("SELECT refs, length FROM blobs WHERE content_hash = ?", (content_hash,)).fetchone()
+        if row and row[0] == 0:
+            self._add_totals(conn, live_bytes=-row[1])
+
+    # Segments
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment:06d}.pack")
+
+    def _segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            int(name[8:14]) for name in os.listdir(self.directory)
+            if name.startswith("segment-") and name.endswith(".pack")
+        )
+
+    @contextmanager
+    def _append_lock(self):
+        """Exclusive right to append, across threads and processes."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            # A fresh descriptor per acquisition, so forked workers never share one lock
+            with open(os.path.join(self.directory, "append.lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append(self, data: bytes):
+        """Append to the active segment, starting a new one when it is full; hold the append lock."""
+        segments = self._segments()
+        segment = segments[-1] if segments else 1
+        path = self._segment_path(segment)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size and size + len(data) > self.segment_bytes:
+            segment += 1
+            path = self._segment_path(segment)
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+        return segment, offset
+
+    def _mapping(self, segment: int, needed: int):
+        with self._maps_lock:
+            mapping = self._maps.get(segment)
+            if mapping is None or len(mapping) < needed:
+                with open(self._segment_path(segment), "rb") as f:
+                    mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                # Replaced maps are left to the garbage collector: another thread may still be slicing one
+                self._maps[segment] = mapping
+                for stale in [s for s in self._maps if not os.path.exists(self._segment_path(s))]:
+                    del self._maps[stale]
+            return mapping
+
+    # Writes
+
+    def put(self, path: str, data: bytes) -> str:
+        """Store ``data`` under ``path`` (replacing any previous content); returns its SHA-256."""
+        key = _key(path)
+        # A flat byte view, not a copy: uploads arrive as bytearrays, encodes as arrays
+        data = memoryview(data).cast("B")
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._append_lock(), self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            previous = conn.execute("SELECT content_hash FROM names WHERE path = ?", (key,)).fetchone()
+            conn.execute("INSERT OR REPLACE INTO names (path, content_hash, created) VALUES (?, ?, ?)",
+                         (key, content_hash, time.time()))
+            if previous and previous[0] == content_hash:
+                return content_hash
+            known = conn.execute("SELECT 1 FROM blobs WHERE content_hash = ?", (content_hash,)).fetchone()
+            if not known:
+                segment, offset = self._append(data)
+                conn.execute("INSERT INTO blobs (content_hash, segment, offset, length, refs) VALUES (?, ?, ?, ?, 0)",
+                             (content_hash, segment, offset, len(data)))
+                self._add_totals(conn, blobs=1, indexed_bytes=len(data), segment_bytes=len(data))
+            conn.execute("UPDATE blobs SET refs = refs + 1 WHERE content_hash = ?", (content_hash,))
+            if conn.execute("SELECT refs FROM blobs WHERE content_hash = ?", (content_hash,)).fetchone()[0] == 1:
+                self._add_totals(conn, live_bytes=len(data))
+            if previous:
+                self._unreference(conn, previous[0])
+            else:
+                self._add_totals(conn, names=1)
+        return content_hash
+
+    def put_file(self, path: str, source: str = None):
+        """Pack the file at ``source`` (default: ``path`` itself) under ``path`` and delete the file."""
+        source = source or path
+        with open(source, "rb") as f:
+            self.put(path, f.read())
+        os.remove(source)
+
+    def delete(self, path: str) -> bool:
+        """Forget ``path``; its bytes are reclaimed by the next ``compact``."""
+        key = _key(path)
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            previous = conn.execute("SELECT content_hash FROM names WHERE path = ?", (key,)).fetchone()
+            deleted = conn.execute("DELETE FROM names WHERE path = ?", (key,)).rowcount
+            if previous:
+                self._unreference(conn, previous[0])
+                self._add_totals(conn, names=-1)
+        if os.path.isfile(key):
+            os.remove(key)
+            deleted = 1
+        return bool(deleted)
+
+    # Reads
+
+    def stat(self, path: str):
+        """``Artifact`` for ``path``, or None if it is neither packed nor a loose file."""
+        key = _key(path)
+        row = self._connect().execute('''
+            SELECT b.length, n.content_hash, n.created, b.segment, b.offset
+            FROM names n JOIN blobs b ON b.content_hash = n.content_hash
+            WHERE n.path = ?
+        ''', (key,)).fetchone()
+        if row:
+            return Artifact(key, *row)
+        if os.path.isfile(key):
+            info = os.stat(key)
+            return Artifact(key, info.st_size, f"{info.st_mtime_ns:x}-{info.st_size:x}", info.st_mtime, None, None)
+        return None
+
+    def exists(self, path: str) -> bool:
+        return self.stat(path) is not None
+
+    def read(self, path: str, start: int = 0, end: int = None) -> bytes:
+        """Bytes ``start:end`` of an artifact; raises FileNotFoundError if it does not exist."""
+        # A second lookup covers a segment compacted away between the index read and the map
+        for _ in range(2):
+            artifact = self.stat(path)
+            if artifact is None:
+                break
+            stop = artifact.size if end is None else min(end, artifact.size)
+            if stop <= start:
+                return b""
+            if artifact.segment is None:
+                with open(artifact.path, "rb") as f:
+                    f.seek(start)
+                    return f.read(stop - start)
+            try:
+                mapping = self._mapping(artifact.segment, artifact.offset + artifact.size)
+            except FileNotFoundError:
+                continue
+            return mapping[artifact.offset + start:artifact.offset + stop]
+        raise FileNotFoundError(path)
+
+    @contextmanager
+    def local_copy(self, path: str):
+        """A real file path with the artifact's content, for libraries that only open files."""
+        artifact = self.stat(path)
+        if artifact is None:
+            raise FileNotFoundError(path)
+        if artifact.segment is None:
+            yield artifact.path
+            return
+        fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(path)[1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.read(path))
+            yield tmp_path
+        finally:
+            os.remove(tmp_path)
+
+    # Maintenance
+
+    def apply_retention(self, days: float = RETENTION_DAYS, keep=()) -> int:
+        """Forget artifacts created more than ``days`` ago (0 keeps everything); returns the count.
+
+        Paths in ``keep`` are never expired; the CLI passes every path that
+        history, unfinished jobs or the face gallery still point at.
+        """
+        if days <= 0:
+            return 0
+        cutoff = time.time() - days * 86400
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("CREATE TEMP TABLE IF NOT EXISTS retained (path TEXT PRIMARY KEY)")
+            conn.execute("DELETE FROM retained")
+            conn.executemany("INSERT OR IGNORE INTO retained (path) VALUES (?)", ((_key(path),) for path in keep))
+            expired = conn.execute('''
+                SELECT content_hash FROM names
+                WHERE created < ? AND path NOT IN (SELECT path FROM retained)
+            ''', (cutoff,)).fetchall()
+            removed = conn.execute(
+                "DELETE FROM names WHERE created < ? AND path NOT IN (SELECT path FROM retained)", (cutoff,)
+            ).rowcount
+            for (content_hash,) in expired:
+                self._unreference(conn, content_hash)
+            self._add_totals(conn, names=-removed)
+            conn.execute("DELETE FROM retained")
+        return removed
+
+    def compact(self, min_live_ratio: float = COMPACT_LIVE_RATIO) -> dict:
+        """Drop unreferenced content and rewrite sealed segments less than ``min_live_ratio`` live.
+
+        Each segment is rewritten under the append lock, so writers wait for
+        at most one segment's copy.
+        """
+        with self._append_lock(), self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            forgotten, forgotten_bytes = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM blobs WHERE refs <= 0"
+            ).fetchone()
+            conn.execute("DELETE FROM blobs WHERE refs <= 0")
+            self._add_totals(conn, blobs=-forgotten, indexed_bytes=-forgotten_bytes)
+            live = dict(conn.execute("SELECT segment, SUM(length) FROM blobs GROUP BY segment").fetchall())
+
+        rewritten, reclaimed = 0, 0
+        for segment in self._segments()[:-1]:
+            path = self._segment_path(segment)
+            size = os.path.getsize(path)
+            if live.get(segment, 0) >= size * min_live_ratio:
+                continue
+            with self._append_lock():
+                with self._connect() as conn:
+                    rows = conn.execute("SELECT content_hash, offset, length FROM blobs WHERE segment = ? ORDER BY offset",
+                                        (segment,)).fetchall()
+                    with open(path, "rb") as f:
+                        for content_hash, offset, length in rows:
+                            f.seek(offset)
+                            moved = self._append(f.read(length))
+                            conn.execute("UPDATE blobs SET segment = ?, offset = ? WHERE content_hash = ?",
+                                         (*moved, content_hash))
+                    self._add_totals(conn, segment_bytes=sum(row[2] for row in rows) - size)
+                os.remove(path)
+            rewritten += 1
+            reclaimed += size - live.get(segment, 0)
+        return {"forgotten": forgotten, "segments_rewritten": rewritten, "bytes_reclaimed": reclaimed}
+
+    def import_loose(self, directories=ARTIFACT_AREAS) -> int:
+        """Pack the loose files under ``directories`` (written before the store existed)."""
+        packed = 0
+        for directory in directories:
+            for root, _, files in os.walk(directory):
+                for name in files:
+                    self.put_file(os.path.join(root, name))
+                    packed += 1
+        return packed
+
+    def stats(self) -> dict:
+        """Store totals, read from the running counters (cheap enough for every metrics scrape)."""
+        names, blobs, stored, referenced, segment_bytes = self._connect().execute(
+            "SELECT names, blobs, indexed_bytes, live_bytes, segment_bytes FROM store_totals WHERE id = 0"
+        ).fetchone()
+        return {
+            "artifacts": names,
+            "blobs": blobs,
+            "segments": len(self._segments()),
+            "segment_bytes": segment_bytes,
+            "indexed_bytes": stored,
+            "live_bytes": referenced
+        }
+
+
+# Shared store next to history.db
+artifact_store = ArtifactStore()
+
+
+if __name__ == "__main__":
+    import json
+
+    parser = argparse.ArgumentParser(description="Maintain the packed artifact store")
+    commands = parser.add_subparsers(dest="command", required=True)
+    compact = commands.add_parser("compact", help="apply retention and rewrite sparse segments")
+    compact.add_argument("--retention-days", type=float, default=RETENTION_DAYS,
+                         help="forget artifacts older than this (0 keeps everything)")
+    compact.add_argument("--min-live-ratio", type=float, default=COMPACT_LIVE_RATIO)
+    compact.add_argument("--interval", type=float, default=0, help="repeat every N seconds (0 runs once)")
+    commands.add_parser("import", help="pack loose files from uploads/, diffs/, cleaned/ and reports/")
+    commands.add_parser("stats", help="print store statistics")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        print(f"Packed {artifact_store.import_loose()} files")
+    elif args.command == "stats":
+        print(json.dumps(artifact_store.stats(), indent=2))
+    else:
+        from database import init_db, referenced_artifacts
+        from vector_index import gallery_image_paths
+
+        init_db()
+        while True:
+            keep = referenced_artifacts() | gallery_image_paths()
+            expired = artifact_store.apply_retention(args.retention_days, keep)
+            report = artifact_store.compact(args.min_live_ratio)
+            print(json.dumps({"expired": expired, **report}))
+            if args.interval <= 0:
+                break
+            time.sleep(args.interval)
@@ -0,0 +1,62 @@
+# backend/artifacts.py
+import hashlib
+import os
+
+from artifact_store import artifact_store
+from database import get_clean_result, get_comparison_result
+from lazy import LazyFunction
+
+# Pillow/fpdf are only imported once a report actually has to be rendered
+generate_report_image = LazyFunction("reports", "generate_report_image")
+generate_report_pdf = LazyFunction("reports", "generate_report_pdf")
+generate_clean_report_image = LazyFunction("reports", "generate_clean_report_image")
+generate_clean_report_pdf = LazyFunction("reports", "generate_clean_report_pdf")
+
+REPORT_FORMATS = ("png", "pdf")
+
+
+def artifact_path(directory: str, uid: str, filename: str) -> str:
+    """Name for an artifact in a two-level hashed shard, e.g. ``uploads/3f/a9/<filename>``.
+
+    The name is the artifact's key in ``artifact_store`` and, with a leading
+    slash, its URL; it is stored in history for later lookups. The shard
+    prefix dates from one-file-per-artifact storage and keeps old URLs stable.
+    """
+    digest = hashlib.sha1(uid.encode()).hexdigest()
+    return f"{directory}/{digest[:2]}/{digest[2:4]}/{os.path.basename(filename)}"
+
+
+def report_path(kind: str, artifact_id: str, format: str) -> str:
+    """Where the report for a comparison or clean id is rendered ("comparison" or "clean")."""
+    prefix = "report" if kind == "comparison" else "clean_report"
+    return artifact_path("reports", artifact_id, f"{prefix}_{artifact_id}.{format}")
+
+
+def render_report(kind: str, artifact_id: str, format: str = "png"):
+    """Render a report once and return its path, or None if the id has no history row.
+
+    The PDF embeds the PNG, so the PNG is rendered first when missing.
+    """
+    path = report_path(kind, artifact_id, format)
+    if artifact_store.exists(path):
+        return path
+    img_path = report_path(kind, artifact_id, "png")
+
+    if kind == "comparison":
+        result = get_comparison_result(artifact_id)
+        if not result:
+            return None
+        if not artifact_store.exists(img_path):
+            generate_report_image(result["img1_path"], result["img2_path"], result, img_path)
+        if format == "pdf" and artifact_store.exists(img_path):
+            generate_report_pdf(img_path, result, path)
+    else:
+        result = {"operation": "Unknown"}
+        if not artifact_store.exists(img_path):
+            paths = get_clean_result(artifact_id)
+            if not paths:
+                return None
+            generate_clean_report_image(paths["original_path"], paths["cleaned_path"], result, img_path)
+        if format == "pdf" and artifact_store.exists(img_path):
+            generate_clean_report_pdf(img_path, result, path)
+    return path
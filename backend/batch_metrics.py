@@ -0,0 +1,142 @@
+# backend/batch_metrics.py
+import cv2
+import numpy as np
+
+# skimage.metrics.structural_similarity defaults
+SSIM_WIN_SIZE = 7
+SSIM_K1 = 0.01
+SSIM_K2 = 0.03
+
+GOOD_MATCH_DISTANCE = 50
+
+
+SSIM_CHUNK = 8  # candidates per pass; keeps the float32 temporaries cache-sized
+
+
+def _window_means(images: np.ndarray) -> np.ndarray:
+    """Mean over every full 7x7 window of each (H, W) plane in an (N, H, W) stack.
+
+    The stack is filtered as one tall 2-D image. Only windows that lie fully
+    inside a plane are kept (the same crop skimage averages over), so
+    neighbouring planes and border handling never affect the result.
+    """
+    n, h, w = images.shape
+    pad = (SSIM_WIN_SIZE - 1) // 2
+    means = cv2.boxFilter(images.reshape(n * h, w), cv2.CV_32F, (SSIM_WIN_SIZE, SSIM_WIN_SIZE), normalize=True)
+    return means.reshape(n, h, w)[:, pad:-pad, pad:-pad]
+
+
+def batch_ssim(probe_gray: np.ndarray, grays: np.ndarray) -> np.ndarray:
+    """SSIM of one grayscale probe (H, W) against a stack (N, H, W).
+
+    Matches ``structural_similarity(probe, candidate, data_range=candidate.max() - candidate.min())``
+    for every pair to within float32 rounding. The probe's window statistics
+    are computed once; candidates are processed in chunks with in-place
+    arithmetic so the cost per pair is a few box filters and array passes.
+    """
+    if grays.shape[0] == 0:
+        return np.zeros(0)
+    f32 = np.float32
+    n = SSIM_WIN_SIZE ** 2
+    cov_norm = f32(n / (n - 1))
+
+    x = probe_gray.astype(f32)[None]
+    ux = _window_means(x)
+    ux_sq = ux * ux
+    vx = cov_norm * (_window_means(x * x) - ux_sq)
+
+    scores = []
+    for start in range(0, grays.shape[0], SSIM_CHUNK):
+        chunk = grays[start:start + SSIM_CHUNK]
+        data_range = (chunk.max(axis=(1, 2)).astype(f32) - chunk.min(axis=(1, 2)))[:, None, None]
+        c1 = (f32(SSIM_K1) * data_range) ** 2
+        c2 = (f32(SSIM_K2) * data_range) ** 2
+
+        y = chunk.astype(f32)
+        uy = _window_means(y)
+        uyy = _window_means(y * y)
+        uxy = _window_means(x * y)
+
+        # numerator: (2 ux uy + c1) (2 vxy + c2)
+        num = ux * uy
+        uxy -= num
+        uxy *= 2 * cov_norm
+        uxy += c2
+        num *= 2
+        num += c1
+        num *= uxy
+        # denominator: (ux^2 + uy^2 + c1) (vx + vy + c2)
+        uyy -= uy * uy
+        uyy *= cov_norm
+        uyy += vx
+        uyy += c2
+        uy *= uy
+        uy += ux_sq
+        uy += c1
+        uy *= uyy
+        with np.errstate(divide="ignore", invalid="ignore"):
+            num /= uy
+        scores.append(num.mean(axis=(1, 2), dtype=np.float64))
+    return np.nan_to_num(np.concatenate(scores), nan=0.0)
+
+
+def batch_psnr(probe: np.ndarray, images: np.ndarray) -> np.ndarray:
+    """PSNR (dB) of one uint8 probe against a stack of same-shaped uint8 images."""
+    if images.shape[0] == 0:
+        return np.zeros(0)
+    diff = images.astype(np.float64) - probe.astype(np.float64)
+    mse = (diff * diff).reshape(images.shape[0], -1).mean(axis=1)
+    with np.errstate(divide="ignore"):
+        return 10 * np.log10((255.0 ** 2) / mse)
+
+
+def pack_descriptors(descriptor_sets):
+    """Stack per-image ORB descriptors into one (M, 32) matrix plus segment offsets.
+
+    ``None`` (no keypoints) contributes an empty segment.
+    """
+    sizes = [0 if des is None else des.shape[0] for des in descriptor_sets]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    if offsets[-1] == 0:
+        return np.zeros((0, 32), np.uint8), offsets
+    packed = np.vstack([des for des in descriptor_sets if des is not None and des.shape[0]])
+    return packed, offsets
+
+
+def hamming_distances(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """All-pairs Hamming distance between binary descriptor rows of ``a`` and ``b``.
+
+    With descriptors unpacked to 0/1 bits, ``popcount(a ^ b) = |a| + |b| - 2 a.b``,
+    so the whole matrix is one float32 matrix product (exact for 256-bit rows).
+    """
+    a_bits = np.unpackbits(a, axis=1).astype(np.float32)
+    b_bits = np.unpackbits(b, axis=1).astype(np.float32)
+    dots = a_bits @ b_bits.T
+    return (a_bits.sum(axis=1)[:, None] + b_bits.sum(axis=1)[None, :] - 2 * dots).astype(np.uint16)
+
+
+def batch_feature_similarity(probe_des, packed: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """ORB match ratio of the probe against every packed candidate segment.
+
+    Equivalent to cross-checked ``BFMatcher(NORM_HAMMING)`` per pair: a match
+    is kept only when each descriptor is the other's nearest neighbour, and the
+    score is the share of kept matches closer than ``GOOD_MATCH_DISTANCE``.
+    """
+    count = offsets.shape[0] - 1
+    scores = np.zeros(count)
+    if probe_des is None or probe_des.shape[0] == 0 or packed.shape[0] == 0:
+        return scores
+
+    distances = hamming_distances(probe_des, packed)
+    for i in range(count):
+        start, end = offsets[i], offsets[i + 1]
+        if start == end:
+            continue
+        d = distances[:, start:end]
+        forward = d.argmin(axis=1)
+        backward = d.argmin(axis=0)
+        mutual = backward[forward] == np.arange(d.shape[0])
+        matched = d[np.arange(d.shape[0]), forward][mutual]
+        good = np.count_nonzero(matched < GOOD_MATCH_DISTANCE)
+        scores[i] = min(1.0, good / max(matched.shape[0], 1))
+    return scores
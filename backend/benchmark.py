@@ -0,0 +1,417 @@
+# backend/benchmark.py
+"""Benchmarks for the compare, clean and report paths.
+
+Function mode times each metric, cleaning operation and report generator on a
+synthetic corpus at several resolutions. Load mode drives the FastAPI app
+in-process with concurrent requests. Both run in a scratch directory, so the
+real history, caches and uploads are never touched. Run from the backend
+directory:
+
+    python benchmark.py --output results.json
+    python benchmark.py --suite compare --resolutions 640x480 --baseline results.json
+    python benchmark.py --load --endpoint compare --concurrency 8 --requests 200
+
+Results are written as JSON. With ``--baseline`` every case is compared with
+the same case in an earlier run; a p50 slowdown beyond ``--threshold`` is
+reported as a regression and makes the exit status 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+DEFAULT_RESOLUTIONS = "640x480,1280x960,2560x1920"
+SUITES = ("compare", "clean", "report")
+LOAD_ENDPOINTS = ("compare", "clean", "mixed")
+
+
+# Synthetic corpus
+
+def synthetic_image(width: int, height: int, seed: int) -> np.ndarray:
+    """Deterministic photo-like BGR image: gradient, shapes, texture and sensor noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([
+        120 + 80 * np.sin(x / width * np.pi * rng.uniform(1, 3)),
+        110 + 70 * np.cos(y / height * np.pi * rng.uniform(1, 3)),
+        100 + 60 * np.sin((x + y) / (width + height) * np.pi * 2)
+    ], axis=2)
+    img = base.astype(np.uint8)
+    scale = min(width, height)
+    for _ in range(12):
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        axes = (int(rng.integers(scale // 20, scale // 4)), int(rng.integers(scale // 20, scale // 4)))
+        cv2.ellipse(img, center, axes, float(rng.uniform(0, 180)), 0, 360, color, -1)
+    noise = rng.normal(0, 8, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def build_corpus(directory: str, resolutions, variants: int = 2):
+    """Write ``variants`` JPEGs per resolution; returns ``{resolution: [paths]}``."""
+    corpus = {}
+    for width, height in resolutions:
+        label = f"{width}x{height}"
+        paths = []
+        for variant in range(variants):
+            path = os.path.join(directory, f"corpus_{label}_{variant}.jpg")
+            cv2.imwrite(path, synthetic_image(width, height, seed=width * 31 + height * 17 + variant),
+                        [cv2.IMWRITE_JPEG_QUALITY, 90])
+            paths.append(path)
+        corpus[label] = paths
+    return corpus
+
+
+# Measurement
+
+class _RssSampler:
+    """Peak resident set size while a case runs, sampled from /proc on Linux.
+
+    Elsewhere it falls back to the process-wide ``ru_maxrss`` high-water mark.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+        self._page = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _rss(self):
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * self._page
+        except OSError:
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return usage if sys.platform == "darwin" else usage * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def _percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        "p50": round(float(np.percentile(samples, 50)), 3),
+        "p90": round(float(np.percentile(samples, 90)), 3),
+        "p99": round(float(np.percentile(samples, 99)), 3),
+        "mean": round(float(samples.mean()), 3),
+        "min": round(float(samples.min()), 3),
+        "max": round(float(samples.max()), 3)
+    }
+
+
+def measure(name, resolution, fn, iterations, warmup=1, setup=None):
+    """Time ``fn()`` and record latency percentiles, throughput, peak RSS and allocations.
+
+    ``setup`` runs untimed before every call (e.g. to empty a cache). The
+    allocation figures come from one extra untimed call under tracemalloc, so
+    tracing overhead never inflates the latencies; they cover Python and NumPy
+    allocations, not OpenCV's native buffers (those show up in peak RSS).
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+
+    latencies = []
+    with _RssSampler() as rss:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            if setup:
+                setup()
+            call_started = time.perf_counter()
+            fn()
+            latencies.append((time.perf_counter() - call_started) * 1000)
+        elapsed = time.perf_counter() - started
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        fn()
+        _, alloc_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "name": name,
+        "resolution": resolution,
+        "iterations": iterations,
+        "latency_ms": _percentiles(latencies),
+        "throughput_per_s": round(iterations / elapsed, 3),
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 2),
+        "alloc_peak_mb": round(alloc_peak / 2 ** 20, 3)
+    }
+    print(f"{name:<40} {resolution:>10}  p50 {result['latency_ms']['p50']:>10.2f} ms  "
+          f"p99 {result['latency_ms']['p99']:>10.2f} ms  {result['throughput_per_s']:>8.2f}/s  "
+          f"rss {result['peak_rss_mb']:>8.1f} MB  alloc {result['alloc_peak_mb']:>8.2f} MB")
+    return result
+
+
+# Function suites
+
+def run_functions(suites, corpus, iterations, warm_cache=False):
+    import utils
+    from embedding_cache import embedding_cache
+
+    # Face metrics are measured cold unless asked otherwise, so the model work is timed
+    reset = None if warm_cache else embedding_cache.clear
+    results = []
+    for resolution, (path1, path2) in corpus.items():
+        with open(path1, "rb") as f:
+            data1 = f.read()
+        with open(path2, "rb") as f:
+            data2 = f.read()
+        out_dir = os.path.dirname(path1)
+
+        if "compare" in suites:
+            ctx1, ctx2 = utils.load_image_context(data1), utils.load_image_context(data2)
+
+            def face():
+                ctx1._faces = ctx2._faces = None
+                utils.get_face_similarity(ctx1, ctx2)
+
+            def feature():
+                ctx1._orb = ctx2._orb = None
+                utils.get_feature_similarity(ctx1, ctx2)
+
+            cases = [
+                ("compare.get_face_similarity", face, reset),
+                ("compare.get_feature_similarity", feature, None),
+                ("compare.get_ssim_psnr", lambda: utils.get_ssim_psnr(ctx1, ctx2), None),
+                ("compare.compute_similarity_scores", lambda: utils.compute_similarity_scores(data1, data2), reset),
+                ("compare.compare_cascade", lambda: utils.compare_cascade(data1, data2), reset)
+            ]
+            for name, fn, setup in cases:
+                results.append(measure(name, resolution, fn, iterations, setup=setup))
+
+        if "clean" in suites:
+            for operation in utils.CLEAN_OPERATIONS:
+                output = os.path.join(out_dir, f"clean_{operation}_{resolution}.png")
+                # remove_bg reads cached face boxes; keep it cold like the face metrics
+                setup = reset if operation == "remove_bg" else None
+                results.append(measure(
+                    f"clean.{operation}", resolution,
+                    lambda operation=operation, output=output: utils.clean_image(operation, path1, output, 0.5),
+                    iterations, setup=setup
+                ))
+
+        if "report" in suites:
+            result = {"face_similarity": 81.5, "final_similarity": 72.25, "is_same_person": False}
+            report_png = os.path.join(out_dir, f"report_{resolution}.png")
+            report_pdf = os.path.join(out_dir, f"report_{resolution}.pdf")
+            clean_png = os.path.join(out_dir, f"clean_report_{resolution}.png")
+            clean_pdf = os.path.join(out_dir, f"clean_report_{resolution}.pdf")
+            cases = [
+                ("report.generate_report_image",
+                 lambda: utils.generate_report_image(path1, path2, result, report_png)),
+                ("report.generate_report_pdf",
+                 lambda: utils.generate_report_pdf(report_png, result, report_pdf)),
+                ("report.generate_clean_report_image",
+                 lambda: utils.generate_clean_report_image(path1, path2, {"operation": "enhance"}, clean_png)),
+                ("report.generate_clean_report_pdf",
+                 lambda: utils.generate_clean_report_pdf(clean_png, {"operation": "enhance"}, clean_pdf))
+            ]
+            for name, fn in cases:
+                results.append(measure(name, resolution, fn, iterations))
+    return results
+
+
+# Load mode
+
+async def _drive(app, endpoint, corpus, concurrency, total):
+    import httpx
+
+    payloads = [open(path, "rb").read() for paths in corpus.values() for path in paths]
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], {}
+
+    async def one(client, index):
+        kind = endpoint if endpoint != "mixed" else ("compare", "clean")[index % 2]
+        first = payloads[index % len(payloads)]
+        second = payloads[(index + 1) % len(payloads)]
+        if kind == "compare":
+            request = ("/api/compare", {"image1": ("a.jpg", first), "image2": ("b.jpg", second)}, {})
+        else:
+            request = ("/api/clean", {"image": ("a.jpg", first)}, {"operation": "sharpen"})
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.post(request[0], files=request[1], data=request[2])
+            latencies.append((time.perf_counter() - started) * 1000)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        started = time.perf_counter()
+        with _RssSampler() as rss:
+            await asyncio.gather(*(one(client, index) for index in range(total)))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed, rss.peak
+
+
+def run_load(endpoint, corpus, concurrency, total):
+    """Drive the app in-process through its ASGI interface (startup/shutdown included)."""
+    try:
+        import httpx  # noqa: F401
+    except ImportError:
+        raise SystemExit("Load mode needs httpx: pip install httpx")
+    # Jobs are not exercised here; keep the app from spawning queue workers
+    os.environ.setdefault("IMAGE_MATCH_JOB_WORKERS", "0")
+    import main
+
+    async def scenario():
+        await main.startup_event()
+        try:
+            # Requests before the models are warm would measure the load, not the app
+            while not main.worker_pool.status()["ready"]:
+                await asyncio.sleep(0.1)
+            return await _drive(main.app, endpoint, corpus, concurrency, total)
+        finally:
+            await main.shutdown_event()
+
+    latencies, statuses, elapsed, peak_rss = asyncio.run(scenario())
+    result = {
+        "name": f"load.{endpoint}",
+        "resolution": ",".join(corpus),
+        "iterations": total,
+        "concurrency": concurrency,
+        "latency_ms": _percentiles(latencies),
+        "throughput_per_s": round(total / elapsed, 3),
+        "peak_rss_mb": round(peak_rss / 2 ** 20, 2),
+        "status_codes": {str(code): count for code, count in sorted(statuses.items())}
+    }
+    print(f"{result['name']:<40} c={concurrency:<4} n={total:<6} p50 {result['latency_ms']['p50']:.2f} ms  "
+          f"p99 {result['latency_ms']['p99']:.2f} ms  {result['throughput_per_s']:.2f} req/s  "
+          f"status {result['status_codes']}")
+    return [result]
+
+
+# Baseline comparison
+
+def compare_with_baseline(results, baseline, threshold):
+    """Print p50/throughput changes against ``baseline``; returns the regressed cases."""
+    previous = {(r["name"], r["resolution"]): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\n{'case':<52} {'p50 before':>12} {'p50 now':>12} {'change':>9}")
+    for result in results:
+        key = (result["name"], result["resolution"])
+        if key not in previous:
+            continue
+        before = previous[key]["latency_ms"]["p50"]
+        now = result["latency_ms"]["p50"]
+        change = (now - before) / before if before else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append({"name": key[0], "resolution": key[1], "change": round(change, 4)})
+        print(f"{key[0] + ' @ ' + key[1]:<52} {before:>12.2f} {now:>12.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+def _parse_resolutions(value):
+    resolutions = []
+    for item in value.split(","):
+        width, height = item.lower().split("x")
+        resolutions.append((int(width), int(height)))
+    return resolutions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Image Match Pro benchmarks")
+    parser.add_argument("--suite", default=",".join(SUITES), help=f"comma-separated subset of {', '.join(SUITES)}")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="comma-separated WxH list")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--warm-cache", action="store_true", help="let face metrics hit the embedding cache")
+    parser.add_argument("--load", action="store_true", help="drive the API in-process instead of single functions")
+    parser.add_argument("--endpoint", choices=LOAD_ENDPOINTS, default="compare")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--output", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="p50 slowdown counted as a regression")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args(argv)
+
+    suites = [suite for suite in args.suite.split(",") if suite]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suite(s): {', '.join(sorted(unknown))}")
+    resolutions = _parse_resolutions(args.resolutions)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    # Everything the app writes (history, caches, uploads) lands in the scratch directory
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, backend_dir)
+    workdir = tempfile.mkdtemp(prefix="image-match-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        corpus = build_corpus(workdir, resolutions)
+        if args.load:
+            results = run_load(args.endpoint, corpus, args.concurrency, args.requests)
+        else:
+            from models import model_registry
+            model_registry.ensure_loaded()
+            results = run_functions(suites, corpus, args.iterations, args.warm_cache)
+    finally:
+        os.chdir(cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    from inference import INFERENCE_BACKEND
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "mode": "load" if args.load else "functions",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "inference": INFERENCE_BACKEND,
+            "iterations": args.iterations,
+            "resolutions": [f"{w}x{h}" for w, h in resolutions]
+        },
+        "results": results
+    }
+    if baseline is not None:
+        report["regressions"] = compare_with_baseline(results, baseline, args.threshold)
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {output}")
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
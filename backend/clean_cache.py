@@ -0,0 +1,145 @@
+# backend/clean_cache.py
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from artifact_store import artifact_store
+
+INTENSITY_STEP = 0.05
+
+
+def quantize_intensity(intensity: float) -> float:
+    """Snap intensity to ``INTENSITY_STEP`` so near-identical requests share one result."""
+    return round(round(float(intensity) / INTENSITY_STEP) * INTENSITY_STEP, 2)
+
+
+class CleanResultCache:
+    """Content-addressed index of cleaned images already stored.
+
+    Keys combine the SHA-256 of the source image, the operation list, the
+    quantised intensity, the processing mode, the output format and the
+    pipeline version, so a change to the cleaning code (a version bump) never
+    serves stale output. The images themselves stay in ``artifact_store`` under
+    the name the first request gave them. Once the indexed results exceed
+    ``max_disk_bytes`` the least recently used entries are dropped from the
+    index only: history rows and URLs already returned still point at them.
+    The running total lives in ``clean_totals`` so a put never re-sums the table.
+    """
+
+    def __init__(self, db_path="clean_cache.db", max_disk_bytes=None):
+        self.db_path = db_path
+        self.max_disk_bytes = max_disk_bytes or int(os.environ.get("IMAGE_MATCH_CLEAN_CACHE_BYTES", 1024 ** 3))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._schema_ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS clean_results (
+                    key TEXT PRIMARY KEY,
+                    path TEXT,
+                    size INTEGER,
+                    last_access REAL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_clean_results_access ON clean_results(last_access)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS clean_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    bytes INTEGER
+                )
+            ''')
+            conn.execute("INSERT OR IGNORE INTO clean_totals (id, bytes) "
+                         "SELECT 0, COALESCE(SUM(size), 0) FROM clean_results")
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    @staticmethod
+    def make_key(content_hash, operations, intensity, mode, output_format, version) -> str:
+        parts = [content_hash, "+".join(operations), f"{quantize_intensity(intensity):.2f}",
+                 mode, output_format, f"v{version}"]
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """Path of the cached result for ``key``, or None on a miss."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT path, size FROM clean_results WHERE key = ?", (key,)).fetchone()
+            if row and not artifact_store.exists(row[0]):
+                conn.execute("DELETE FROM clean_results WHERE key = ?", (key,))
+                conn.execute("UPDATE clean_totals SET bytes = bytes - ? WHERE id = 0", (row[1],))
+                conn.commit()
+                row = None
+            if row:
+                conn.execute("UPDATE clean_results SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+        finally:
+            conn.close()
+        self._count("hits" if row else "misses")
+        return row[0] if row else None
+
+    def put(self, key, path):
+        """Record a freshly written result and trim the cache back under its size limit."""
+        artifact = artifact_store.stat(path)
+        if artifact is None:
+            return
+        conn = self._connect()
+        try:
+            previous = conn.execute("SELECT size FROM clean_results WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO clean_results (key, path, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, path, artifact.size, time.time())
+            )
+            conn.execute("UPDATE clean_totals SET bytes = bytes + ? WHERE id = 0",
+                         (artifact.size - (previous[0] if previous else 0),))
+            self._evict(conn, keep=key)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _evict(self, conn, keep):
+        total = conn.execute("SELECT bytes FROM clean_totals WHERE id = 0").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        rows = conn.execute("SELECT key, size FROM clean_results WHERE key != ? ORDER BY last_access ASC", (keep,))
+        stale, freed = [], 0
+        for key, size in rows:
+            if total - freed <= self.max_disk_bytes:
+                break
+            stale.append((key,))
+            freed += size
+        conn.executemany("DELETE FROM clean_results WHERE key = ?", stale)
+        conn.execute("UPDATE clean_totals SET bytes = bytes - ? WHERE id = 0", (freed,))
+        with self._lock:
+            self.evictions += len(stale)
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        try:
+            entries = conn.execute("SELECT COUNT(*) FROM clean_results").fetchone()[0]
+            size = conn.execute("SELECT bytes FROM clean_totals WHERE id = 0").fetchone()[0]
+        finally:
+            conn.close()
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_disk_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+
+
+# Shared cache next to history.db
+clean_cache = CleanResultCache()
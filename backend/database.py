@@ -1,82 +1,463 @@
+import atexit
+import base64
+import os
+import queue
+import json
 import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 from datetime import datetime
 
+from metrics import observe, record_error, stage
+
+DB_PATH = "history.db"
+POOL_SIZE = 4
+POOL_TIMEOUT = 30  # seconds to wait for a free connection before failing the request
+WRITE_BATCH_SIZE = 100
+WRITE_BATCH_WAIT = 0.05  # seconds to wait for more entries before committing a batch
+FLUSH_TIMEOUT = 5  # seconds a reader waits for earlier queued rows before reading without them
+JOB_LEASE_SECONDS = 600  # a running job not finished by then is treated as abandoned
+JOB_RETRY_DELAY = 2  # seconds before the first retry; doubles with each attempt
+
+INSERT_SQL = '''
+    INSERT INTO history
+    (timestamp, type, img1_name, img2_name, face_similarity, final_score,
+     is_same_person, img1_path, img2_path, cleaned_path, comparison_id, clean_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def _open_connection():
+    conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+    # WAL lets readers proceed while the writer commits; NORMAL syncs on checkpoint, not every commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class _ConnectionPool:
+    """Fixed set of reusable SQLite connections shared by request handlers."""
+
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            if create:
+                conn = _open_connection()
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError("Timed out waiting for a database connection")
+        try:
+            yield conn
+        finally:
+            # A statement that failed after the implicit BEGIN must not leak its transaction
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+
+class _HistoryWriter:
+    """Background thread that commits queued history rows in batches.
+
+    ``save_entry`` only enqueues, so the request path never waits on a commit.
+    Every row gets an increasing sequence number; readers that must see their
+    own writes call ``flush``, which waits only for the rows queued before it,
+    not for the queue to drain, so steady write traffic cannot starve them.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._committed = 0
+        self._done = threading.Condition()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+                self._thread.start()
+
+    def put(self, row):
+        self.start()
+        # Numbered under the lock so queue order and sequence order agree
+        with self._lock:
+            self._queued += 1
+            self._queue.put((self._queued, row))
+
+    def flush(self, timeout=FLUSH_TIMEOUT) -> bool:
+        """Wait until every row queued before this call is committed; False on timeout."""
+        target = self._queued
+        if self._thread is None or not self._thread.is_alive():
+            return self._committed >= target
+        with self._done:
+            return self._done.wait_for(lambda: self._committed >= target, timeout)
+
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        conn = _open_connection()
+        try:
+            while True:
+                rows = [self._queue.get()]
+                while rows[-1] is not None and len(rows) < WRITE_BATCH_SIZE:
+                    try:
+                        rows.append(self._queue.get(timeout=WRITE_BATCH_WAIT))
+                    except queue.Empty:
+                        break
+                entries = [row for _, row in filter(None, rows)]
+                started = time.perf_counter()
+                try:
+                    if entries:
+                        with conn:
+                            conn.executemany(INSERT_SQL, entries)
+                        observe("db.write_batch", time.perf_counter() - started)
+                except Exception as e:
+                    record_error("db.write_batch")
+                    print(f"History write failed: {e}")
+                finally:
+                    # Failed rows count as done too, so readers never wait on them forever
+                    numbered = [item[0] for item in rows if item is not None]
+                    if numbered:
+                        with self._done:
+                            self._committed = numbered[-1]
+                            self._done.notify_all()
+                if rows[-1] is None:
+                    return
+        finally:
+            conn.close()
+
+
+_pool = _ConnectionPool()
+_writer = _HistoryWriter()
+
+
 def init_db():
-    conn = sqlite3.connect("history.db")
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT,
-            type TEXT,
-            img1_name TEXT,
-            img2_name TEXT,
-            face_similarity REAL,
-            final_score REAL,
-            is_same_person INTEGER,
-            img1_path TEXT,
-            img2_path TEXT,
-            cleaned_path TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    with _pool.connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT,
+                type TEXT,
+                img1_name TEXT,
+                img2_name TEXT,
+                face_similarity REAL,
+                final_score REAL,
+                is_same_person INTEGER,
+                img1_path TEXT,
+                img2_path TEXT,
+                cleaned_path TEXT,
+                comparison_id TEXT,
+                clean_id TEXT
+            )
+        ''')
+
+        # Older databases predate the artifact id columns
+        columns = [row[1] for row in c.execute("PRAGMA table_info(history)")]
+        for column in ("comparison_id", "clean_id"):
+            if column not in columns:
+                c.execute(f"ALTER TABLE history ADD COLUMN {column} TEXT")
+        if "comparison_id" not in columns:
+            _backfill_artifact_ids(c)
+
+        c.execute("CREATE INDEX IF NOT EXISTS idx_history_comparison_id ON history(comparison_id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_history_clean_id ON history(clean_id)")
+        # Keyset pagination walks these in (timestamp, id) order
+        c.execute("CREATE INDEX IF NOT EXISTS idx_history_time ON history(timestamp, id)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_history_type_time ON history(type, timestamp, id)")
+
+        # Durable job queue; artifact_id is the comparison_id/clean_id of the history row a job produced
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT,
+                params TEXT,
+                status TEXT,
+                priority INTEGER DEFAULT 0,
+                attempts INTEGER DEFAULT 0,
+                max_attempts INTEGER DEFAULT 3,
+                result TEXT,
+                error TEXT,
+                artifact_id TEXT,
+                worker TEXT,
+                created_at TEXT,
+                started_at TEXT,
+                finished_at TEXT,
+                run_after REAL,
+                lease_until REAL
+            )
+        ''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs(status, priority DESC, created_at)")
+        conn.commit()
+    _writer.start()
     print("Database initialized")
 
+def close_db():
+    """Commit any queued entries and release pooled connections."""
+    _writer.stop()
+    _pool.close()
+
+atexit.register(close_db)
+
+def _backfill_artifact_ids(c):
+    """Recover ids of legacy rows from their upload file names ("uploads/<id>_...")."""
+    rows = c.execute("SELECT id, type, img1_path FROM history WHERE img1_path IS NOT NULL").fetchall()
+    for row_id, entry_type, img1_path in rows:
+        artifact_id = os.path.basename(img1_path).split("_", 1)[0]
+        column = "comparison_id" if entry_type == "comparison" else "clean_id"
+        c.execute(f"UPDATE history SET {column} = ? WHERE id = ?", (artifact_id, row_id))
+
 def save_entry(data):
-    conn = sqlite3.connect("history.db")
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO history 
-        (timestamp, type, img1_name, img2_name, face_similarity, final_score, 
-         is_same_person, img1_path, img2_path, cleaned_path)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        datetime.now().isoformat(),
-        data.get('type', 'unknown'),
-        data.get('img1_name'),
-        data.get('img2_name'),
-        data.get('face_similarity', 0.0),
-        data.get('final_score', 0.0),
-        data.get('is_same_person', 0),
-        data.get('img1_path'),
-        data.get('img2_path'),
-        data.get('cleaned_path')
-    ))
-    conn.commit()
-    conn.close()
-
-def get_history():
-    conn = sqlite3.connect("history.db")
-    c = conn.cursor()
-    c.execute("SELECT * FROM history ORDER BY timestamp DESC LIMIT 50")
-    rows = c.fetchall()
-    conn.close()
-    return rows
+    with stage("db.save_entry"):
+        _writer.put((
+            datetime.now().isoformat(),
+            data.get('type', 'unknown'),
+            data.get('img1_name'),
+            data.get('img2_name'),
+            data.get('face_similarity', 0.0),
+            data.get('final_score', 0.0),
+            data.get('is_same_person', 0),
+            data.get('img1_path'),
+            data.get('img2_path'),
+            data.get('cleaned_path'),
+            data.get('comparison_id'),
+            data.get('clean_id')
+        ))
+
+def flush_entries():
+    """Wait (at most ``FLUSH_TIMEOUT``) until every entry queued so far is committed."""
+    return _writer.flush()
+
+def pending_entries():
+    """History rows queued but not yet committed."""
+    return _writer.backlog()
+
+HISTORY_COLUMNS = ("id", "timestamp", "type", "img1_name", "img2_name", "final_score", "comparison_id", "clean_id")
+
+def encode_history_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode()).decode()
+
+def decode_history_cursor(cursor):
+    """Return ``(timestamp, id)`` from a cursor; raises ValueError if malformed."""
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return timestamp, int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def get_history(limit=50, cursor=None, entry_type=None, since=None, until=None,
+                min_score=None, max_score=None):
+    """One page of history, newest first, using keyset pagination.
+
+    ``cursor`` is the ``next_cursor`` of the previous page; ``since``/``until``
+    are ISO timestamps and the scores are final_score fractions (0-1).
+    Returns ``(entries, next_cursor)`` where ``next_cursor`` is None on the last page.
+    """
+    clauses, params = [], []
+    if cursor:
+        timestamp, row_id = decode_history_cursor(cursor)
+        clauses.append("(timestamp, id) < (?, ?)")
+        params += [timestamp, row_id]
+    if entry_type:
+        clauses.append("type = ?")
+        params.append(entry_type)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(until)
+    if min_score is not None:
+        clauses.append("final_score >= ?")
+        params.append(min_score)
+    if max_score is not None:
+        clauses.append("final_score <= ?")
+        params.append(max_score)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+    flush_entries()
+    with stage("db.history"), _pool.connection() as conn:
+        rows = conn.execute(
+            f"SELECT {', '.join(HISTORY_COLUMNS)} FROM history {where} "
+            "ORDER BY timestamp DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+
+    entries = [dict(zip(HISTORY_COLUMNS, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = entries[-1]
+        next_cursor = encode_history_cursor(last["timestamp"], last["id"])
+    return entries, next_cursor
 
 def get_comparison_result(comparison_id):
-    conn = sqlite3.connect("history.db")
-    c = conn.cursor()
-    c.execute("SELECT face_similarity, final_score, is_same_person FROM history WHERE id = ? AND type = 'comparison'", (comparison_id,))
-    row = c.fetchone()
-    conn.close()
+    flush_entries()
+    with _pool.connection() as conn:
+        row = conn.execute("SELECT face_similarity, final_score, is_same_person, img1_path, img2_path FROM history WHERE comparison_id = ? AND type = 'comparison'", (comparison_id,)).fetchone()
     if row:
         return {
             "face_similarity": round(row[0] * 100, 2),
             "final_similarity": round(row[1] * 100, 2),
-            "is_same_person": bool(row[2])
+            "is_same_person": bool(row[2]),
+            "img1_path": row[3],
+            "img2_path": row[4]
         }
     return None
 
 def get_clean_result(clean_id):
-    conn = sqlite3.connect("history.db")
-    c = conn.cursor()
-    c.execute("SELECT img1_path, cleaned_path FROM history WHERE id = ? AND type = 'cleaning'", (clean_id,))
-    row = c.fetchone()
-    conn.close()
+    flush_entries()
+    with _pool.connection() as conn:
+        row = conn.execute("SELECT img1_path, cleaned_path FROM history WHERE clean_id = ? AND type = 'cleaning'", (clean_id,)).fetchone()
     if row:
         return {
             "original_path": row[0],
             "cleaned_path": row[1]
         }
-    return None
\ No newline at end of file
+    return None
+
+# Job parameters that name stored uploads
+JOB_ARTIFACT_PARAMS = ("upload_path", "img1_path", "img2_path")
+
+def referenced_artifacts():
+    """Every stored path a history row or an unfinished job points at.
+
+    History reports are rendered from these, and queued or running jobs read
+    their uploads when they run, so none of them may expire.
+    """
+    flush_entries()
+    with _pool.connection() as conn:
+        rows = conn.execute(
+            "SELECT img1_path FROM history UNION SELECT img2_path FROM history UNION SELECT cleaned_path FROM history"
+        ).fetchall()
+        jobs = conn.execute("SELECT params FROM jobs WHERE status IN ('queued', 'running')").fetchall()
+    paths = {row[0] for row in rows if row[0]}
+    for (params,) in jobs:
+        params = json.loads(params)
+        paths.update(params[key] for key in JOB_ARTIFACT_PARAMS if params.get(key))
+    return paths
+
+# JOB QUEUE
+JOB_COLUMNS = ("id", "kind", "status", "priority", "attempts", "max_attempts", "result", "error",
+               "artifact_id", "created_at", "started_at", "finished_at")
+
+def enqueue_job(kind, params, priority=0, max_attempts=3):
+    """Queue a job and return its id; higher ``priority`` runs first."""
+    job_id = uuid.uuid4().hex[:12]
+    with _pool.connection() as conn:
+        conn.execute('''
+            INSERT INTO jobs (id, kind, params, status, priority, attempts, max_attempts, created_at, run_after)
+            VALUES (?, ?, ?, 'queued', ?, 0, ?, ?, ?)
+        ''', (job_id, kind, json.dumps(params), priority, max_attempts, datetime.now().isoformat(), time.time()))
+        conn.commit()
+    return job_id
+
+def claim_job(worker):
+    """Atomically take the next runnable job, or return None.
+
+    Runnable means queued and past its retry delay, or running with an expired
+    lease (its worker died). An abandoned job that already used all its
+    attempts is marked failed instead of being handed out again.
+    """
+    with _pool.connection() as conn:
+        while True:
+            now = time.time()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute('''
+                    SELECT id, kind, params, status, attempts, max_attempts FROM jobs
+                    WHERE (status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_until < ?)
+                    ORDER BY priority DESC, created_at LIMIT 1
+                ''', (now, now)).fetchone()
+                if row is None:
+                    conn.commit()
+                    return None
+                job_id, kind, params, status, attempts, max_attempts = row
+                if status == "running" and attempts >= max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                        ("Worker lost while running the job", datetime.now().isoformat(), job_id)
+                    )
+                    conn.commit()
+                    continue
+                conn.execute('''
+                    UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?,
+                                    started_at = ?, lease_until = ?
+                    WHERE id = ?
+                ''', (worker, datetime.now().isoformat(), now + JOB_LEASE_SECONDS, job_id))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            return {"id": job_id, "kind": kind, "params": json.loads(params), "attempt": attempts + 1}
+
+def finish_job(job_id, result=None, error=None):
+    """Record a job outcome; a failure is retried with backoff until ``max_attempts``."""
+    with _pool.connection() as conn:
+        if error is None:
+            artifact_id = (result or {}).get("comparison_id") or (result or {}).get("clean_id")
+            conn.execute('''
+                UPDATE jobs SET status = 'done', result = ?, error = NULL, artifact_id = ?, finished_at = ?
+                WHERE id = ?
+            ''', (json.dumps(result), artifact_id, datetime.now().isoformat(), job_id))
+        else:
+            attempts, max_attempts = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if attempts < max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', error = ?, run_after = ? WHERE id = ?",
+                    (error, time.time() + JOB_RETRY_DELAY * 2 ** (attempts - 1), job_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                    (error, datetime.now().isoformat(), job_id)
+                )
+        conn.commit()
+
+def get_job(job_id):
+    with _pool.connection() as conn:
+        row = conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(zip(JOB_COLUMNS, row))
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def job_counts():
+    """Number of jobs per status, e.g. ``{"queued": 3, "running": 1}``."""
+    with _pool.connection() as conn:
+        return dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
@@ -0,0 +1,163 @@
+# backend/embedding_cache.py
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from inference import INFERENCE_BACKEND
+
+# A disk hit only rewrites ``last_access`` when the stored value is older than
+# this many seconds, so repeated lookups stay reads instead of write locks
+ACCESS_RESOLUTION = 60
+
+
+class FaceEmbeddingCache:
+    """Content-addressed store of detected faces and their Facenet512 embeddings.
+
+    Entries are keyed by the SHA-256 of the image content. A small in-memory LRU
+    sits in front of a SQLite table; the table is trimmed back under
+    ``max_disk_bytes`` by evicting the least recently used rows, with the
+    running total kept in ``embedding_totals``. Recency on disk is tracked to
+    ``ACCESS_RESOLUTION`` seconds.
+    """
+
+    def __init__(self, db_path="embeddings.db", memory_items=256, max_disk_bytes=256 * 1024 * 1024):
+        self.db_path = db_path
+        self.memory_items = memory_items
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        if not self._schema_ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS face_embeddings (
+                    content_hash TEXT PRIMARY KEY,
+                    facial_areas TEXT,
+                    embeddings BLOB,
+                    size INTEGER,
+                    last_access REAL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_face_embeddings_access ON face_embeddings(last_access)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS embedding_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    bytes INTEGER
+                )
+            ''')
+            conn.execute("INSERT OR IGNORE INTO embedding_totals (id, bytes) "
+                         "SELECT 0, COALESCE(SUM(size), 0) FROM face_embeddings")
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    def _remember(self, content_hash, faces):
+        with self._lock:
+            self._memory[content_hash] = faces
+            self._memory.move_to_end(content_hash)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+
+    def get(self, content_hash):
+        """Return the cached faces for ``content_hash`` or None on a miss."""
+        with self._lock:
+            faces = self._memory.get(content_hash)
+            if faces is not None:
+                self._memory.move_to_end(content_hash)
+                return faces
+
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT facial_areas, embeddings, last_access FROM face_embeddings WHERE content_hash = ?",
+                (content_hash,)
+            ).fetchone()
+            if not row:
+                return None
+            now = time.time()
+            if now - (row[2] or 0) >= ACCESS_RESOLUTION:
+                conn.execute(
+                    "UPDATE face_embeddings SET last_access = ? WHERE content_hash = ?",
+                    (now, content_hash)
+                )
+                conn.commit()
+        finally:
+            conn.close()
+
+        areas = json.loads(row[0])
+        vectors = np.frombuffer(row[1], dtype=np.float32).reshape(len(areas), -1) if areas else []
+        faces = [
+            {"facial_area": area, "embedding": vector}
+            for area, vector in zip(areas, vectors)
+        ]
+        self._remember(content_hash, faces)
+        return faces
+
+    def put(self, content_hash, faces):
+        """Store faces (dicts with ``facial_area`` and ``embedding``) for ``content_hash``."""
+        faces = [
+            {"facial_area": face["facial_area"], "embedding": np.asarray(face["embedding"], dtype=np.float32)}
+            for face in faces
+        ]
+        self._remember(content_hash, faces)
+
+        areas = json.dumps([face["facial_area"] for face in faces])
+        blob = b"".join(face["embedding"].tobytes() for face in faces)
+        size = len(areas) + len(blob)
+        conn = self._connect()
+        try:
+            previous = conn.execute("SELECT size FROM face_embeddings WHERE content_hash = ?",
+                                    (content_hash,)).fetchone()
+            conn.execute('''
+                INSERT OR REPLACE INTO face_embeddings
+                (content_hash, facial_areas, embeddings, size, last_access)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (content_hash, areas, blob, size, time.time()))
+            conn.execute("UPDATE embedding_totals SET bytes = bytes + ? WHERE id = 0",
+                         (size - (previous[0] if previous else 0),))
+            self._evict(conn, keep=content_hash)
+            conn.commit()
+        finally:
+            conn.close()
+        return faces
+
+    def clear(self):
+        """Drop every cached entry (memory and disk)."""
+        with self._lock:
+            self._memory.clear()
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM face_embeddings")
+            conn.execute("UPDATE embedding_totals SET bytes = 0 WHERE id = 0")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _evict(self, conn, keep):
+        total = conn.execute("SELECT bytes FROM embedding_totals WHERE id = 0").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        rows = conn.execute(
+            "SELECT content_hash, size FROM face_embeddings WHERE content_hash != ? ORDER BY last_access ASC",
+            (keep,)
+        )
+        stale, freed = [], 0
+        for content_hash, size in rows:
+            if total - freed <= self.max_disk_bytes:
+                break
+            stale.append((content_hash,))
+            freed += size
+        conn.executemany("DELETE FROM face_embeddings WHERE content_hash = ?", stale)
+        conn.execute("UPDATE embedding_totals SET bytes = bytes - ? WHERE id = 0", (freed,))
+
+
+# Shared cache next to history.db; embeddings from different backends never mix
+embedding_cache = FaceEmbeddingCache(
+    "embeddings.db" if INFERENCE_BACKEND == "deepface" else f"embeddings_{INFERENCE_BACKEND}.db"
+)
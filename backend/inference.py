@@ -0,0 +1,296 @@
+# backend/inference.py
+"""Face detection and embedding backends used by ``ModelRegistry``.
+
+Selected with IMAGE_MATCH_INFERENCE:
+  deepface  RetinaFace and Facenet512 through DeepFace/TensorFlow (default)
+  onnx      YuNet through OpenCV's DNN module and an exported Facenet512
+            (optionally int8-quantized) through onnxruntime, CPU only
+
+Other settings:
+  IMAGE_MATCH_EMBEDDER_MODEL     Facenet512 ONNX file (default weights/facenet512.onnx)
+  IMAGE_MATCH_DETECTOR_MODEL     YuNet ONNX file (default weights/face_detection_yunet_2023mar.onnx)
+  IMAGE_MATCH_INFERENCE_THREADS  onnxruntime intra-op threads (default 0: one per core)
+  IMAGE_MATCH_EMBED_BATCH        faces per embedding forward pass (default 64)
+
+Tools (from the backend directory; both need the deepface stack installed and
+``export`` also needs tf2onnx):
+
+    python inference.py export --quantize
+    python inference.py check --images path/to/faces
+"""
+import argparse
+import glob
+import os
+import threading
+import time
+from collections import namedtuple
+
+import numpy as np
+
+WEIGHTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "weights")
+INFERENCE_BACKEND = os.environ.get("IMAGE_MATCH_INFERENCE", "deepface")
+EMBEDDER_MODEL_PATH = os.environ.get("IMAGE_MATCH_EMBEDDER_MODEL", os.path.join(WEIGHTS_DIR, "facenet512.onnx"))
+DETECTOR_MODEL_PATH = os.environ.get("IMAGE_MATCH_DETECTOR_MODEL",
+                                     os.path.join(WEIGHTS_DIR, "face_detection_yunet_2023mar.onnx"))
+INFERENCE_THREADS = int(os.environ.get("IMAGE_MATCH_INFERENCE_THREADS", 0))
+EMBED_BATCH_SIZE = int(os.environ.get("IMAGE_MATCH_EMBED_BATCH", 64))
+FACE_SIZE = (160, 160)
+DETECTION_THRESHOLD = 0.9
+
+FacialArea = namedtuple("FacialArea", "x y w h")
+DetectedFace = namedtuple("DetectedFace", "img facial_area confidence")
+
+
+def fit_face(face: np.ndarray, size=FACE_SIZE) -> np.ndarray:
+    """Scale a face crop into ``size`` keeping its aspect ratio, zero-padded, as float32 in [0, 1].
+
+    Same result as deepface's ``preprocessing.resize_image`` without the batch axis.
+    """
+    import cv2
+    factor = min(size[0] / face.shape[0], size[1] / face.shape[1])
+    face = cv2.resize(face, (int(face.shape[1] * factor), int(face.shape[0] * factor)))
+    pad_h, pad_w = size[0] - face.shape[0], size[1] - face.shape[1]
+    face = np.pad(face, ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2), (0, 0)), "constant")
+    if face.shape[:2] != size:
+        face = cv2.resize(face, (size[1], size[0]))
+    face = face.astype(np.float32)
+    return face / 255.0 if face.max() > 1 else face
+
+
+def _align_crop(bgr: np.ndarray, area: FacialArea, right_eye, left_eye) -> np.ndarray:
+    """Crop ``area`` after rotating its neighbourhood so the eyes are level."""
+    import cv2
+    height, width = bgr.shape[:2]
+    margin = max(area.w, area.h) // 2
+    x0, y0 = max(area.x - margin, 0), max(area.y - margin, 0)
+    x1, y1 = min(area.x + area.w + margin, width), min(area.y + area.h + margin, height)
+    region = bgr[y0:y1, x0:x1]
+    angle = np.degrees(np.arctan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0]))
+    center = ((right_eye[0] + left_eye[0]) / 2 - x0, (right_eye[1] + left_eye[1]) / 2 - y0)
+    rotated = cv2.warpAffine(region, cv2.getRotationMatrix2D(center, angle, 1.0), (region.shape[1], region.shape[0]))
+    return rotated[area.y - y0:area.y - y0 + area.h, area.x - x0:area.x - x0 + area.w]
+
+
+class DeepFaceBackend:
+    """RetinaFace and Facenet512 through DeepFace (TensorFlow)."""
+
+    name = "deepface"
+    detector_name = "retinaface"
+    embedder_name = "Facenet512"
+
+    def __init__(self):
+        self.embedder = None
+        self.detector = None
+
+    def load(self):
+        from deepface import DeepFace
+        self.embedder = DeepFace.build_model(self.embedder_name)
+        self.detector = DeepFace.build_model(self.detector_name, task="face_detector")
+
+    def detect(self, bgr: np.ndarray):
+        from deepface.modules import detection
+        return detection.detect_faces(detector_backend=self.detector_name, img=bgr, align=True)
+
+    def embed(self, faces_bgr) -> np.ndarray:
+        from deepface.modules import preprocessing
+        batch = np.vstack([
+            preprocessing.resize_image(face, self.embedder.input_shape)
+            for face in faces_bgr
+        ])
+        return np.asarray(self.embedder.model(batch, training=False), dtype=np.float32)
+
+    def info(self) -> dict:
+        return {}
+
+
+class OnnxBackend:
+    """YuNet (OpenCV DNN) and an exported Facenet512 (onnxruntime) on the CPU.
+
+    The embedder takes ``(batch, 160, 160, 3)`` float input, as written by
+    ``python inference.py export``. Sessions are thread-safe; each thread gets
+    its own YuNet instance since it keeps the input size as state.
+    """
+
+    name = "onnx"
+    detector_name = "yunet"
+    embedder_name = "Facenet512"
+
+    def __init__(self, embedder_path=EMBEDDER_MODEL_PATH, detector_path=DETECTOR_MODEL_PATH,
+                 threads=INFERENCE_THREADS):
+        self.embedder_path = embedder_path
+        self.detector_path = detector_path
+        self.threads = threads
+        self.session = None
+        self._input_name = None
+        self._local = threading.local()
+
+    def load(self):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("IMAGE_MATCH_INFERENCE=onnx requires the onnxruntime package")
+        for path in (self.embedder_path, self.detector_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Model file not found: {path}")
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(self.embedder_path, options, providers=["CPUExecutionProvider"])
+        self._input_name = self.session.get_inputs()[0].name
+
+    def _detector(self):
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            import cv2
+            detector = cv2.FaceDetectorYN.create(self.detector_path, "", (320, 320), DETECTION_THRESHOLD, 0.3, 5000)
+            self._local.detector = detector
+        return detector
+
+    def detect(self, bgr: np.ndarray):
+        height, width = bgr.shape[:2]
+        detector = self._detector()
+        detector.setInputSize((width, height))
+        _, rows = detector.detect(bgr)
+        faces = []
+        # Each row: box, right eye, left eye, nose, mouth corners, score
+        for row in rows if rows is not None else []:
+            x, y = max(int(row[0]), 0), max(int(row[1]), 0)
+            w, h = min(int(row[2]), width - x), min(int(row[3]), height - y)
+            if w <= 0 or h <= 0:
+                continue
+            area = FacialArea(x, y, w, h)
+            faces.append(DetectedFace(_align_crop(bgr, area, row[4:6], row[6:8]), area, float(row[14])))
+        return faces
+
+    def embed(self, faces_bgr) -> np.ndarray:
+        batch = np.stack([fit_face(face) for face in faces_bgr])
+        return np.asarray(self.session.run(None, {self._input_name: batch})[0], dtype=np.float32)
+
+    def info(self) -> dict:
+        return {
+            "embedder_model": os.path.basename(self.embedder_path),
+            "detector_model": os.path.basename(self.detector_path),
+            "threads": self.threads or os.cpu_count()
+        }
+
+
+INFERENCE_BACKENDS = {
+    "deepface": DeepFaceBackend,
+    "onnx": OnnxBackend
+}
+
+
+def create_backend(name: str = INFERENCE_BACKEND):
+    if name not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend: {name}. Choose from: {', '.join(INFERENCE_BACKENDS)}")
+    return INFERENCE_BACKENDS[name]()
+
+
+# TOOLS
+
+def export_embedder(output_path: str, quantize: bool = False):
+    """Export DeepFace's Facenet512 to ONNX with a dynamic batch axis, plus an int8 copy if asked."""
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    model = DeepFace.build_model("Facenet512").model
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    spec = (tf.TensorSpec((None, FACE_SIZE[0], FACE_SIZE[1], 3), tf.float32, name="input"),)
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=output_path)
+    print(f"Wrote {output_path}")
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        root, extension = os.path.splitext(output_path)
+        quantized_path = f"{root}.int8{extension}"
+        quantize_dynamic(output_path, quantized_path, weight_type=QuantType.QInt8)
+        print(f"Wrote {quantized_path} (set IMAGE_MATCH_EMBEDDER_MODEL to use it)")
+
+
+def _cosine_similarity(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-12)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-12)
+    return np.sum(a * b, axis=1)
+
+
+def check_accuracy(image_dir: str, candidate, reference=None, limit: int = 200) -> dict:
+    """Compare ``candidate`` embeddings with the DeepFace path on the images in ``image_dir``.
+
+    Both backends embed the same face crops (from the reference detector), so
+    the cosine similarities measure the embedder alone. Detection agreement is
+    reported separately as the share of images where both find the same
+    number of faces. The same-person verdicts of every image pair are compared
+    at the cosine threshold the compare endpoint effectively uses.
+    """
+    import cv2
+
+    reference = reference or DeepFaceBackend()
+    reference.load()
+    candidate.load()
+    paths = sorted(
+        path for path in glob.glob(os.path.join(image_dir, "**", "*"), recursive=True)
+        if path.lower().endswith((".jpg", ".jpeg", ".png", ".bmp", ".webp"))
+    )[:limit]
+
+    crops, same_count, timings = [], 0, {"reference_ms": 0.0, "candidate_ms": 0.0}
+    for path in paths:
+        bgr = cv2.imread(path)
+        if bgr is None:
+            continue
+        faces = reference.detect(bgr)
+        same_count += len(faces) == len(candidate.detect(bgr))
+        crops.extend(face.img for face in faces[:1])
+    if not crops:
+        raise ValueError(f"No faces found in {image_dir}")
+
+    embeddings = {}
+    for label, backend in (("reference", reference), ("candidate", candidate)):
+        started = time.perf_counter()
+        embeddings[label] = np.vstack([
+            backend.embed(crops[start:start + EMBED_BATCH_SIZE])
+            for start in range(0, len(crops), EMBED_BATCH_SIZE)
+        ])
+        timings[f"{label}_ms"] = round((time.perf_counter() - started) * 1000 / len(crops), 2)
+
+    cosine = _cosine_similarity(embeddings["reference"], embeddings["candidate"])
+    pair_index = np.triu_indices(len(crops), 1)
+    verdicts = {}
+    for label, vectors in embeddings.items():
+        normed = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        verdicts[label] = (normed @ normed.T)[pair_index] > 0.5
+    return {
+        "images": len(paths),
+        "faces": len(crops),
+        "embedding_cosine": {
+            "mean": round(float(cosine.mean()), 5),
+            "min": round(float(cosine.min()), 5),
+            "p5": round(float(np.percentile(cosine, 5)), 5)
+        },
+        "verdict_agreement": round(float(np.mean(verdicts["reference"] == verdicts["candidate"])), 4) if len(crops) > 1 else None,
+        "detection_count_agreement": round(same_count / max(len(paths), 1), 4),
+        "embed_ms_per_face": timings
+    }
+
+
+if __name__ == "__main__":
+    import json
+
+    parser = argparse.ArgumentParser(description="Export and check the ONNX face embedder")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="export Facenet512 from DeepFace to ONNX")
+    export.add_argument("--output", default=os.path.join(WEIGHTS_DIR, "facenet512.onnx"))
+    export.add_argument("--quantize", action="store_true", help="also write an int8 dynamically quantized copy")
+    check = commands.add_parser("check", help="compare ONNX embeddings with the DeepFace path")
+    check.add_argument("--images", required=True, help="directory of face images")
+    check.add_argument("--embedder", default=EMBEDDER_MODEL_PATH)
+    check.add_argument("--detector", default=DETECTOR_MODEL_PATH)
+    check.add_argument("--threads", type=int, default=INFERENCE_THREADS)
+    check.add_argument("--limit", type=int, default=200, help="maximum number of images")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_embedder(args.output, args.quantize)
+    else:
+        report = check_accuracy(args.images, OnnxBackend(args.embedder, args.detector, args.threads), limit=args.limit)
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,114 @@
+# backend/ingest.py
+"""Bounded reads of uploaded images.
+
+Uploads are read in chunks and hashed on the way in; the read stops as soon as
+``MAX_UPLOAD_BYTES`` is exceeded instead of trusting the client-declared size.
+The image header is checked before any pixel decode, so a small file that
+would expand into a huge bitmap (a decompression bomb) is refused up front.
+"""
+import hashlib
+import io
+import os
+import warnings
+
+from PIL import Image
+
+MAX_UPLOAD_BYTES = int(os.environ.get("IMAGE_MATCH_MAX_UPLOAD_BYTES", 2_000_000))
+MAX_IMAGE_PIXELS = int(os.environ.get("IMAGE_MATCH_MAX_PIXELS", 40_000_000))
+MAX_IMAGE_SIDE = int(os.environ.get("IMAGE_MATCH_MAX_SIDE", 12_000))
+READ_CHUNK_BYTES = 256 * 1024
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload exceeds ``MAX_UPLOAD_BYTES``."""
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image's declared dimensions exceed the pixel or side limits."""
+
+
+class _BufferReader(io.RawIOBase):
+    """Seekable read-only stream over any buffer; ``io.BytesIO`` copies anything but bytes."""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        chunk = self._view[self._position:self._position + len(b)]
+        b[:len(chunk)] = chunk
+        self._position += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+def check_dimensions(data: bytes):
+    """Validate the header-declared size of an encoded image without decoding pixels.
+
+    Returns ``(width, height)``, or None when Pillow cannot parse the header;
+    ``decode_image`` refuses such bytes, since their size was never checked.
+    """
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+            with Image.open(_BufferReader(data)) as img:
+                width, height = img.size
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError("Image dimensions are too large")
+    except Exception:
+        return None
+    if width * height > MAX_IMAGE_PIXELS or max(width, height) > MAX_IMAGE_SIDE:
+        raise ImageTooLargeError(
+            f"Image dimensions are too large (max {MAX_IMAGE_SIDE}px per side, {MAX_IMAGE_PIXELS // 1_000_000}MP)"
+        )
+    return width, height
+
+
+async def read_upload(upload, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Read an UploadFile in chunks, hashing as it goes; returns ``(data, sha256 hex)``.
+
+    ``data`` is the bytearray the chunks were collected in, handed over
+    without a final copy. Raises UploadTooLargeError once more than ``max_bytes`` arrive and
+    ImageTooLargeError if the header declares oversized dimensions.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLargeError(f"{upload.filename} exceeds {max_bytes} bytes")
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        if len(buffer) + len(chunk) > max_bytes:
+            raise UploadTooLargeError(f"{upload.filename} exceeds {max_bytes} bytes")
+        digest.update(chunk)
+        buffer += chunk
+    check_dimensions(buffer)
+    return buffer, digest.hexdigest()
+
+
+def read_member(archive, info, max_bytes: int = MAX_UPLOAD_BYTES) -> bytes:
+    """Decompress one ZIP member, stopping at ``max_bytes`` whatever its header claims.
+
+    Raises the same errors as ``read_upload``.
+    """
+    with archive.open(info) as f:
+        data = f.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise UploadTooLargeError(f"{info.filename} exceeds {max_bytes} bytes")
+    check_dimensions(data)
+    return data
+
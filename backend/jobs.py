@@ -0,0 +1,198 @@
+# backend/jobs.py
+"""Background job workers for the durable queue in ``database.py``.
+
+Run standalone workers next to the API (from the backend directory):
+
+    python jobs.py --workers 4
+
+or let the API start ``IMAGE_MATCH_JOB_WORKERS`` local worker processes.
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import time
+import traceback
+import uuid
+
+from artifact_store import artifact_store
+from artifacts import artifact_path, render_report
+from clean_cache import clean_cache, quantize_intensity
+from database import init_db, save_entry, flush_entries, claim_job, finish_job
+from lazy import LazyFunction
+from options import blend_scores, CLEAN_OUTPUT_EXTENSIONS, CLEAN_PIPELINE_VERSION, DEFAULT_CLEAN_MODE
+from upload_index import upload_index
+
+# Imported by the worker that first runs each kind, not by the API importing this module
+clean_pipeline = LazyFunction("utils", "clean_pipeline")
+score_pair = LazyFunction("utils", "score_pair")
+
+JOB_KINDS = ("clean", "compare", "report")
+POLL_INTERVAL = 0.5
+
+
+def _run_clean(params):
+    uid = str(uuid.uuid4())[:8]
+    operations = params["operations"]
+    output_format = params.get("output_format", "png")
+    mode = params.get("mode")
+    intensity = quantize_intensity(params.get("intensity", 0.5))
+    cache_key = clean_cache.make_key(params["content_hash"], operations, intensity, mode or DEFAULT_CLEAN_MODE,
+                                     output_format, CLEAN_PIPELINE_VERSION)
+
+    cleaned_path = clean_cache.get(cache_key)
+    cached = cleaned_path is not None
+    if not cached:
+        cleaned_path = artifact_path("cleaned", uid, f"cleaned_{uid}{CLEAN_OUTPUT_EXTENSIONS[output_format]}")
+        clean_pipeline(operations, params["upload_path"], cleaned_path, intensity, mode, output_format)
+        if not artifact_store.exists(cleaned_path):
+            raise RuntimeError("Cleaning produced no output")
+        clean_cache.put(cache_key, cleaned_path)
+
+    save_entry({
+        "type": "cleaning",
+        "img1_name": params.get("filename"),
+        "clean_id": uid,
+        "img1_path": params["upload_path"],
+        "cleaned_path": cleaned_path
+    })
+    return {
+        "original": f"/{params['upload_path']}",
+        "cleaned": f"/{cleaned_path}",
+        "operation": ",".join(operations),
+        "operations": operations,
+        "output_format": output_format,
+        "clean_id": uid,
+        "cached": cached
+    }
+
+
+def _run_compare(params):
+    uid = str(uuid.uuid4())[:8]
+    mode = params.get("mode", "full")
+    contents1 = artifact_store.read(params["img1_path"])
+    contents2 = artifact_store.read(params["img2_path"])
+
+    result_key = upload_index.compare_key(mode, params["hash1"], params["hash2"])
+    cached = upload_index.get_result(result_key)
+    if cached:
+        scores, cascade = cached["scores"], cached["cascade"]
+    else:
+        scores, cascade, complete = score_pair(contents1, contents2, mode)
+        if complete:
+            upload_index.put_result(result_key, {"scores": scores, "cascade": cascade})
+    face_sim = scores[0]
+
+    result = blend_scores(*scores)
+    result.update({
+        "image1": f"/{params['img1_path']}",
+        "image2": f"/{params['img2_path']}",
+        "comparison_id": uid,
+        "mode": mode,
+        "cached": cached is not None
+    })
+    if cascade is not None:
+        result["cascade"] = cascade
+
+    save_entry({
+        "type": "comparison",
+        "img1_name": params.get("img1_name"),
+        "img2_name": params.get("img2_name"),
+        "face_similarity": face_sim or 0.0,
+        "final_score": result["final_similarity"] / 100,
+        "is_same_person": int(result["is_same_person"]),
+        "comparison_id": uid,
+        "img1_path": params["img1_path"],
+        "img2_path": params["img2_path"]
+    })
+    return result
+
+
+def _run_report(params):
+    kind, artifact_id, format = params["report_for"], params["id"], params.get("format", "png")
+    path = render_report(kind, artifact_id, format)
+    if path is None or not artifact_store.exists(path):
+        raise RuntimeError(f"Could not render report for {kind} {artifact_id}")
+    route = "report" if kind == "comparison" else "clean_report"
+    return {
+        "report": f"/api/{route}/{artifact_id}/{format}",
+        "comparison_id" if kind == "comparison" else "clean_id": artifact_id
+    }
+
+
+JOB_HANDLERS = {
+    "clean": _run_clean,
+    "compare": _run_compare,
+    "report": _run_report
+}
+
+
+def execute_job(job):
+    """Run one claimed job and record its result (or its error, for a retry)."""
+    try:
+        result = JOB_HANDLERS[job["kind"]](job["params"])
+    except Exception as e:
+        print(f"Job {job['id']} ({job['kind']}) attempt {job['attempt']} failed: {e}")
+        finish_job(job["id"], error=f"{type(e).__name__}: {e}")
+        return
+    # The history row must be visible before the job reports done
+    flush_entries()
+    finish_job(job["id"], result=result)
+
+
+def run_worker(stop_event=None, poll_interval=POLL_INTERVAL):
+    """Claim and run jobs until ``stop_event`` is set (forever when None)."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    print(f"Job worker {worker} started")
+    while stop_event is None or not stop_event.is_set():
+        try:
+            job = claim_job(worker)
+        except Exception:
+            traceback.print_exc()
+            job = None
+        if job is None:
+            if stop_event is not None:
+                stop_event.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        execute_job(job)
+
+
+def start_job_workers(count):
+    """Spawn ``count`` worker processes; returns ``(processes, stop_event)``."""
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    processes = []
+    for index in range(count):
+        process = context.Process(target=run_worker, args=(stop_event,), name=f"job-worker-{index}", daemon=True)
+        process.start()
+        processes.append(process)
+    return processes, stop_event
+
+
+def stop_job_workers(processes, stop_event, timeout=10):
+    """Let workers finish their current job, then terminate any that are still running."""
+    stop_event.set()
+    deadline = time.monotonic() + timeout
+    for process in processes:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            process.terminate()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run Image Match Pro job workers")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    args = parser.parse_args()
+
+    init_db()
+    if args.workers == 1:
+        run_worker()
+    else:
+        workers, stop = start_job_workers(args.workers)
+        try:
+            for worker_process in workers:
+                worker_process.join()
+        except KeyboardInterrupt:
+            stop_job_workers(workers, stop)
@@ -0,0 +1,28 @@
+# backend/lazy.py
+import importlib
+
+
+class LazyFunction:
+    """Reference to ``module.name`` that imports the module on first call.
+
+    Lets the API hold handles to the image pipeline (OpenCV, scikit-image, the
+    face models) without importing it at startup. Only the names are stored,
+    so the reference pickles cleanly into process-pool workers, which import
+    the module themselves.
+    """
+
+    def __init__(self, module: str, name: str):
+        self.module = module
+        self.__name__ = name
+        self._fn = None
+
+    def __call__(self, *args, **kwargs):
+        if self._fn is None:
+            self._fn = getattr(importlib.import_module(self.module), self.__name__)
+        return self._fn(*args, **kwargs)
+
+    def __getstate__(self):
+        return {"module": self.module, "__name__": self.__name__, "_fn": None}
+
+    def __repr__(self):
+        return f"<LazyFunction {self.module}.{self.__name__}>"
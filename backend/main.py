@@ -1,31 +1,54 @@
 # backend/main.py
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from pathlib import Path
+from typing import List, Optional
+import asyncio
+import hashlib
+import json
+import mimetypes
 import os
+import time
 import uuid
+import zipfile
 from datetime import datetime
-
-# Import all functions from utils
-from utils import (
-    get_face_similarity,
-    get_feature_similarity,
-    get_ssim_psnr,
-    advanced_enhance,
-    remove_background,
-    brighten_dark_image,
-    denoise_image,
-    sharpen_image,
-    generate_report_image,
-    generate_report_pdf,
-    generate_clean_report_image,
-    generate_clean_report_pdf
+from email.utils import formatdate, parsedate_to_datetime
+
+# The image pipeline (OpenCV, scikit-image, deepface) is imported on first use by
+# a pool worker, so history, report downloads and health answer without loading it
+from lazy import LazyFunction
+from options import (
+    blend_scores,
+    CLEAN_OPERATIONS,
+    CLEAN_OUTPUT_EXTENSIONS,
+    CLEAN_PIPELINE_VERSION,
+    CLEAN_MODES,
+    DEFAULT_CLEAN_MODE
+)
+score_pair = LazyFunction("utils", "score_pair")
+compare_probe_batch = LazyFunction("utils", "compare_probe_batch")
+prepare_probe = LazyFunction("utils", "prepare_probe")
+fingerprint_upload = LazyFunction("utils", "fingerprint_upload")
+get_face_embedding = LazyFunction("utils", "get_face_embedding")
+clean_pipeline = LazyFunction("utils", "clean_pipeline")
+from artifacts import artifact_path, report_path, render_report, REPORT_FORMATS
+from artifact_store import artifact_store, ARTIFACT_AREAS
+
+from workers import worker_pool, PoolBusyError, JobTimeoutError
+from vector_index import face_index, enroll_embedding, search_embedding
+from upload_index import upload_index
+from clean_cache import clean_cache, quantize_intensity
+from ingest import (
+    read_upload, read_member, MAX_UPLOAD_BYTES, UploadTooLargeError, ImageTooLargeError
 )
+from metrics import REQUEST_SECONDS, record_cache, render_metrics, server_timing, stage, start_request
 
 # Import database functions
-from database import init_db, save_entry, get_history, get_comparison_result, get_clean_result
+from database import (
+    init_db, close_db, save_entry, get_history, get_comparison_result, get_clean_result,
+    enqueue_job, get_job, job_counts, pending_entries
+)
+from jobs import JOB_KINDS, start_job_workers, stop_job_workers
 
 # Create FastAPI app
 app = FastAPI(title="Image Match Pro - AI Image Comparison & Cleaning Tool")
@@ -37,81 +60,261 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing"],
 )
 
-# Create required directories
-directories = ["uploads", "diffs", "cleaned", "reports"]
-for directory in directories:
-    Path(directory).mkdir(exist_ok=True)
-
-# Mount static folders
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-app.mount("/diffs", StaticFiles(directory="diffs"), name="diffs")
-app.mount("/cleaned", StaticFiles(directory="cleaned"), name="cleaned")
-app.mount("/reports", StaticFiles(directory="reports"), name="reports")
+# Per-request stage timings in a Server-Timing header (off by default; see /metrics for aggregates)
+SERVER_TIMING = os.environ.get("IMAGE_MATCH_SERVER_TIMING", "0") == "1"
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    timings = start_request()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        route = request.scope.get("route")
+        REQUEST_SECONDS.observe(elapsed, request.method, getattr(route, "path", "unmatched"), status)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(timings, elapsed)
+    return response
+
+# ARTIFACT FILES
+# Uploads, diffs, cleaned images and reports are served from the packed store at
+# their old static URLs, e.g. /uploads/3f/a9/<file>
+def _parse_range(header: str, size: int):
+    """``(start, end)`` of a single ``bytes=`` range, or None to send everything.
+
+    A malformed or unsatisfiable range is ignored rather than answered with
+    416, as RFC 9110 allows, so the client simply gets the full body.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) + 1 if last else size
+        else:
+            start, end = max(size - int(last), 0), size
+    except ValueError:
+        return None
+    if start >= size or end <= start:
+        return None
+    return start, min(end, size)
+
+def _serve_artifact(request: Request, path: str, filename: str = None, cache_control: str = None):
+    """Serve an artifact with ETag/Last-Modified (answering revalidation with 304) and byte ranges."""
+    artifact = artifact_store.stat(path)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    etag = f'"{artifact.etag}"'
+    headers = {"ETag": etag, "Last-Modified": formatdate(artifact.created, usegmt=True), "Accept-Ranges": "bytes"}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if filename:
+        headers["Content-Disposition"] = f'attachment; filename="{filename}"'
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        if etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since"):
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"]).timestamp()
+        except (TypeError, ValueError):
+            since = None
+        if since is not None and int(artifact.created) <= since:
+            return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    status_code, start, end = 200, 0, artifact.size
+    if request.headers.get("range") and request.headers.get("if-range", etag) == etag:
+        byte_range = _parse_range(request.headers["range"], artifact.size)
+        if byte_range:
+            status_code, (start, end) = 206, byte_range
+            headers["Content-Range"] = f"bytes {start}-{end - 1}/{artifact.size}"
+    if request.method == "HEAD":
+        headers["Content-Length"] = str(end - start)
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    try:
+        body = artifact_store.read(path, start, end)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Not found")
+    return Response(body, status_code=status_code, headers=headers, media_type=media_type)
+
+def _artifact_route(area: str):
+    def serve(request: Request, path: str):
+        key = os.path.normpath(f"{area}/{path}")
+        if not key.startswith(f"{area}{os.sep}"):
+            raise HTTPException(status_code=404, detail="Not found")
+        return _serve_artifact(request, key)
+    return serve
+
+for area in ARTIFACT_AREAS:
+    app.add_api_route(f"/{area}/{{path:path}}", _artifact_route(area), methods=["GET", "HEAD"],
+                      include_in_schema=False)
+
+UPLOAD_LIMIT_DETAIL = f"Each image must be less than {MAX_UPLOAD_BYTES / 1_000_000:g}MB"
+
+async def read_image(upload: UploadFile):
+    """Bounded, hashed read of one image upload; returns ``(contents, content_hash)``."""
+    try:
+        return await read_upload(upload)
+    except UploadTooLargeError:
+        raise HTTPException(status_code=400, detail=UPLOAD_LIMIT_DETAIL)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def store_upload(contents: bytes, uid: str, filename: str, content_hash: str = None):
+    """Save an upload unless identical bytes are already stored.
+
+    Returns ``(path, content_hash)``. New content is fingerprinted (raising
+    ValueError if it does not decode), written off the event loop and added
+    to the near-duplicate index.
+    """
+    content_hash = content_hash or hashlib.sha256(contents).hexdigest()
+    path = await asyncio.to_thread(upload_index.lookup, content_hash)
+    record_cache("upload", path is not None)
+    if path:
+        return path, content_hash
+    fingerprint = await worker_pool.run(fingerprint_upload, contents)
+    path = artifact_path("uploads", uid, filename)
+    with stage("upload.write"):
+        await asyncio.to_thread(artifact_store.put, path, contents)
+    await asyncio.to_thread(upload_index.register, content_hash, fingerprint, path, len(contents))
+    return path, content_hash
+
+# Local job worker processes; 0 when workers run separately (python jobs.py)
+JOB_WORKERS = int(os.environ.get("IMAGE_MATCH_JOB_WORKERS", 1))
+job_workers = None
 
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
+    global job_workers
     init_db()
     print("Database initialized. No torchvision/CLIP used - fully stable!")
+    # Start the worker pool; it loads and warms the face models in the background
+    worker_pool.start()
+    if JOB_WORKERS > 0:
+        job_workers = start_job_workers(JOB_WORKERS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    worker_pool.shutdown()
+    if job_workers is not None:
+        stop_job_workers(*job_workers)
+    close_db()
+
+@app.exception_handler(PoolBusyError)
+async def pool_busy_handler(request, exc):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, retry shortly"},
+                        headers={"Retry-After": "5"})
+
+@app.exception_handler(JobTimeoutError)
+async def job_timeout_handler(request, exc):
+    return JSONResponse(status_code=504, content={"detail": "Processing timed out"})
 
 @app.get("/")
 async def root():
     return {"message": "Image Match Pro API is running (torchvision-free)!",
             "timestamp": datetime.now().isoformat()}
 
+# HEALTH ENDPOINT
+@app.get("/api/health")
+async def health():
+    status = worker_pool.status()
+    status["clean_cache"] = await asyncio.to_thread(clean_cache.stats)
+    return JSONResponse(content=status, status_code=200 if status["ready"] else 503)
+
+# METRICS ENDPOINT
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition: stage latencies, cache outcomes, errors and queue depths."""
+    pool = worker_pool.status()
+    cache = await asyncio.to_thread(clean_cache.stats)
+    store = await asyncio.to_thread(artifact_store.stats)
+    jobs = await asyncio.to_thread(job_counts)
+    gauges = [
+        ("image_match_pool_pending", "Worker pool jobs running or queued", {(): pool["pending"]}),
+        ("image_match_pool_max_pending", "Worker pool queue limit before 503s", {(): pool["max_pending"]}),
+        ("image_match_pool_workers", "Worker pool size", {(): pool["workers"]}),
+        ("image_match_models_ready", "1 once the face models are loaded", {(): int(pool["ready"])}),
+        ("image_match_jobs", "Background jobs by status",
+         {(("status", status),): jobs.get(status, 0) for status in ("queued", "running", "done", "failed")}),
+        ("image_match_history_write_backlog", "History rows waiting to be committed", {(): pending_entries()}),
+        ("image_match_clean_cache_bytes", "Bytes of cleaned results on disk", {(): cache["bytes"]}),
+        ("image_match_clean_cache_entries", "Cleaned results in the cache", {(): cache["entries"]}),
+        ("image_match_artifacts", "Named artifacts in the packed store", {(): store["artifacts"]}),
+        ("image_match_artifact_segments", "Segment files in the packed store", {(): store["segments"]}),
+        ("image_match_artifact_bytes", "Packed store bytes by kind",
+         {(("kind", "segments"),): store["segment_bytes"], (("kind", "live"),): store["live_bytes"]}),
+    ]
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
+
 # COMPARISON ENDPOINT
+# "full" always runs every metric; "cascade" stops once the cheap stages decide the verdict
+COMPARE_MODES = ("full", "cascade")
+DEFAULT_COMPARE_MODE = os.environ.get("IMAGE_MATCH_COMPARE_MODE", "full")
+
 @app.post("/api/compare")
-async def compare_images(image1: UploadFile = File(...), image2: UploadFile = File(...)):
-    if image1.size > 2_000_000 or image2.size > 2_000_000:
-        raise HTTPException(status_code=400, detail="Each image must be less than 2MB")
+async def compare_images(image1: UploadFile = File(...), image2: UploadFile = File(...),
+                         mode: str = Form(None)):
+    mode = mode or DEFAULT_COMPARE_MODE
+    if mode not in COMPARE_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Choose from: {', '.join(COMPARE_MODES)}")
 
     # Generate unique IDs
     uid = str(uuid.uuid4())[:8]
-    img1_path = f"uploads/{uid}_1_{image1.filename}"
-    img2_path = f"uploads/{uid}_2_{image2.filename}"
-
-    # Save uploaded files
-    contents1 = await image1.read()
-    contents2 = await image2.read()
-    with open(img1_path, "wb") as f:
-        f.write(contents1)
-    with open(img2_path, "wb") as f:
-        f.write(contents2)
-
-    # Compute advanced similarities (highly optimized for speed)
-    face_sim = get_face_similarity(img1_path, img2_path)
-    feature_sim = get_feature_similarity(img1_path, img2_path)
-    ssim_score, psnr_score = get_ssim_psnr(img1_path, img2_path)
-
-    # Advanced blend
-    normalized_psnr = min(psnr_score / 40.0, 1.0)
-    final_score = (face_sim * 0.25) + (feature_sim * 0.25) + (ssim_score * 0.25) + (normalized_psnr * 0.25)
-    is_same_person = final_score > 0.75
+
+    contents1, hash1 = await read_image(image1)
+    contents2, hash2 = await read_image(image2)
+
+    # Identical content compared before reuses the stored scores
+    result_key = upload_index.compare_key(mode, hash1, hash2)
+    cached = await asyncio.to_thread(upload_index.get_result, result_key)
+    record_cache("compare_result", cached is not None)
+    if cached:
+        scores, cascade = cached["scores"], cached["cascade"]
+    else:
+        # Decode each upload once and share it across every metric (off the event loop)
+        try:
+            scores, cascade, complete = await worker_pool.run(score_pair, contents1, contents2, mode)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Could not decode uploaded image")
+        # A stage that failed scored 0; only memoise results where every metric ran
+        if complete:
+            await asyncio.to_thread(upload_index.put_result, result_key, {"scores": scores, "cascade": cascade})
+    face_sim, feature_sim, ssim_score, psnr_score = scores
+
+    # Save uploaded files (re-uploads point at the stored copy)
+    img1_path, _ = await store_upload(contents1, uid, f"{uid}_1_{image1.filename}", hash1)
+    img2_path, _ = await store_upload(contents2, uid, f"{uid}_2_{image2.filename}", hash2)
 
     # Prepare detailed result with all scores
-    result = {
-        "face_structure_similarity": round(face_sim * 100, 2),
-        "feature_similarity": round(feature_sim * 100, 2),
-        "ssim_similarity": round(ssim_score * 100, 2),
-        "psnr_similarity": round(normalized_psnr * 100, 2),
-        "face_match": round(face_sim * 100, 2),
-        "final_similarity": round(final_score * 100, 2),
-        "is_same_person": bool(is_same_person),
-        "image1": f"/uploads/{os.path.basename(img1_path)}",
-        "image2": f"/uploads/{os.path.basename(img2_path)}",
-        "comparison_id": uid
-    }
+    result = blend_scores(face_sim, feature_sim, ssim_score, psnr_score)
+    result.update({
+        "image1": f"/{img1_path}",
+        "image2": f"/{img2_path}",
+        "comparison_id": uid,
+        "mode": mode,
+        "cached": cached is not None
+    })
+    if cascade is not None:
+        result["cascade"] = cascade
 
     # Save to history
     save_entry({
         "type": "comparison",
         "img1_name": image1.filename,
         "img2_name": image2.filename,
-        "face_similarity": face_sim,
-        "final_score": final_score,
-        "is_same_person": int(is_same_person),
+        "face_similarity": face_sim or 0.0,
+        "final_score": result["final_similarity"] / 100,
+        "is_same_person": int(result["is_same_person"]),
         "comparison_id": uid,
         "img1_path": img1_path,
         "img2_path": img2_path
@@ -119,40 +322,223 @@ async def compare_images(image1: UploadFile = File(...), image2: UploadFile = Fi
 
     return JSONResponse(content=result)
 
+# BATCH HELPERS
+MAX_BATCH_CANDIDATES = 500
+MAX_ARCHIVE_BYTES = 200_000_000
+STREAM_CHUNK = 8
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+def _open_archive(upload: UploadFile):
+    """Open an uploaded ZIP in place and validate its image members up front."""
+    try:
+        archive = zipfile.ZipFile(upload.file)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Archive must be a valid ZIP file")
+    members = [
+        info for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    if any(info.file_size > MAX_UPLOAD_BYTES for info in members):
+        raise HTTPException(status_code=400, detail=UPLOAD_LIMIT_DETAIL)
+    if sum(info.file_size for info in members) > MAX_ARCHIVE_BYTES:
+        raise HTTPException(status_code=400, detail="Archive is too large")
+    return archive, members
+
+def _batch_sources(images, archive_upload):
+    """Validate a batch and return lazy ``(name, read)`` sources.
+
+    Nothing is read here; each source is only pulled into memory when its
+    item is processed, so streamed batches hold one chunk at a time.
+    """
+    sources = []
+    for upload in images or []:
+        if upload.size is not None and upload.size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=400, detail=UPLOAD_LIMIT_DETAIL)
+        sources.append((upload.filename, lambda upload=upload: read_upload(upload)))
+    if archive_upload is not None:
+        archive, members = _open_archive(archive_upload)
+        for info in members:
+            sources.append((info.filename, lambda info=info: read_member(archive, info)))
+    if not sources:
+        raise HTTPException(status_code=400, detail="Provide images or a ZIP archive")
+    if len(sources) > MAX_BATCH_CANDIDATES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_CANDIDATES} images per batch")
+    return sources
+
+async def _read_source(read):
+    """Read one batch source; returns ``(data, None)``, or ``(None, detail)`` if it is over a limit."""
+    try:
+        data = read()
+        if asyncio.iscoroutine(data):
+            data = (await data)[0]
+    except UploadTooLargeError:
+        return None, UPLOAD_LIMIT_DETAIL
+    except ImageTooLargeError as e:
+        return None, str(e)
+    return data, None
+
+def _encode_event(payload: dict, mode: str, event: str = "item") -> str:
+    if mode == "sse":
+        return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+    return json.dumps(payload) + "\n"
+
+async def _respond(items, mode: str, summary: dict):
+    """Send batch items as one JSON body, or stream them as NDJSON/SSE as they finish."""
+    if mode is None:
+        results = [item async for item in items]
+        return JSONResponse(content=dict(summary, count=len(results), results=results))
+    if mode not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="stream must be 'ndjson' or 'sse'")
+
+    async def body():
+        started = time.perf_counter()
+        count = 0
+        try:
+            async for item in items:
+                count += 1
+                yield _encode_event(item, mode)
+        except (PoolBusyError, JobTimeoutError) as e:
+            # Headers are already sent, so report the failure in-band and stop
+            yield _encode_event({"error": str(e)}, mode, "error")
+        total_ms = round((time.perf_counter() - started) * 1000, 2)
+        yield _encode_event(dict(summary, done=True, count=count, total_ms=total_ms), mode, "done")
+
+    return StreamingResponse(body(), media_type=STREAM_MEDIA_TYPES[mode])
+
+# BATCH COMPARISON ENDPOINT
+@app.post("/api/compare/batch")
+async def compare_batch(probe: UploadFile = File(...),
+                        candidates: List[UploadFile] = File(None),
+                        archive: UploadFile = File(None),
+                        stream: Optional[str] = None):
+    sources = _batch_sources(candidates, archive)
+    probe_contents, _ = await read_image(probe)
+
+    # The probe is decoded and embedded once; candidates are then scored against
+    # it in fixed chunks, so only one chunk of full-resolution images is resident
+    try:
+        prepared = await worker_pool.run(prepare_probe, probe_contents)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not decode probe image")
+    del probe_contents
+
+    async def items():
+        index = 0
+        for offset in range(0, len(sources), STREAM_CHUNK):
+            chunk, rejected = [], {}
+            for name, read in sources[offset:offset + STREAM_CHUNK]:
+                data, detail = await _read_source(read)
+                if detail:
+                    rejected[len(chunk)] = detail
+                chunk.append((name, data or b""))
+            scored = await worker_pool.run(compare_probe_batch, prepared, chunk)
+            del chunk
+            for position, (name, scores, timings) in enumerate(scored):
+                entry = {"index": index, "name": name}
+                if scores is None:
+                    entry["error"] = rejected.get(position, "Could not decode image")
+                else:
+                    entry.update(blend_scores(*scores))
+                entry["timings"] = timings
+                index += 1
+                yield entry
+
+    return await _respond(items(), stream, {"probe": probe.filename})
+
+# GALLERY ENROLLMENT ENDPOINT
+@app.post("/api/enroll")
+async def enroll_face(image: UploadFile = File(...), label: str = Form(...)):
+    uid = str(uuid.uuid4())[:8]
+    img_path = artifact_path("uploads", uid, f"{uid}_gallery_{image.filename}")
+    contents, _ = await read_image(image)
+
+    try:
+        embedding = await worker_pool.run(get_face_embedding, contents)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not decode uploaded image")
+    if embedding is None:
+        raise HTTPException(status_code=400, detail="No face detected")
+
+    await asyncio.to_thread(artifact_store.put, img_path, contents)
+
+    image_url = f"/{img_path}"
+    gallery_id = await worker_pool.run(enroll_embedding, embedding, label, image_url)
+    return JSONResponse(content={"gallery_id": gallery_id, "label": label, "image": image_url})
+
+@app.delete("/api/enroll/{gallery_id}")
+async def remove_enrolled_face(gallery_id: int):
+    if not await asyncio.to_thread(face_index.remove, gallery_id):
+        raise HTTPException(status_code=404, detail="Gallery entry not found")
+    return {"removed": gallery_id}
+
+# 1:N SEARCH ENDPOINT
+@app.post("/api/search")
+async def search_faces(image: UploadFile = File(...), k: int = Form(5)):
+    if k < 1 or k > 100:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 100")
+
+    contents, _ = await read_image(image)
+    try:
+        embedding = await worker_pool.run(get_face_embedding, contents)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not decode uploaded image")
+    if embedding is None:
+        raise HTTPException(status_code=400, detail="No face detected")
+
+    matches, strategy = await worker_pool.run(search_embedding, embedding, k)
+    return JSONResponse(content={
+        "matches": matches,
+        "index": strategy,
+        "gallery_size": await asyncio.to_thread(face_index.size)
+    })
+
 # CLEANING ENDPOINT
-@app.post("/api/clean")
-async def clean_image_endpoint(image: UploadFile = File(...), operation: str = Form(...), intensity: float = Form(0.5)):
-    if image.size > 2_000_000:
-        raise HTTPException(status_code=400, detail="Image must be less than 2MB")
+def _clean_options(operation, operations, mode, output_format):
+    """Validate cleaning form fields; returns the ordered operation list.
+
+    ``operations`` may be repeated form fields or one comma-separated value;
+    the single ``operation`` field is kept for existing clients.
+    """
+    values = operations or ([operation] if operation else [])
+    steps = [op.strip() for value in values for op in value.split(",") if op.strip()]
+    if not steps or any(op not in CLEAN_OPERATIONS for op in steps):
+        raise HTTPException(status_code=400, detail="Invalid operation")
+    if mode is not None and mode not in CLEAN_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode. Choose from: {', '.join(CLEAN_MODES)}")
+    if output_format not in CLEAN_OUTPUT_EXTENSIONS:
+        raise HTTPException(status_code=400, detail=f"Invalid output format. Choose from: {', '.join(CLEAN_OUTPUT_EXTENSIONS)}")
+    return steps
 
+@app.post("/api/clean")
+async def clean_image_endpoint(image: UploadFile = File(...), operation: str = Form(None),
+                               operations: List[str] = Form(None), intensity: float = Form(0.5),
+                               mode: str = Form(None), output_format: str = Form("png")):
     uid = str(uuid.uuid4())[:8]
-    orig_path = f"uploads/{uid}_{image.filename}"
-    cleaned_path = f"cleaned/cleaned_{uid}.png"
+
+    steps = _clean_options(operation, operations, mode, output_format)
 
     # Save original
-    contents = await image.read()
-    with open(orig_path, "wb") as f:
-        f.write(contents)
-
-    # Perform selected advanced operation with intensity
-    if operation == "enhance":
-        advanced_enhance(orig_path, cleaned_path, intensity)
-    elif operation == "remove_bg":
-        remove_background(orig_path, cleaned_path)
-    elif operation == "brighten":
-        brighten_dark_image(orig_path, cleaned_path, intensity)
-    elif operation == "denoise":
-        denoise_image(orig_path, cleaned_path, intensity)
-    elif operation == "sharpen":
-        sharpen_image(orig_path, cleaned_path, intensity)
-    else:
-        raise HTTPException(status_code=400, detail="Invalid operation")
+    contents, content_hash = await read_image(image)
+    try:
+        orig_path, content_hash = await store_upload(contents, uid, f"{uid}_{image.filename}", content_hash)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not decode uploaded image")
+
+    # Perform the selected operations in order with intensity, decoding from the upload buffer
+    cleaned_path, cached = await clean_upload(content_hash, contents, uid, steps, intensity, mode, output_format)
+    if cleaned_path is None:
+        raise HTTPException(status_code=500, detail="Cleaning failed")
 
     result = {
-        "original": f"/uploads/{os.path.basename(orig_path)}",
-        "cleaned": f"/cleaned/{os.path.basename(cleaned_path)}",
-        "operation": operation,
-        "clean_id": uid
+        "original": f"/{orig_path}",
+        "cleaned": f"/{cleaned_path}",
+        "operation": ",".join(steps),
+        "operations": steps,
+        "output_format": output_format,
+        "clean_id": uid,
+        "mode": mode or DEFAULT_CLEAN_MODE,
+        "cached": cached
     }
 
     # Save to history
@@ -166,79 +552,259 @@ async def clean_image_endpoint(image: UploadFile = File(...), operation: str = F
 
     return JSONResponse(content=result)
 
+async def clean_upload(content_hash, source, uid, operations, intensity, mode=None, output_format="png"):
+    """Clean an upload (its bytes or stored path), reusing the output of an identical earlier request.
+
+    Returns ``(cleaned_path, cached)``; ``cleaned_path`` is None when the
+    pipeline failed and stored no output (nothing is cached then).
+    """
+    # Keyed by the requested mode: remove_bg runs GrabCut at full resolution only in "full"
+    intensity = quantize_intensity(intensity)
+    cache_key = clean_cache.make_key(content_hash, operations, intensity, mode or DEFAULT_CLEAN_MODE,
+                                     output_format, CLEAN_PIPELINE_VERSION)
+    cached_path = await asyncio.to_thread(clean_cache.get, cache_key)
+    record_cache("clean_result", cached_path is not None)
+    if cached_path:
+        return cached_path, True
+    extension = CLEAN_OUTPUT_EXTENSIONS[output_format]
+    cleaned_path = artifact_path("cleaned", uid, f"cleaned_{uid}{extension}")
+    await worker_pool.run(clean_pipeline, operations, source, cleaned_path, intensity, mode, output_format)
+    # clean_pipeline logs and swallows its errors, so the stored output is the only proof it ran
+    if not await asyncio.to_thread(artifact_store.exists, cleaned_path):
+        return None, False
+    await asyncio.to_thread(clean_cache.put, cache_key, cleaned_path)
+    return cleaned_path, False
+
+# NEAR-DUPLICATE ENDPOINT
+@app.post("/api/duplicates")
+async def find_duplicates(image: UploadFile = File(...), radius: int = Form(8), limit: int = Form(20)):
+    """Stored uploads whose pHash is within ``radius`` bits of the given image."""
+    if not 0 <= radius <= 64 or not 1 <= limit <= 200:
+        raise HTTPException(status_code=400, detail="radius must be 0-64 and limit 1-200")
+    contents, content_hash = await read_image(image)
+    try:
+        fingerprint = await worker_pool.run(fingerprint_upload, contents)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Could not decode uploaded image")
+
+    matches = await asyncio.to_thread(upload_index.near, fingerprint["phash"], radius, limit)
+    for match in matches:
+        match["exact"] = match["content_hash"] == content_hash
+    return JSONResponse(content={"phash": f"{fingerprint['phash']:016x}", "radius": radius, "matches": matches})
+
+# BATCH CLEANING ENDPOINT
+@app.post("/api/clean/batch")
+async def clean_batch(images: List[UploadFile] = File(None),
+                      archive: UploadFile = File(None),
+                      operation: str = Form(None),
+                      operations: List[str] = Form(None),
+                      intensity: float = Form(0.5),
+                      mode: str = Form(None),
+                      output_format: str = Form("png"),
+                      stream: Optional[str] = None):
+    steps = _clean_options(operation, operations, mode, output_format)
+    sources = _batch_sources(images, archive)
+
+    async def items():
+        for index, (name, read) in enumerate(sources):
+            started = time.perf_counter()
+            uid = str(uuid.uuid4())[:8]
+            contents, detail = await _read_source(read)
+            if detail:
+                yield {"index": index, "name": name, "error": detail}
+                continue
+            try:
+                orig_path, content_hash = await store_upload(contents, uid, f"{uid}_{name}")
+            except ValueError:
+                yield {"index": index, "name": name, "error": "Could not decode image"}
+                continue
+            save_ms = round((time.perf_counter() - started) * 1000, 2)
+
+            cleaned_path, cached = await clean_upload(content_hash, contents, uid, steps, intensity, mode, output_format)
+            process_ms = round((time.perf_counter() - started) * 1000 - save_ms, 2)
+            if cleaned_path is None:
+                yield {"index": index, "name": name, "error": "Cleaning failed"}
+                continue
+
+            save_entry({
+                "type": "cleaning",
+                "img1_name": name,
+                "clean_id": uid,
+                "img1_path": orig_path,
+                "cleaned_path": cleaned_path
+            })
+            yield {
+                "index": index,
+                "name": name,
+                "original": f"/{orig_path}",
+                "cleaned": f"/{cleaned_path}",
+                "clean_id": uid,
+                "cached": cached,
+                "timings": {
+                    "save_ms": save_ms,
+                    "process_ms": process_ms,
+                    "total_ms": round((time.perf_counter() - started) * 1000, 2)
+                }
+            }
+
+    return await _respond(items(), stream, {"operation": ",".join(steps), "operations": steps})
+
+# REPORT CACHE
+def _serve_report(request: Request, path: str, filename: str):
+    """Serve a rendered report as a download; revalidation is answered with 304."""
+    if not artifact_store.exists(path):
+        raise HTTPException(status_code=500, detail="Report generation failed")
+    return _serve_artifact(request, path, filename, "private, max-age=86400")
+
+# JOB ENDPOINTS
+@app.post("/api/jobs")
+async def create_job(kind: str = Form(...),
+                     priority: int = Form(0),
+                     max_attempts: int = Form(3),
+                     images: List[UploadFile] = File(None),
+                     operation: str = Form(None),
+                     operations: List[str] = Form(None),
+                     intensity: float = Form(0.5),
+                     mode: str = Form(None),
+                     output_format: str = Form("png"),
+                     report_for: str = Form(None),
+                     report_id: str = Form(None),
+                     format: str = Form("png")):
+    """Queue a clean, compare or report job and return immediately with its id.
+
+    clean takes one image plus the /api/clean fields, compare takes two images
+    plus ``mode``, and report takes ``report_for`` ("comparison" or "clean"),
+    ``report_id`` and ``format``. Poll ``GET /api/jobs/{id}`` for the result.
+    """
+    if kind not in JOB_KINDS:
+        raise HTTPException(status_code=400, detail=f"Invalid kind. Choose from: {', '.join(JOB_KINDS)}")
+    if not 1 <= max_attempts <= 10:
+        raise HTTPException(status_code=400, detail="max_attempts must be 1-10")
+    images = images or []
+    uid = str(uuid.uuid4())[:8]
+
+    if kind == "clean":
+        if len(images) != 1:
+            raise HTTPException(status_code=400, detail="A clean job takes exactly one image")
+        steps = _clean_options(operation, operations, mode, output_format)
+        contents, content_hash = await read_image(images[0])
+        try:
+            upload_path, content_hash = await store_upload(contents, uid, f"{uid}_{images[0].filename}", content_hash)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Could not decode uploaded image")
+        params = {"upload_path": upload_path, "content_hash": content_hash, "filename": images[0].filename,
+                  "operations": steps, "intensity": intensity, "mode": mode, "output_format": output_format}
+    elif kind == "compare":
+        if len(images) != 2:
+            raise HTTPException(status_code=400, detail="A compare job takes exactly two images")
+        mode = mode or DEFAULT_COMPARE_MODE
+        if mode not in COMPARE_MODES:
+            raise HTTPException(status_code=400, detail=f"Invalid mode. Choose from: {', '.join(COMPARE_MODES)}")
+        params = {"mode": mode}
+        for index, image in enumerate(images, start=1):
+            contents, content_hash = await read_image(image)
+            try:
+                path, content_hash = await store_upload(contents, uid, f"{uid}_{index}_{image.filename}", content_hash)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Could not decode uploaded image")
+            params.update({f"img{index}_path": path, f"hash{index}": content_hash, f"img{index}_name": image.filename})
+    else:
+        if report_for not in ("comparison", "clean") or not report_id:
+            raise HTTPException(status_code=400, detail="A report job needs report_for (comparison or clean) and report_id")
+        if format not in REPORT_FORMATS:
+            raise HTTPException(status_code=400, detail="Format must be 'png' or 'pdf'")
+        lookup = get_comparison_result if report_for == "comparison" else get_clean_result
+        exists = await asyncio.to_thread(lookup, report_id)
+        if not exists:
+            raise HTTPException(status_code=404, detail="Comparison not found" if report_for == "comparison" else "Clean result not found")
+        params = {"report_for": report_for, "id": report_id, "format": format}
+
+    job_id = await asyncio.to_thread(enqueue_job, kind, params, priority=priority, max_attempts=max_attempts)
+    status_url = f"/api/jobs/{job_id}"
+    return JSONResponse(status_code=202, headers={"Location": status_url},
+                        content={"job_id": job_id, "kind": kind, "status": "queued", "priority": priority,
+                                 "status_url": status_url})
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await asyncio.to_thread(get_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JSONResponse(content=job)
+
 # CLEAN REPORT ENDPOINT
 @app.get("/api/clean_report/{clean_id}/{format}")
-async def get_clean_report(clean_id: str, format: str = "png"):
-    if format not in ["png", "pdf"]:
+async def get_clean_report(request: Request, clean_id: str, format: str = "png"):
+    if format not in REPORT_FORMATS:
         raise HTTPException(status_code=400, detail="Format must be 'png' or 'pdf'")
 
-    orig_files = [f for f in os.listdir("uploads") if f.startswith(f"{clean_id}_")]
-    cleaned_files = [f for f in os.listdir("cleaned") if f.startswith(f"cleaned_{clean_id}")]
-    if not orig_files or not cleaned_files:
-        raise HTTPException(status_code=404, detail="Clean result not found")
-
-    orig_path = f"uploads/{orig_files[0]}"
-    cleaned_path = f"cleaned/{cleaned_files[0]}"
-
-    report_img_path = f"reports/clean_report_{clean_id}.png"
-    report_pdf_path = f"reports/clean_report_{clean_id}.pdf"
+    # Reports are rendered once per clean id; later downloads are served from the store
+    path = report_path("clean", clean_id, format)
+    if not await asyncio.to_thread(artifact_store.exists, path):
+        path = await worker_pool.run(render_report, "clean", clean_id, format)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Clean result not found")
 
-    result = {"operation": "Unknown"}
-
-    generate_clean_report_image(orig_path, cleaned_path, result, report_img_path)
-
-    if format == "pdf":
-        generate_clean_report_pdf(report_img_path, result, report_pdf_path)
-        return FileResponse(report_pdf_path, filename="clean_report.pdf")
-
-    return FileResponse(report_img_path, filename="clean_report.png")
+    return await asyncio.to_thread(_serve_report, request, path, f"clean_report.{format}")
 
 # REPORT ENDPOINT for compare
 @app.get("/api/report/{comparison_id}/{format}")
-async def get_report(comparison_id: str, format: str = "png"):
-    if format not in ["png", "pdf"]:
+async def get_report(request: Request, comparison_id: str, format: str = "png"):
+    if format not in REPORT_FORMATS:
         raise HTTPException(status_code=400, detail="Format must be 'png' or 'pdf'")
 
-    img1_files = [f for f in os.listdir("uploads") if f.startswith(f"{comparison_id}_1_")]
-    img2_files = [f for f in os.listdir("uploads") if f.startswith(f"{comparison_id}_2_")]
-    if not img1_files or not img2_files:
-        raise HTTPException(status_code=404, detail="Comparison not found")
-
-    img1_path = f"uploads/{img1_files[0]}"
-    img2_path = f"uploads/{img2_files[0]}"
-
-    report_img_path = f"reports/report_{comparison_id}.png"
-    report_pdf_path = f"reports/report_{comparison_id}.pdf"
+    # Reports are rendered once per comparison id; later downloads are served from the store
+    path = report_path("comparison", comparison_id, format)
+    if not await asyncio.to_thread(artifact_store.exists, path):
+        path = await worker_pool.run(render_report, "comparison", comparison_id, format)
+        if path is None:
+            raise HTTPException(status_code=404, detail="Comparison not found")
 
-    result = get_comparison_result(comparison_id)
-    if not result:
-        result = {"final_similarity": 0.0, "face_similarity": 0.0, "is_same_person": False}
-
-    generate_report_image(img1_path, img2_path, result, report_img_path)
-
-    if format == "pdf":
-        generate_report_pdf(report_img_path, result, report_pdf_path)
-        return FileResponse(report_pdf_path, filename="report.pdf")
-
-    return FileResponse(report_img_path, filename="report.png")
+    return await asyncio.to_thread(_serve_report, request, path, f"report.{format}")
 
 # HISTORY ENDPOINT
 @app.get("/api/history")
-async def get_history_endpoint():
-    rows = get_history()
+async def get_history_endpoint(limit: int = Query(50, ge=1, le=500),
+                               cursor: Optional[str] = None,
+                               type: Optional[str] = None,
+                               since: Optional[str] = None,
+                               until: Optional[str] = None,
+                               min_score: Optional[float] = Query(None, ge=0, le=100),
+                               max_score: Optional[float] = Query(None, ge=0, le=100)):
+    """Newest-first history page; the cursor for the next page is in ``X-Next-Cursor``."""
+    try:
+        # get_history waits for queued writes, so it runs off the event loop
+        rows, next_cursor = await asyncio.to_thread(
+            get_history,
+            limit=limit,
+            cursor=cursor,
+            entry_type=type,
+            since=since,
+            until=until,
+            min_score=min_score / 100 if min_score is not None else None,
+            max_score=max_score / 100 if max_score is not None else None
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
     history_list = []
     for row in rows:
         entry = {
-            "id": row[0],
-            "time": row[1],
-            "type": row[2],
-            "img1_name": row[3]
+            "id": row["id"],
+            "time": row["timestamp"],
+            "type": row["type"],
+            "img1_name": row["img1_name"]
         }
-        if row[2] == "comparison":
-            entry["img2_name": row[4]]
-            entry["score"] = round(row[6] * 100, 1) if row[6] else None
+        if row["type"] == "comparison":
+            entry["img2_name"] = row["img2_name"]
+            entry["score"] = round(row["final_score"] * 100, 1) if row["final_score"] else None
+            entry["comparison_id"] = row["comparison_id"]
+        else:
+            entry["clean_id"] = row["clean_id"]
         history_list.append(entry)
-    return history_list
+
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+    return JSONResponse(content=history_list, headers=headers)
 
 if __name__ == "__main__":
     import uvicorn
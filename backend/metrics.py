@@ -0,0 +1,186 @@
+# backend/metrics.py
+"""In-process metrics in the Prometheus text format, plus per-request stage timings.
+
+Code on the hot path reports through three calls: ``stage`` (a timing context
+manager), ``record_error`` and ``record_cache``. Events go to the process
+registry and, when a request is being handled, to that request's timings for
+the ``Server-Timing`` header.
+
+Pool jobs run under ``collect``, which buffers their events instead of
+recording them. The web worker then ``replay``s the buffer, so stage timings
+from thread and process workers alike land in the registry that ``/metrics``
+serves, and in the right request's header.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class _Collector:
+    def __init__(self, defer):
+        self.defer = defer
+        self.events = []
+
+
+_collector = contextvars.ContextVar("image_match_metrics_collector", default=None)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for values, total in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=STAGE_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for values, (counts, total, count) in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = _format_labels(self.labels + ("le",), values + (bound,))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels + ("le",), values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                base = _format_labels(self.labels, values)
+                lines.append(f"{self.name}_sum{base} {round(total, 6)}")
+                lines.append(f"{self.name}_count{base} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("image_match_stage_seconds", "Latency of processing stages", ("stage",))
+STAGE_ERRORS = Counter("image_match_stage_errors_total", "Failures caught in processing stages", ("stage",))
+CACHE_REQUESTS = Counter("image_match_cache_requests_total", "Cache lookups by outcome", ("cache", "result"))
+REQUEST_SECONDS = Histogram("image_match_request_seconds", "HTTP request latency",
+                            ("method", "route", "status"))
+REGISTRY = (STAGE_SECONDS, STAGE_ERRORS, CACHE_REQUESTS, REQUEST_SECONDS)
+
+
+def _emit(event):
+    collector = _collector.get()
+    if collector is not None:
+        collector.events.append(event)
+        if collector.defer:
+            return
+    kind, name, value = event
+    if kind == "time":
+        STAGE_SECONDS.observe(value, name)
+    elif kind == "error":
+        STAGE_ERRORS.inc(name)
+    else:
+        CACHE_REQUESTS.inc(name, value)
+
+
+def observe(stage_name, seconds):
+    _emit(("time", stage_name, seconds))
+
+
+def record_error(stage_name):
+    _emit(("error", stage_name, 1))
+
+
+def record_cache(cache, hit):
+    _emit(("cache", cache, "hit" if hit else "miss"))
+
+
+@contextmanager
+def stage(stage_name):
+    """Time the block as ``stage_name``; an exception escaping it also counts as an error."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_error(stage_name)
+        raise
+    finally:
+        observe(stage_name, time.perf_counter() - started)
+
+
+# Pool jobs
+
+def collect(fn, *args):
+    """Run ``fn(*args)`` buffering its metric events; returns ``(ok, result_or_exception, events)``."""
+    token = _collector.set(_Collector(defer=True))
+    try:
+        try:
+            return True, fn(*args), _collector.get().events
+        except Exception as e:
+            return False, e, _collector.get().events
+    finally:
+        _collector.reset(token)
+
+
+def replay(events):
+    for event in events:
+        _emit(event)
+
+
+# Requests
+
+def start_request():
+    """Begin collecting the current request's events; returns the collector."""
+    collector = _Collector(defer=False)
+    _collector.set(collector)
+    return collector
+
+
+def server_timing(collector, total_seconds):
+    """``Server-Timing`` header value: summed duration per stage plus the total."""
+    totals = {}
+    for kind, name, value in collector.events:
+        if kind == "time":
+            totals[name] = totals.get(name, 0.0) + value
+    parts = [f"{name.replace('.', '-')};dur={seconds * 1000:.2f}" for name, seconds in totals.items()]
+    parts.append(f"total;dur={total_seconds * 1000:.2f}")
+    return ", ".join(parts)
+
+
+def render_metrics(gauges=()):
+    """Prometheus text exposition of the registry plus ``(name, help, {labels: value})`` gauges."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    for name, help, samples in gauges:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples.items():
+            lines.append(f"{name}{_format_labels(tuple(k for k, _ in labels), tuple(v for _, v in labels))} {value}")
+    return "\n".join(lines) + "\n"
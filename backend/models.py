@@ -0,0 +1,120 @@
+# backend/models.py
+import threading
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+from inference import EMBED_BATCH_SIZE, create_backend
+from metrics import stage
+
+
+class ModelRegistry:
+    """Face detector and embedder, loaded once per worker.
+
+    ``load`` builds and warms both models; every other method waits for it, so a
+    request that arrives mid-load blocks instead of loading its own copy.
+    The models come from the inference backend chosen by IMAGE_MATCH_INFERENCE
+    (see inference.py); its runtime is imported by ``load``, not with this module.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or create_backend()
+        self.error = None
+        self.load_seconds = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def load(self):
+        with self._lock:
+            if self._ready.is_set():
+                return
+            started = time.perf_counter()
+            try:
+                self.backend.load()
+                # One dummy pass so graph tracing happens now, not on a user request
+                self.represent(np.zeros((224, 224, 3), np.uint8), _warming=True)
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+                print(f"Model warm-up failed: {e}")
+                raise
+            self.load_seconds = round(time.perf_counter() - started, 3)
+            self._ready.set()
+            print(f"Models ready in {self.load_seconds}s")
+
+    def ensure_loaded(self):
+        if not self._ready.is_set():
+            self.load()
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "backend": self.backend.name,
+            "detector": self.backend.detector_name,
+            "embedder": self.backend.embedder_name,
+            **self.backend.info(),
+            "load_seconds": self.load_seconds,
+            "error": self.error
+        }
+
+    def detect(self, bgr: np.ndarray, _warming: bool = False):
+        """Detect and align faces; returns objects with ``img``, ``facial_area`` and ``confidence``."""
+        if not _warming:
+            self.ensure_loaded()
+        # Warm-up passes stay out of the latency metrics
+        with nullcontext() if _warming else stage("detect"):
+            return self.backend.detect(bgr)
+
+    def embed(self, faces_bgr, _warming: bool = False) -> np.ndarray:
+        """Embed a list of BGR face crops in one forward pass."""
+        if not _warming:
+            self.ensure_loaded()
+        if not faces_bgr:
+            return np.zeros((0, 512), np.float32)
+        with nullcontext() if _warming else stage("embed"):
+            return self.backend.embed(faces_bgr)
+
+    def represent(self, bgr: np.ndarray, _warming: bool = False):
+        """Faces with ``facial_area`` and ``embedding``, like ``DeepFace.represent``.
+
+        Falls back to the whole image when no face is found, matching
+        ``enforce_detection=False``.
+        """
+        return self.represent_batch([bgr], _warming=_warming)[0]
+
+    def represent_batch(self, images, batch_size: int = EMBED_BATCH_SIZE, _warming: bool = False):
+        """``represent`` for many images, embedding all their faces in shared batches."""
+        crops, areas, owners = [], [], []
+        for index, bgr in enumerate(images):
+            height, width = bgr.shape[:2]
+            detected = self.detect(bgr, _warming=_warming)
+            if not detected:
+                crops.append(bgr)
+                areas.append({"x": 0, "y": 0, "w": width, "h": height})
+                owners.append(index)
+                continue
+            for face in detected:
+                crops.append(face.img)
+                areas.append({"x": int(face.facial_area.x), "y": int(face.facial_area.y),
+                              "w": int(face.facial_area.w), "h": int(face.facial_area.h)})
+                owners.append(index)
+
+        embeddings = [
+            self.embed(crops[start:start + batch_size], _warming=_warming)
+            for start in range(0, len(crops), batch_size)
+        ]
+        embeddings = np.vstack(embeddings) if embeddings else np.zeros((0, 512), np.float32)
+
+        results = [[] for _ in images]
+        for owner, area, embedding in zip(owners, areas, embeddings):
+            results[owner].append({"facial_area": area, "embedding": embedding})
+        return results
+
+
+# One registry per worker process
+model_registry = ModelRegistry()
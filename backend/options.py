@@ -0,0 +1,55 @@
+# backend/options.py
+"""Request options and score blending shared by the API and the image pipeline.
+
+Nothing here imports OpenCV, scikit-image or the face models, so the API can
+validate requests and blend scores before the heavy stack is loaded.
+"""
+import os
+
+SAME_PERSON_THRESHOLD = 0.75
+
+def blend_scores(face_sim, feature_sim, ssim_score, psnr_score) -> dict:
+    """Advanced blend of the four metrics into the compare score breakdown.
+
+    A ``face_sim`` of None (face stage skipped in cascade mode) is reported as
+    null and counted as 0, so the final similarity is a lower bound.
+    """
+    skipped_face = face_sim is None
+    face_sim = 0.0 if skipped_face else face_sim
+    normalized_psnr = min(psnr_score / 40.0, 1.0)
+    final_score = (face_sim * 0.25) + (feature_sim * 0.25) + (ssim_score * 0.25) + (normalized_psnr * 0.25)
+    is_same_person = final_score > SAME_PERSON_THRESHOLD
+    face_percent = None if skipped_face else round(face_sim * 100, 2)
+    return {
+        "face_structure_similarity": face_percent,
+        "feature_similarity": round(feature_sim * 100, 2),
+        "ssim_similarity": round(ssim_score * 100, 2),
+        "psnr_similarity": round(normalized_psnr * 100, 2),
+        "face_match": face_percent,
+        "final_similarity": round(final_score * 100, 2),
+        "is_same_person": bool(is_same_person)
+    }
+
+# Processing modes for the non-local-means denoise that dominates cleaning cost:
+#   full     one pass over the whole image
+#   tiled    overlapping tiles denoised in parallel; same output as full
+#   preview  denoise a downscaled copy, then guided-upsample back to full size
+#   auto     tiled for large images when more than one core is available, else full
+CLEAN_MODES = ("auto", "full", "tiled", "preview")
+DEFAULT_CLEAN_MODE = os.environ.get("IMAGE_MATCH_CLEAN_MODE", "auto")
+
+# Bump whenever a change alters cleaned output, so cached results are not reused
+CLEAN_PIPELINE_VERSION = 3
+
+# Bump whenever a change alters compare scores, so memoised scores are not reused
+COMPARE_SCORING_VERSION = 1
+
+# Cleaning steps, in the order they are offered to clients
+CLEAN_OPERATIONS = ("enhance", "remove_bg", "brighten", "denoise", "sharpen")
+
+# File extension per cleaned-image output format (encoder settings live in utils)
+CLEAN_OUTPUT_EXTENSIONS = {
+    "png": ".png",
+    "webp": ".webp",
+    "jpeg": ".jpg"
+}
@@ -0,0 +1,122 @@
+# backend/reports.py
+"""PNG and PDF report rendering (Pillow and fpdf only)."""
+import io
+from datetime import datetime
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+from fpdf import FPDF
+
+from artifact_store import artifact_store
+from metrics import stage
+
+@lru_cache(maxsize=1)
+def _report_fonts():
+    """TrueType fonts for reports, loaded once per process."""
+    try:
+        font_large = ImageFont.truetype("arial.ttf", 60)
+        font_med = ImageFont.truetype("arial.ttf", 40)
+        font_small = ImageFont.truetype("arial.ttf", 30)
+    except:
+        font_large = ImageFont.load_default()
+        font_med = ImageFont.load_default()
+        font_small = ImageFont.load_default()
+    return font_large, font_med, font_small
+
+@lru_cache(maxsize=4)
+def _report_template(title: str):
+    """Static report layer (canvas and title); callers draw on a copy."""
+    width, height = 1400, 900  # Higher resolution
+    report = Image.new('RGB', (width, height), color=(250, 250, 250))
+    draw = ImageDraw.Draw(report)
+    draw.text((100, 50), title, fill="black", font=_report_fonts()[0])
+    return report
+
+def _report_thumbnail(path):
+    img = Image.open(io.BytesIO(artifact_store.read(path)))
+    img.draft("RGB", (400, 400))  # Let JPEG decode at reduced scale
+    img = img.resize((400, 400))
+    if img.mode in ("RGBA", "LA"):
+        # Background-removed images show on white
+        flat = Image.new("RGB", img.size, "white")
+        flat.paste(img, mask=img.getchannel("A"))
+        img = flat
+    return img
+
+def _store_png(report, output_path):
+    buffer = io.BytesIO()
+    report.save(buffer, format="PNG", dpi=(300,300))
+    artifact_store.put(output_path, buffer.getvalue())
+
+def _store_pdf(pdf, output_path):
+    # fpdf builds the document as a latin-1 str
+    artifact_store.put(output_path, pdf.output(dest="S").encode("latin1"))
+
+def generate_report_image(img1_path, img2_path, result, output_path):
+    try:
+        with stage("report.image"):
+            report = _report_template("IMAGE MATCH PRO - ADVANCED SIMILARITY REPORT").copy()
+            draw = ImageDraw.Draw(report)
+            font_large, font_med, font_small = _report_fonts()
+
+            report.paste(_report_thumbnail(img1_path), (100, 200))
+            report.paste(_report_thumbnail(img2_path), (600, 200))
+
+            draw.text((100, 130), f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", fill="gray", font=font_small)
+
+            color = "green" if result['is_same_person'] else "red"
+            draw.text((100, 650), f"FINAL SIMILARITY: {result['final_similarity']}%", fill=color, font=font_large)
+            draw.text((100, 730), f"FACE MATCH: {result['face_similarity']}%", fill="black", font=font_med)
+            verdict = "SAME PERSON" if result['is_same_person'] else "DIFFERENT PERSON"
+            draw.text((100, 800), f"VERDICT: {verdict}", fill=color, font=font_large)
+
+            _store_png(report, output_path)
+    except Exception as e:
+        print(f"Report image failed: {e}")
+
+def generate_report_pdf(report_img_path, result, output_path):
+    try:
+        with stage("report.pdf"):
+            pdf = FPDF()
+            pdf.add_page()
+            with artifact_store.local_copy(report_img_path) as img_path:
+                pdf.image(img_path, x=10, y=10, w=190)
+            pdf.set_font("Arial", 'B', 16)
+            pdf.cell(0, 20, f"Image Match Pro Report - {datetime.now().strftime('%Y-%m-%d')}", ln=1, align='C')
+            pdf.cell(0, 15, f"Final Similarity: {result['final_similarity']}%", ln=1)
+            pdf.cell(0, 15, f"Face Match: {result['face_similarity']}%", ln=1)
+            _store_pdf(pdf, output_path)
+    except Exception as e:
+        print(f"PDF failed: {e}")
+
+def generate_clean_report_image(orig_path, cleaned_path, result, output_path):
+    try:
+        with stage("clean_report.image"):
+            report = _report_template("IMAGE CLEAN PRO - ENHANCEMENT REPORT").copy()
+            draw = ImageDraw.Draw(report)
+            font_large, font_med, font_small = _report_fonts()
+
+            report.paste(_report_thumbnail(orig_path), (100, 200))
+            report.paste(_report_thumbnail(cleaned_path), (600, 200))
+
+            draw.text((100, 130), f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", fill="gray", font=font_small)
+            draw.text((100, 650), f"Operation: {result.get('operation', 'Unknown')}", fill="black", font=font_large)
+            draw.text((100, 730), "Original (Left) vs Processed (Right)", fill="black", font=font_med)
+
+            _store_png(report, output_path)
+    except Exception as e:
+        print(f"Clean report image failed: {e}")
+
+def generate_clean_report_pdf(report_img_path, result, output_path):
+    try:
+        with stage("clean_report.pdf"):
+            pdf = FPDF()
+            pdf.add_page()
+            with artifact_store.local_copy(report_img_path) as img_path:
+                pdf.image(img_path, x=10, y=10, w=190)
+            pdf.set_font("Arial", 'B', 16)
+            pdf.cell(0, 20, f"Image Clean Pro Report - {datetime.now().strftime('%Y-%m-%d')}", ln=1, align='C')
+            pdf.cell(0, 15, f"Operation: {result.get('operation', 'Unknown')}", ln=1)
+            _store_pdf(pdf, output_path)
+    except Exception as e:
+        print(f"Clean PDF failed: {e}")
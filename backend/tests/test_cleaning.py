@@ -0,0 +1,91 @@
+# backend/tests/test_cleaning.py
+"""The in-memory cleaning pipeline against the old one-OpenCV-call-per-step code.
+
+Denoise and sharpen must match exactly. Enhance and brighten fold their
+gamma and HSV value lifts into one table instead of round-tripping through
+HSV, so they may differ by the HSV conversion's rounding: at most 6 grey
+levels, and on fewer than 1% of channel values by more than 3.
+"""
+import cv2
+import numpy as np
+import pytest
+
+import utils
+
+INTENSITIES = [0.3, 0.5, 0.8, 1.0]
+MAX_TONE_DIFF = 6
+MAX_FRACTION_OVER_3 = 0.01
+
+
+def _scene(seed):
+    """A fixed 320x240 image: gradients, filled circles and seeded noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:240, 0:320]
+    img = np.dstack([x % 256, (y * 0.9) % 256, ((x + y) // 3) % 256]).astype(np.float64)
+    for _ in range(10):
+        center = tuple(int(v) for v in rng.integers(0, 300, 2))
+        cv2.circle(img, center, int(rng.integers(10, 50)), tuple(float(v) for v in rng.integers(0, 256, 3)), -1)
+    return np.clip(img + rng.normal(0, 15, img.shape), 0, 255).astype(np.uint8)
+
+
+@pytest.fixture(scope="module", params=[1, 2])
+def scene(request):
+    return _scene(request.param)
+
+
+# Reference steps, as the per-operation functions ran them before the pipeline
+
+def _clahe(img, clip_limit):
+    l, a, b = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2LAB))
+    l = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8)).apply(l)
+    return cv2.cvtColor(cv2.merge((l, a, b)), cv2.COLOR_LAB2BGR)
+
+
+def _lift_value(img, amount):
+    h, s, v = cv2.split(cv2.cvtColor(img, cv2.COLOR_BGR2HSV))
+    v = np.clip(cv2.add(v, amount), 0, 255)
+    return cv2.cvtColor(cv2.merge((h, s, v)), cv2.COLOR_HSV2BGR)
+
+
+def _enhance(img, intensity):
+    img = utils.denoise_colored(img, int(10 * intensity), 7, 21, "full")
+    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]]) * intensity
+    img = cv2.filter2D(_clahe(img, 3.0 * intensity), -1, kernel)
+    return _lift_value(img, int(20 * intensity))
+
+
+def _brighten(img, intensity):
+    img = _clahe(utils.denoise_colored(img, int(15 * intensity), 10, 30, "full"), 4.0 * intensity)
+    gamma = 1.0 + (1 - np.mean(cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)) / 255) * 1.5 * intensity
+    table = np.array([((i / 255.0) ** (1.0 / gamma)) * 255 for i in np.arange(0, 256)]).astype("uint8")
+    return _lift_value(cv2.LUT(img, table), int(40 * intensity))
+
+
+def _denoise(img, intensity):
+    img = cv2.fastNlMeansDenoisingColored(img, None, int(15 * intensity), int(15 * intensity), 7, 21)
+    return cv2.bilateralFilter(img, d=int(9 * intensity), sigmaColor=75, sigmaSpace=75)
+
+
+def _sharpen(img, intensity):
+    gaussian = cv2.GaussianBlur(img, (0, 0), 3 * intensity)
+    return cv2.addWeighted(img, 1.5 * intensity, gaussian, -0.5 * intensity, 0)
+
+
+def _run(operation, img, intensity):
+    pipe = utils.CleanPipeline(img.copy(), "full")
+    utils.CLEAN_STEPS[operation](pipe, intensity)
+    return pipe.image
+
+
+@pytest.mark.parametrize("intensity", INTENSITIES)
+@pytest.mark.parametrize("operation, reference", [("enhance", _enhance), ("brighten", _brighten)])
+def test_folded_tone_steps_stay_within_tolerance(scene, operation, reference, intensity):
+    diff = np.abs(_run(operation, scene, intensity).astype(np.int16) - reference(scene, intensity))
+    assert diff.max() <= MAX_TONE_DIFF
+    assert (diff > 3).mean() < MAX_FRACTION_OVER_3
+
+
+@pytest.mark.parametrize("intensity", INTENSITIES)
+@pytest.mark.parametrize("operation, reference", [("denoise", _denoise), ("sharpen", _sharpen)])
+def test_spatial_steps_match_exactly(scene, operation, reference, intensity):
+    np.testing.assert_array_equal(_run(operation, scene, intensity), reference(scene, intensity))
@@ -0,0 +1,37 @@
+# backend/tests/test_denoise.py
+"""Tiled NLM denoising must reproduce the single full-image pass exactly."""
+import cv2
+import numpy as np
+import pytest
+
+import utils
+
+# (h, templateWindowSize, searchWindowSize) as used by the cleaning steps and OpenCV's defaults
+NLM_SETTINGS = [(10, 7, 21), (6, 7, 21), (15, 5, 11)]
+
+
+@pytest.fixture(scope="module")
+def noisy():
+    """A fixed 300x250 image with structure and seeded noise."""
+    rng = np.random.default_rng(3)
+    y, x = np.mgrid[0:300, 0:250]
+    img = np.dstack([x % 256, (y * 0.8) % 256, ((x * y) // 97) % 256]).astype(np.float64)
+    for _ in range(8):
+        center = tuple(int(v) for v in rng.integers(0, 250, 2))
+        cv2.circle(img, center, int(rng.integers(10, 40)), tuple(float(v) for v in rng.integers(0, 256, 3)), -1)
+    return np.clip(img + rng.normal(0, 20, img.shape), 0, 255).astype(np.uint8)
+
+
+@pytest.mark.parametrize("h, template_size, search_size", NLM_SETTINGS)
+def test_tiled_denoise_matches_single_pass(monkeypatch, noisy, h, template_size, search_size):
+    # Small tiles so the image spans a 4x5 grid, including ragged edge tiles
+    monkeypatch.setattr(utils, "TILE_SIZE", 64)
+    tiled = utils._denoise_tiled(noisy, h, template_size, search_size)
+    full = cv2.fastNlMeansDenoisingColored(noisy, None, h, h, template_size, search_size)
+    np.testing.assert_array_equal(tiled, full)
+
+
+def test_tiled_mode_dispatches_to_tiles(monkeypatch, noisy):
+    monkeypatch.setattr(utils, "TILE_SIZE", 64)
+    full = cv2.fastNlMeansDenoisingColored(noisy, None, 10, 10, 7, 21)
+    np.testing.assert_array_equal(utils.denoise_colored(noisy, 10, 7, 21, mode="tiled"), full)
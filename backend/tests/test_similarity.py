@@ -0,0 +1,91 @@
+# backend/tests/test_similarity.py
+"""The vectorized batch metrics must score exactly like the per-pair reference code."""
+import cv2
+import numpy as np
+import pytest
+from skimage.metrics import peak_signal_noise_ratio, structural_similarity
+
+from batch_metrics import (
+    GOOD_MATCH_DISTANCE, batch_feature_similarity, batch_psnr, batch_ssim, pack_descriptors
+)
+
+
+def _scene(seed):
+    """A fixed 200x200 test image: gradient background, shapes and seeded noise."""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:200, 0:200]
+    img = np.dstack([(x + seed * 7) % 256, (y * 1.2) % 256, ((x + y) // 2) % 256]).astype(np.uint8)
+    for _ in range(12):
+        center = tuple(int(v) for v in rng.integers(10, 190, 2))
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        cv2.circle(img, center, int(rng.integers(5, 30)), color, -1)
+        corner = tuple(int(v) for v in rng.integers(0, 180, 2))
+        cv2.rectangle(img, corner, (corner[0] + 20, corner[1] + 15), color[::-1], 2)
+    noise = rng.normal(0, 6, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.fixture(scope="module")
+def images():
+    probe = _scene(1)
+    candidates = [
+        probe.copy(),                                             # identical
+        cv2.GaussianBlur(probe, (5, 5), 1.5),                     # blurred
+        np.roll(probe, (6, -4), axis=(0, 1)),                     # shifted
+        cv2.convertScaleAbs(probe, alpha=0.8, beta=30),           # contrast change
+        _scene(2),                                                # unrelated
+        np.full_like(probe, 128),                                 # flat
+    ]
+    return probe, candidates
+
+
+def _gray(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+def _orb(gray):
+    _, des = cv2.ORB_create(nfeatures=300).detectAndCompute(gray, None)
+    return des
+
+
+def _reference_feature_similarity(des1, des2):
+    if des1 is None or des2 is None:
+        return 0.0
+    matches = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True).match(des1, des2)
+    good = [m for m in matches if m.distance < GOOD_MATCH_DISTANCE]
+    return max(0.0, min(1.0, len(good) / max(len(matches), 1)))
+
+
+def test_batch_ssim_matches_skimage(images):
+    probe, candidates = images
+    grays = np.stack([_gray(img) for img in candidates])
+    expected = [
+        structural_similarity(_gray(probe), gray, data_range=gray.max() - gray.min())
+        for gray in grays
+    ]
+    expected = np.nan_to_num(expected, nan=0.0)
+    np.testing.assert_allclose(batch_ssim(_gray(probe), grays), expected, rtol=0, atol=1e-5)
+
+
+def test_batch_psnr_matches_skimage(images):
+    probe, candidates = images
+    with np.errstate(divide="ignore"):
+        expected = [peak_signal_noise_ratio(probe, img) for img in candidates]
+    np.testing.assert_allclose(batch_psnr(probe, np.stack(candidates)), expected, rtol=1e-12)
+
+
+def test_batch_orb_matches_bfmatcher_cross_check(images):
+    probe, candidates = images
+    probe_des = _orb(_gray(probe))
+    descriptors = [_orb(_gray(img)) for img in candidates]
+    packed, offsets = pack_descriptors(descriptors)
+    expected = [_reference_feature_similarity(probe_des, des) for des in descriptors]
+    assert batch_feature_similarity(probe_des, packed, offsets).tolist() == pytest.approx(expected, abs=1e-12)
+
+
+def test_batch_metrics_handle_empty_batches(images):
+    probe, _ = images
+    packed, offsets = pack_descriptors([])
+    assert batch_feature_similarity(_orb(_gray(probe)), packed, offsets).shape == (0,)
+    assert batch_ssim(_gray(probe), np.zeros((0, 200, 200), np.uint8)).shape == (0,)
+    assert batch_psnr(probe, np.zeros((0, 200, 200, 3), np.uint8)).shape == (0,)
@@ -0,0 +1,229 @@
+# backend/upload_index.py
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from artifact_store import artifact_store
+from inference import INFERENCE_BACKEND
+from options import COMPARE_SCORING_VERSION
+
+HASH_BITS = 64
+BAND_BITS = 16
+BANDS = HASH_BITS // BAND_BITS
+BAND_MASK = (1 << BAND_BITS) - 1
+
+# Set bits per byte value, for popcount over uint64 hashes viewed as bytes
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+
+
+def _signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def _unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class UploadIndex:
+    """Stored uploads keyed by content hash, with a pHash near-duplicate index.
+
+    Every stored upload is recorded with the SHA-256 of its bytes, so a
+    re-upload of identical content reuses the stored artifact instead of writing
+    a new one. Compare scores are memoised in the same database under keys
+    built from content hashes, the inference backend and the scoring version;
+    the least recently used are dropped beyond ``max_results``.
+
+    The 64-bit pHashes are kept in memory in a multi-index hash table: each
+    hash is split into four 16-bit bands with one bucket table per band. Two
+    hashes within Hamming distance 3 must agree exactly on at least one band,
+    so small radii only check the matching buckets; larger radii scan every
+    hash with one vectorised XOR and popcount. Rows added by other processes
+    are picked up by rowid before each query.
+    """
+
+    def __init__(self, db_path="uploads.db", max_results=None):
+        self.db_path = db_path
+        self.max_results = max_results or int(os.environ.get("IMAGE_MATCH_COMPARE_RESULTS", 100_000))
+        self._lock = threading.Lock()
+        self._schema_ready = False
+        self._last_rowid = 0
+        self._hashes = np.zeros(0, np.uint64)
+        self._keys = []
+        self._bands = [{} for _ in range(BANDS)]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._schema_ready:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS uploads (
+                    content_hash TEXT PRIMARY KEY,
+                    path TEXT,
+                    phash INTEGER,
+                    dhash INTEGER,
+                    size INTEGER,
+                    first_seen TEXT,
+                    hits INTEGER DEFAULT 0
+                )
+            ''')
+            # Replaced by compare_results; its keys carried no backend or scoring version
+            conn.execute("DROP TABLE IF EXISTS results")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS compare_results (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT,
+                    created TEXT,
+                    last_access REAL
+                )
+            ''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_compare_results_access ON compare_results(last_access)")
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS compare_totals (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    entries INTEGER
+                )
+            ''')
+            conn.execute("INSERT OR IGNORE INTO compare_totals (id, entries) "
+                         "SELECT 0, COUNT(*) FROM compare_results")
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    # Exact duplicates
+
+    def lookup(self, content_hash):
+        """Stored path of identical content, or None if unknown or the file is gone."""
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT path FROM uploads WHERE content_hash = ?", (content_hash,)).fetchone()
+            if not row or not artifact_store.exists(row[0]):
+                return None
+            conn.execute("UPDATE uploads SET hits = hits + 1 WHERE content_hash = ?", (content_hash,))
+            conn.commit()
+        finally:
+            conn.close()
+        return row[0]
+
+    def register(self, content_hash, fingerprint, path, size):
+        """Record a newly stored upload (``fingerprint`` from ``fingerprint_upload``)."""
+        conn = self._connect()
+        try:
+            conn.execute('''
+                INSERT INTO uploads (content_hash, path, phash, dhash, size, first_seen)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO UPDATE SET path = excluded.path
+            ''', (content_hash, path, _signed(fingerprint["phash"]),
+                  _signed(fingerprint["dhash"]), size, datetime.now().isoformat()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # Compare scores
+
+    @staticmethod
+    def compare_key(mode, hash1, hash2) -> str:
+        return f"compare:{mode}:{INFERENCE_BACKEND}:v{COMPARE_SCORING_VERSION}:{hash1}:{hash2}"
+
+    def get_result(self, key):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT payload FROM compare_results WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE compare_results SET last_access = ? WHERE key = ?", (time.time(), key))
+                conn.commit()
+        finally:
+            conn.close()
+        return json.loads(row[0]) if row else None
+
+    def put_result(self, key, payload):
+        """Memoise scores for ``key``, dropping the least recently used beyond ``max_results``."""
+        conn = self._connect()
+        try:
+            known = conn.execute("SELECT 1 FROM compare_results WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO compare_results (key, payload, created, last_access) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload), datetime.now().isoformat(), time.time())
+            )
+            if not known:
+                conn.execute("UPDATE compare_totals SET entries = entries + 1 WHERE id = 0")
+            entries = conn.execute("SELECT entries FROM compare_totals WHERE id = 0").fetchone()[0]
+            if entries > self.max_results:
+                dropped = conn.execute('''
+                    DELETE FROM compare_results WHERE key IN (
+                        SELECT key FROM compare_results WHERE key != ? ORDER BY last_access ASC LIMIT ?
+                    )
+                ''', (key, entries - self.max_results)).rowcount
+                conn.execute("UPDATE compare_totals SET entries = entries - ? WHERE id = 0", (dropped,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # Near duplicates
+
+    def _refresh(self):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT rowid, content_hash, phash FROM uploads WHERE rowid > ? ORDER BY rowid",
+                (self._last_rowid,)
+            ).fetchall()
+        finally:
+            conn.close()
+        if not rows:
+            return
+        start = len(self._keys)
+        hashes = [_unsigned(row[2]) for row in rows]
+        self._hashes = np.concatenate([self._hashes, np.array(hashes, np.uint64)])
+        for offset, value in enumerate(hashes):
+            for band in range(BANDS):
+                key = (value >> (band * BAND_BITS)) & BAND_MASK
+                self._bands[band].setdefault(key, []).append(start + offset)
+        self._keys.extend(row[1] for row in rows)
+        self._last_rowid = rows[-1][0]
+
+    def near(self, phash_value, radius=8, limit=20):
+        """Stored uploads whose pHash is within ``radius`` bits, closest first."""
+        with self._lock:
+            self._refresh()
+            if radius < BANDS:
+                candidates = set()
+                for band in range(BANDS):
+                    key = (phash_value >> (band * BAND_BITS)) & BAND_MASK
+                    candidates.update(self._bands[band].get(key, ()))
+                rows = np.fromiter(candidates, np.int64, len(candidates))
+            else:
+                rows = np.arange(len(self._keys))
+            if rows.shape[0] == 0:
+                return []
+            xor = self._hashes[rows] ^ np.uint64(phash_value)
+            distances = _POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+            keep = distances <= radius
+            rows, distances = rows[keep], distances[keep]
+            order = np.argsort(distances, kind="stable")[:limit]
+            hits = [(self._keys[rows[i]], int(distances[i])) for i in order]
+
+        if not hits:
+            return []
+        conn = self._connect()
+        try:
+            placeholders = ",".join("?" * len(hits))
+            paths = dict(conn.execute(
+                f"SELECT content_hash, path FROM uploads WHERE content_hash IN ({placeholders})",
+                [content_hash for content_hash, _ in hits]
+            ).fetchall())
+        finally:
+            conn.close()
+        return [
+            {"content_hash": content_hash, "path": f"/{paths[content_hash]}", "distance": distance}
+            for content_hash, distance in hits
+            if content_hash in paths and artifact_store.exists(paths[content_hash])
+        ]
+
+
+# Shared index next to history.db
+upload_index = UploadIndex()
@@ -1,325 +1,795 @@
 # backend/utils.py
 import cv2
 import numpy as np
-from PIL import Image, ImageDraw, ImageFont
-from deepface import DeepFace
-from fpdf import FPDF
 from skimage.metrics import structural_similarity as ssim
 from skimage.metrics import peak_signal_noise_ratio as psnr
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import hashlib
 import os
+import time
 
-def get_face_similarity(img1_path: str, img2_path: str) -> float:
+from artifact_store import artifact_store
+from batch_metrics import batch_feature_similarity, batch_psnr, batch_ssim, pack_descriptors
+from embedding_cache import embedding_cache
+from ingest import check_dimensions
+from metrics import collect, observe, record_cache, record_error, replay, stage
+from models import model_registry
+from options import (
+    CLEAN_MODES,
+    CLEAN_OUTPUT_EXTENSIONS,
+    DEFAULT_CLEAN_MODE,
+    SAME_PERSON_THRESHOLD
+)
+# Report rendering lives in reports.py; re-exported for existing callers
+from reports import (
+    generate_clean_report_image,
+    generate_clean_report_pdf,
+    generate_report_image,
+    generate_report_pdf
+)
+
+class ImageContext:
+    """Decoded image shared by every comparison metric.
+
+    Each upload is decoded once; the grayscale copy, the 200x200 thumbnails and
+    the detected faces are derived from that single decode and reused.
+    """
+
+    def __init__(self, bgr: np.ndarray, content_hash: str = None):
+        self.bgr = bgr
+        self.content_hash = content_hash or hashlib.sha256(bgr.tobytes()).hexdigest()
+        self.gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        self.small = cv2.resize(bgr, (200, 200))  # Very small for speed
+        self.small_gray = cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY)
+        self._faces = None
+        self._orb = None
+
+    @property
+    def faces(self):
+        """Detected faces as dicts with ``facial_area`` and ``embedding``.
+
+        Looked up in the embedding cache by content hash first, so a repeated
+        image skips detection and embedding entirely.
+        """
+        if self._faces is None:
+            load_faces([self])
+        return self._faces
+
+    @property
+    def orb_descriptors(self):
+        """ORB descriptors of the 200x200 grayscale thumbnail (None if no keypoints)."""
+        if self._orb is None:
+            orb = cv2.ORB_create(nfeatures=300)
+            _, des = orb.detectAndCompute(self.small_gray, None)
+            self._orb = (des,)
+        return self._orb[0]
+
+    @property
+    def face_crops(self):
+        crops = []
+        for face in self.faces:
+            area = face["facial_area"]
+            x, y, w, h = area["x"], area["y"], area["w"], area["h"]
+            if w > 0 and h > 0:
+                crops.append(self.bgr[y:y + h, x:x + w])
+        return crops
+
+    def release(self):
+        """Drop the full-resolution arrays once faces are loaded.
+
+        ORB descriptors are derived first, so a released context still serves
+        every batch metric from its thumbnails, descriptors and embeddings.
+        """
+        self.orb_descriptors
+        self.bgr = self.gray = None
+        return self
+
+
+def load_faces(contexts):
+    """Fill ``faces`` for many contexts, embedding every cache miss in one batch."""
+    missing = {}
+    for ctx in contexts:
+        if ctx._faces is None:
+            ctx._faces = embedding_cache.get(ctx.content_hash)
+            record_cache("embedding", ctx._faces is not None)
+        if ctx._faces is None:
+            missing.setdefault(ctx.content_hash, []).append(ctx)
+    if not missing:
+        return
+    groups = list(missing.values())
+    for group, faces in zip(groups, model_registry.represent_batch([group[0].bgr for group in groups])):
+        faces = embedding_cache.put(group[0].content_hash, faces)
+        for ctx in group:
+            ctx._faces = faces
+
+
+def decode_image(data: bytes, flags: int = cv2.IMREAD_COLOR) -> np.ndarray:
+    """Decode encoded image bytes in memory; raises ValueError if undecodable or oversized.
+
+    Bytes whose header Pillow cannot read are refused before OpenCV sees them:
+    their size is unknown, and ``cv2.imdecode`` applies no pixel limit of ours.
+    """
+    if not data or check_dimensions(data) is None:
+        raise ValueError("Could not decode image")
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if img is None:
+        raise ValueError("Could not decode image")
+    return img
+
+
+def load_image_context(data: bytes) -> ImageContext:
+    """Decode raw upload bytes straight into an ImageContext."""
+    with stage("decode"):
+        return ImageContext(decode_image(data), hashlib.sha256(data).hexdigest())
+
+
+def _as_context(image) -> ImageContext:
+    if isinstance(image, ImageContext):
+        return image
+    return load_image_context(artifact_store.read(image))
+
+
+def _cosine_distance(a, b) -> float:
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    if denom == 0:
+        return 1.0
+    return float(1 - np.dot(a, b) / denom)
+
+
+def get_face_similarity(img1, img2) -> float:
     try:
-        result = DeepFace.verify(
-            img1_path, img2_path,
-            model_name="Facenet512",
-            detector_backend="retinaface",
-            enforce_detection=False,
-            distance_metric="cosine",
-            silent=True
-        )
-        distance = result.get("distance", 1.0)
-        similarity = 1 - distance
-        return max(0.0, min(1.0, similarity))
+        with stage("face_similarity"):
+            ctx1, ctx2 = _as_context(img1), _as_context(img2)
+            # Same rule as DeepFace.verify: closest pair of faces across both images
+            distance = min(
+                (_cosine_distance(f1["embedding"], f2["embedding"])
+                 for f1 in ctx1.faces for f2 in ctx2.faces),
+                default=1.0
+            )
+            similarity = 1 - distance
+            return max(0.0, min(1.0, similarity))
     except Exception as e:
         print(f"Face similarity failed: {e}")
         return 0.0
 
-def get_feature_similarity(img1_path: str, img2_path: str) -> float:
+def get_feature_similarity(img1, img2) -> float:
     try:
-        img1 = cv2.imread(img1_path, cv2.IMREAD_GRAYSCALE)
-        img2 = cv2.imread(img2_path, cv2.IMREAD_GRAYSCALE)
-        
-        img1 = cv2.resize(img1, (200, 200))  # Very small for speed
-        img2 = cv2.resize(img2, (200, 200))
-        
-        orb = cv2.ORB_create(nfeatures=300)
-        kp1, des1 = orb.detectAndCompute(img1, None)
-        kp2, des2 = orb.detectAndCompute(img2, None)
-        
-        if des1 is None or des2 is None:
-            return 0.0
-        
-        bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
-        matches = bf.match(des1, des2)
-        matches = sorted(matches, key=lambda x: x.distance)
-        
-        good_matches = [m for m in matches if m.distance < 50]
-        similarity = len(good_matches) / max(len(matches), 1)
-        return max(0.0, min(1.0, similarity))
+        with stage("orb"):
+            ctx1, ctx2 = _as_context(img1), _as_context(img2)
+            des1, des2 = ctx1.orb_descriptors, ctx2.orb_descriptors
+
+            if des1 is None or des2 is None:
+                return 0.0
+
+            bf = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+            matches = bf.match(des1, des2)
+            matches = sorted(matches, key=lambda x: x.distance)
+
+            good_matches = [m for m in matches if m.distance < 50]
+            similarity = len(good_matches) / max(len(matches), 1)
+            return max(0.0, min(1.0, similarity))
     except Exception as e:
         print(f"Feature similarity failed: {e}")
         return 0.0
 
-def get_ssim_psnr(img1_path: str, img2_path: str):
+def get_ssim_psnr(img1, img2):
     try:
-        img1 = cv2.imread(img1_path)
-        img2 = cv2.imread(img2_path)
-        img1 = cv2.resize(img1, (200, 200))
-        img2 = cv2.resize(img2, (200, 200))
-        gray1 = cv2.cvtColor(img1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(img2, cv2.COLOR_BGR2GRAY)
-        
-        ssim_score = ssim(gray1, gray2, data_range=gray2.max() - gray2.min())
-        psnr_score = psnr(img1, img2)
-        return ssim_score, psnr_score
+        with stage("ssim_psnr"):
+            ctx1, ctx2 = _as_context(img1), _as_context(img2)
+            gray1, gray2 = ctx1.small_gray, ctx2.small_gray
+
+            ssim_score = ssim(gray1, gray2, data_range=gray2.max() - gray2.min())
+            psnr_score = psnr(ctx1.small, ctx2.small)
+            return ssim_score, psnr_score
     except Exception as e:
         print(f"SSIM/PSNR failed: {e}")
         return 0.0, 0.0
 
-def advanced_enhance(input_path: str, output_path: str, intensity: float = 0.5):
-    try:
-        img = cv2.imread(input_path)
-        height, width = img.shape[:2]
-        
-        # Denoise
-        denoised = cv2.fastNlMeansDenoisingColored(img, None, int(10 * intensity), int(10 * intensity), 7, 21)
-        
-        # Contrast enhancement
-        lab = cv2.cvtColor(denoised, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=3.0 * intensity, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        lab = cv2.merge((l, a, b))
-        enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-        
-        # Sharpen
-        kernel = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]]) * intensity
-        sharpened = cv2.filter2D(enhanced, -1, kernel)
-        
-        # Brightness
-        hsv = cv2.cvtColor(sharpened, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        v = cv2.add(v, int(20 * intensity))
-        v = np.clip(v, 0, 255)
-        hsv = cv2.merge((h, s, v))
-        final = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-        
-        final = cv2.resize(final, (width, height))
-        cv2.imwrite(output_path, final, [cv2.IMWRITE_PNG_COMPRESSION, 0])  # High quality
-    except Exception as e:
-        print(f"Advanced enhance failed: {e}")
+def compute_similarity_scores(data1: bytes, data2: bytes):
+    """Decode both uploads once and run every metric on the shared contexts.
 
-def remove_background(input_path: str, output_path: str):
-    try:
-        img = cv2.imread(input_path)
-        height, width = img.shape[:2]
-        
-        # Detect faces
-        try:
-            faces = DeepFace.extract_faces(img_path=input_path, detector_backend="retinaface", enforce_detection=False)
-        except:
-            faces = []
-        
-        mask = np.zeros(img.shape[:2], np.uint8)
-        
-        has_person = False
-        
-        # For each face, mark face and body
-        for face in faces:
-            coords = face["facial_area"]
-            x, y, w, h = coords['x'], coords['y'], coords['w'], coords['h']
-            if w <= 0 or h <= 0:
-                continue
-            
-            has_person = True
-            
-            # Face definite foreground
-            cv2.rectangle(mask, (x, y, x+w, y+h), cv2.GC_FGD, -1)
-            
-            # Body estimation: ellipse for dress shape
-            center = (int(x + w/2), int(y + h/2))
-            axes = (int(w * 1.5), int(h * 4))
-            if axes[0] > 0 and axes[1] > 0:
-                cv2.ellipse(mask, center, axes, 0, 0, 360, cv2.GC_PR_FGD, -1)
-        
-        # If no person detected, fallback to center rect
-        if not has_person:
-            rect = (width//4, height//4, width//2, height//2)
-            bgdModel = np.zeros((1,65), np.float64)
-            fgdModel = np.zeros((1,65), np.float64)
-            cv2.grabCut(img, mask, rect, bgdModel, fgdModel, 5, cv2.GC_INIT_WITH_RECT)
-        else:
-            # Dress shape detection using edges
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-            edges = cv2.Canny(blurred, 30, 100)
-            dilated_edges = cv2.dilate(edges, np.ones((3,3), np.uint8), iterations=1)
-            
-            # Find contours for dress/body shapes
-            contours, _ = cv2.findContours(dilated_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            # Fill large contours (people/dress)
-            for cnt in contours:
-                area = cv2.contourArea(cnt)
-                if area > 5000:
-                    cv2.fillPoly(mask, [cnt], cv2.GC_PR_FGD)
-            
-            # Edges to background
-            mask[0:20, :] = cv2.GC_BGD
-            mask[:, 0:20] = cv2.GC_BGD
-            mask[height-20:height, :] = cv2.GC_BGD
-            mask[:, width-20:width] = cv2.GC_BGD
-            
-            # GrabCut
-            bgdModel = np.zeros((1,65), np.float64)
-            fgdModel = np.zeros((1,65), np.float64)
-            cv2.grabCut(img, mask, None, bgdModel, fgdModel, 8, cv2.GC_INIT_WITH_MASK)
-        
-        # Final mask
-        mask2 = np.where((mask==cv2.GC_BGD)|(mask==cv2.GC_PR_BGD), 0, 1).astype('uint8')
-        
-        # White background
-        result = img.copy()
-        result[mask2 == 0] = [255, 255, 255]
-        
-        cv2.imwrite(output_path, result, [cv2.IMWRITE_PNG_COMPRESSION, 0])
-    except Exception as e:
-        print(f"Background removal failed: {e}")
+    Returns ``(face_sim, feature_sim, ssim_score, psnr_score)``; raises
+    ValueError if either upload cannot be decoded.
+    """
+    ctx1 = load_image_context(data1)
+    ctx2 = load_image_context(data2)
+    face_sim = get_face_similarity(ctx1, ctx2)
+    feature_sim = get_feature_similarity(ctx1, ctx2)
+    ssim_score, psnr_score = get_ssim_psnr(ctx1, ctx2)
+    return face_sim, feature_sim, ssim_score, psnr_score
 
-def brighten_dark_image(input_path: str, output_path: str, intensity: float = 0.5):
-    try:
-        img = cv2.imread(input_path)
-        height, width = img.shape[:2]
-        
-        # Denoise
-        denoised = cv2.fastNlMeansDenoisingColored(img, None, int(15 * intensity), int(15 * intensity), 10, 30)
-        
-        # CLAHE
-        lab = cv2.cvtColor(denoised, cv2.COLOR_BGR2LAB)
-        l, a, b = cv2.split(lab)
-        clahe = cv2.createCLAHE(clipLimit=4.0 * intensity, tileGridSize=(8,8))
-        l = clahe.apply(l)
-        lab = cv2.merge((l, a, b))
-        bright = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
-        
-        # Gamma
-        avg_brightness = np.mean(cv2.cvtColor(bright, cv2.COLOR_BGR2GRAY))
-        gamma = 1.0 + (1 - avg_brightness / 255) * 1.5 * intensity
-        inv_gamma = 1.0 / gamma
-        table = np.array([((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
-        bright = cv2.LUT(bright, table)
-        
-        # HSV boost
-        hsv = cv2.cvtColor(bright, cv2.COLOR_BGR2HSV)
-        h, s, v = cv2.split(hsv)
-        v = np.clip(v.astype(np.uint16) + int(40 * intensity), 0, 255).astype(np.uint8)
-        hsv = cv2.merge((h, s, v))
-        final = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
-        
-        final = cv2.resize(final, (width, height))
-        cv2.imwrite(output_path, final, [cv2.IMWRITE_PNG_COMPRESSION, 0])
-    except Exception as e:
-        print(f"Brighten failed: {e}")
+# Cascade mode thresholds
+CASCADE_HASH_DISTANCE = int(os.environ.get("IMAGE_MATCH_CASCADE_HASH_DISTANCE", 2))
+CASCADE_SKIP_FACELESS = os.environ.get("IMAGE_MATCH_CASCADE_SKIP_FACELESS", "1") == "1"
 
-def denoise_image(input_path: str, output_path: str, intensity: float = 0.5):
-    try:
-        img = cv2.imread(input_path)
-        height, width = img.shape[:2]
-        
-        denoised = cv2.fastNlMeansDenoisingColored(img, None, int(15 * intensity), int(15 * intensity), 7, 21)
-        bilateral = cv2.bilateralFilter(denoised, d=int(9 * intensity), sigmaColor=75, sigmaSpace=75)
-        
-        bilateral = cv2.resize(bilateral, (width, height))
-        cv2.imwrite(output_path, bilateral, [cv2.IMWRITE_PNG_COMPRESSION, 0])
-    except Exception as e:
-        print(f"Denoise failed: {e}")
+def dhash(gray: np.ndarray, size: int = 8) -> int:
+    """64-bit difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
 
-def sharpen_image(input_path: str, output_path: str, intensity: float = 0.5):
+def phash(gray: np.ndarray) -> int:
+    """64-bit perceptual hash: low 8x8 DCT coefficients of a 32x32 thumbnail vs their median."""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def fingerprint_upload(data: bytes) -> dict:
+    """pHash/dHash of raw upload bytes; raises ValueError if undecodable.
+
+    Decodes at reduced resolution, which is plenty for 32x32 hashes and much
+    cheaper than a full decode for large JPEGs.
+    """
+    with stage("fingerprint"):
+        gray = decode_image(data, cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        return {
+            "phash": phash(gray),
+            "dhash": dhash(gray)
+        }
+
+def hash_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+@lru_cache(maxsize=1)
+def _haar_face_detector():
+    return cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml"))
+
+def _detected_faces(faces, shape):
+    """``faces`` without the whole-image fallback embedded when detection finds none."""
+    height, width = shape[:2]
+    return [f for f in faces if f["facial_area"]["w"] < width or f["facial_area"]["h"] < height]
+
+def has_face_quick(ctx: ImageContext) -> bool:
+    """Cheap face presence check (Haar cascade on a <=320px copy), no deep models."""
+    if ctx._faces is None:
+        ctx._faces = embedding_cache.get(ctx.content_hash)
+    if ctx._faces is not None:
+        return bool(_detected_faces(ctx._faces, ctx.bgr.shape))
+    gray = ctx.gray
+    scale = 320 / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    faces = _haar_face_detector().detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(24, 24))
+    return len(faces) > 0
+
+def compare_cascade(data1: bytes, data2: bytes):
+    """Tiered compare that only runs the Facenet512/RetinaFace stage when needed.
+
+    Stages, cheapest first:
+      hash      dHash distance <= CASCADE_HASH_DISTANCE means a near-duplicate;
+                face similarity is taken as 1.0 without running the models.
+      quality   ORB, SSIM and PSNR on the thumbnails. With face similarity
+                bounded to [0, 1], if even face=1 cannot lift the blend above
+                the verdict threshold (or face=0 cannot pull it below), the
+                verdict is already decided.
+      presence  Haar check for a face in either image; if there is none and
+                CASCADE_SKIP_FACELESS is set, the face stage is skipped.
+      face      full embedding similarity, as in the default mode.
+
+    Returns ``(scores, cascade)``: the ``compute_similarity_scores`` tuple with
+    face_sim None when the face stage did not run, and a dict listing the
+    stages that ran with their timings and which one decided.
+    """
+    stages = []
+
+    def finish(scores, decided_by):
+        return scores, {"stages": stages, "decided_by": decided_by}
+
+    started = time.perf_counter()
+    ctx1 = load_image_context(data1)
+    ctx2 = load_image_context(data2)
+    stages.append({"name": "decode", "ms": _elapsed_ms(started)})
+
+    started = time.perf_counter()
+    distance = hash_distance(dhash(ctx1.small_gray), dhash(ctx2.small_gray))
+    stages.append({"name": "hash", "ms": _elapsed_ms(started), "distance": distance})
+
+    started = time.perf_counter()
+    feature_sim = get_feature_similarity(ctx1, ctx2)
+    ssim_score, psnr_score = get_ssim_psnr(ctx1, ctx2)
+    stages.append({"name": "quality", "ms": _elapsed_ms(started)})
+    if distance <= CASCADE_HASH_DISTANCE:
+        return finish((1.0, feature_sim, ssim_score, psnr_score), "hash")
+
+    partial = (feature_sim + ssim_score + min(psnr_score / 40.0, 1.0)) * 0.25
+    if partial + 0.25 <= SAME_PERSON_THRESHOLD or partial > SAME_PERSON_THRESHOLD:
+        return finish((None, feature_sim, ssim_score, psnr_score), "quality")
+
+    if CASCADE_SKIP_FACELESS:
+        started = time.perf_counter()
+        present = has_face_quick(ctx1) or has_face_quick(ctx2)
+        stages.append({"name": "presence", "ms": _elapsed_ms(started), "face_found": present})
+        if not present:
+            return finish((None, feature_sim, ssim_score, psnr_score), "presence")
+
+    started = time.perf_counter()
+    face_sim = get_face_similarity(ctx1, ctx2)
+    stages.append({"name": "face", "ms": _elapsed_ms(started)})
+    return finish((face_sim, feature_sim, ssim_score, psnr_score), "face")
+
+def score_pair(data1: bytes, data2: bytes, mode: str = "full"):
+    """Scores for one compare request in ``mode`` ("full" or "cascade").
+
+    Returns ``(scores, cascade, complete)``: the score list as floats (face
+    None when skipped), the cascade dict or None, and whether every metric
+    stage succeeded. A failed stage is reported as 0, so callers must not
+    memoise an incomplete result. Raises ValueError if an upload does not decode.
+    """
+    fn = compare_cascade if mode == "cascade" else compute_similarity_scores
+    ok, result, events = collect(fn, data1, data2)
+    replay(events)
+    if not ok:
+        raise result
+    scores, cascade = result if mode == "cascade" else (result, None)
+    scores = [None if score is None else float(score) for score in scores]
+    complete = not any(kind == "error" for kind, _, _ in events)
+    return scores, cascade, complete
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+def _embed_batch(contexts):
+    """Load faces for ``contexts``; a failed batch leaves them with no faces."""
     try:
-        img = cv2.imread(input_path)
-        height, width = img.shape[:2]
-        
-        gaussian = cv2.GaussianBlur(img, (0, 0), 3 * intensity)
-        sharpened = cv2.addWeighted(img, 1.5 * intensity, gaussian, -0.5 * intensity, 0)
-        
-        sharpened = cv2.resize(sharpened, (width, height))
-        cv2.imwrite(output_path, sharpened, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+        load_faces(contexts)
     except Exception as e:
-        print(f"Sharpen failed: {e}")
+        record_error("batch_embed")
+        print(f"Batch face embedding failed: {e}")
+    for ctx in contexts:
+        if ctx._faces is None:
+            ctx._faces = []
 
-def generate_report_image(img1_path, img2_path, result, output_path):
-    try:
-        width, height = 1400, 900  # Higher resolution
-        report = Image.new('RGB', (width, height), color=(250, 250, 250))
-        draw = ImageDraw.Draw(report)
+def prepare_probe(probe_data: bytes) -> ImageContext:
+    """Decode and embed a batch probe once, released for reuse by every chunk."""
+    probe = load_image_context(probe_data)
+    _embed_batch([probe])
+    return probe.release()
+
+def compare_probe_batch(probe: ImageContext, candidates):
+    """Score a ``prepare_probe`` context against many ``(name, bytes)`` candidates.
+
+    Every candidate face that misses the embedding cache is embedded in shared
+    model batches, and ORB/SSIM/PSNR run through the vectorized
+    ``batch_metrics`` engine. Candidates drop their full-resolution arrays as
+    soon as they are embedded.
+    Returns ``(name, scores, timings)`` per candidate, where ``scores`` is the
+    ``compute_similarity_scores`` tuple or None if the candidate did not decode,
+    and ``timings`` holds per-stage milliseconds (shared batch stages are split
+    evenly across the candidates in them).
+    """
+    contexts = []
+    for name, data in candidates:
+        started = time.perf_counter()
         try:
-            font_large = ImageFont.truetype("arial.ttf", 60)
-            font_med = ImageFont.truetype("arial.ttf", 40)
-            font_small = ImageFont.truetype("arial.ttf", 30)
-        except:
-            font_large = ImageFont.load_default()
-            font_med = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-        
-        img1 = Image.open(img1_path).resize((400, 400))
-        img2 = Image.open(img2_path).resize((400, 400))
-        report.paste(img1, (100, 200))
-        report.paste(img2, (600, 200))
-        
-        draw.text((100, 50), "IMAGE MATCH PRO - ADVANCED SIMILARITY REPORT", fill="black", font=font_large)
-        draw.text((100, 130), f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", fill="gray", font=font_small)
-        
-        color = "green" if result['is_same_person'] else "red"
-        draw.text((100, 650), f"FINAL SIMILARITY: {result['final_similarity']}%", fill=color, font=font_large)
-        draw.text((100, 730), f"FACE MATCH: {result['face_similarity']}%", fill="black", font=font_med)
-        verdict = "SAME PERSON" if result['is_same_person'] else "DIFFERENT PERSON"
-        draw.text((100, 800), f"VERDICT: {verdict}", fill=color, font=font_large)
-        
-        report.save(output_path, quality=95, dpi=(300,300))  # High quality
-    except Exception as e:
-        print(f"Report image failed: {e}")
+            ctx = load_image_context(data)
+        except ValueError:
+            ctx = None
+        contexts.append((name, ctx, {"decode_ms": _elapsed_ms(started)}))
+
+    started = time.perf_counter()
+    decoded = [ctx for _, ctx, _ in contexts if ctx is not None]
+    _embed_batch(decoded)
+    for ctx in decoded:
+        ctx.release()
+    observe("batch_embed", time.perf_counter() - started)
+    embed_ms = round(_elapsed_ms(started) / max(len(decoded), 1), 2)
 
-def generate_report_pdf(report_img_path, result, output_path):
+    # ORB, SSIM and PSNR for every candidate in one vectorized pass over stacked thumbnails
+    started = time.perf_counter()
     try:
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.image(report_img_path, x=10, y=10, w=190)
-        pdf.set_font("Arial", 'B', 16)
-        pdf.cell(0, 20, f"Image Match Pro Report - {datetime.now().strftime('%Y-%m-%d')}", ln=1, align='C')
-        pdf.cell(0, 15, f"Final Similarity: {result['final_similarity']}%", ln=1)
-        pdf.cell(0, 15, f"Face Match: {result['face_similarity']}%", ln=1)
-        pdf.output(output_path)
+        packed, offsets = pack_descriptors([ctx.orb_descriptors for ctx in decoded])
+        feature_sims = batch_feature_similarity(probe.orb_descriptors, packed, offsets)
+        ssim_scores = batch_ssim(probe.small_gray, np.stack([ctx.small_gray for ctx in decoded])) if decoded else []
+        psnr_scores = batch_psnr(probe.small, np.stack([ctx.small for ctx in decoded])) if decoded else []
     except Exception as e:
-        print(f"PDF failed: {e}")
+        record_error("batch_metrics")
+        print(f"Batch metrics failed: {e}")
+        feature_sims = ssim_scores = psnr_scores = np.zeros(len(decoded))
+    observe("batch_metrics", time.perf_counter() - started)
+    metrics_ms = round(_elapsed_ms(started) / max(len(decoded), 1), 2)
 
-def generate_clean_report_image(orig_path, cleaned_path, result, output_path):
-    try:
-        width, height = 1400, 900
-        report = Image.new('RGB', (width, height), color=(250, 250, 250))
-        draw = ImageDraw.Draw(report)
+    results = []
+    position = 0
+    for name, ctx, timings in contexts:
+        if ctx is None:
+            results.append((name, None, timings))
+            continue
+        face_sim = get_face_similarity(probe, ctx)
+        scores = (face_sim, float(feature_sims[position]), float(ssim_scores[position]), float(psnr_scores[position]))
+        position += 1
+        timings.update({"embed_ms": embed_ms, "metrics_ms": metrics_ms})
+        results.append((name, scores, timings))
+    return results
+
+def get_face_embedding(data: bytes):
+    """Facenet512 embedding of the largest face in an upload (used by the gallery).
+
+    Returns None when no face is detected, rather than the whole-image
+    fallback embedding, which must never be enrolled or searched.
+    """
+    ctx = load_image_context(data)
+    faces = _detected_faces(ctx.faces, ctx.bgr.shape)
+    if not faces:
+        return None
+    face = max(faces, key=lambda f: f["facial_area"]["w"] * f["facial_area"]["h"])
+    return np.asarray(face["embedding"], dtype=np.float32)
+
+TILE_SIZE = int(os.environ.get("IMAGE_MATCH_TILE_SIZE", 512))
+TILE_WORKERS = int(os.environ.get("IMAGE_MATCH_TILE_WORKERS", os.cpu_count() or 1))
+TILED_MIN_PIXELS = 2_000_000
+PREVIEW_MAX_SIDE = int(os.environ.get("IMAGE_MATCH_PREVIEW_SIDE", 768))
+
+@lru_cache(maxsize=1)
+def _tile_executor():
+    """Shared threads for tile work; OpenCV releases the GIL while filtering."""
+    return ThreadPoolExecutor(max_workers=TILE_WORKERS, thread_name_prefix="clean-tile")
+
+def _denoise_tiled(img, h, template_size, search_size):
+    """NLM over overlapping tiles, writing back only each tile's interior.
+
+    The overlap covers the search and template reach of every interior pixel,
+    so each tile sees exactly the neighbourhood the full-image pass would and
+    peak memory is bounded by the tile size rather than the image size.
+    """
+    height, width = img.shape[:2]
+    margin = search_size // 2 + template_size // 2
+    out = np.empty_like(img)
+
+    def run(y, x):
+        y0, x0 = max(0, y - margin), max(0, x - margin)
+        y1, x1 = min(height, y + TILE_SIZE + margin), min(width, x + TILE_SIZE + margin)
+        tile = cv2.fastNlMeansDenoisingColored(img[y0:y1, x0:x1], None, h, h, template_size, search_size)
+        th, tw = min(TILE_SIZE, height - y), min(TILE_SIZE, width - x)
+        out[y:y + th, x:x + tw] = tile[y - y0:y - y0 + th, x - x0:x - x0 + tw]
+
+    futures = [
+        _tile_executor().submit(run, y, x)
+        for y in range(0, height, TILE_SIZE)
+        for x in range(0, width, TILE_SIZE)
+    ]
+    for future in futures:
+        future.result()
+    return out
+
+def _guided_upsample(guide_small, result_small, guide, radius=2, eps=1e-3):
+    """Carry a low-resolution result up to ``guide``'s size with a fast guided filter.
+
+    Per channel, ``result ~ a * guide + b`` is fitted over local windows at low
+    resolution; the smoothed coefficients are upsampled and applied to the
+    full-resolution guide, so edges come from the original image.
+    """
+    ksize = (2 * radius + 1, 2 * radius + 1)
+    I = guide_small.astype(np.float32) / 255
+    p = result_small.astype(np.float32) / 255
+    mean_I = cv2.boxFilter(I, -1, ksize)
+    mean_p = cv2.boxFilter(p, -1, ksize)
+    cov_Ip = cv2.boxFilter(I * p, -1, ksize) - mean_I * mean_p
+    var_I = cv2.boxFilter(I * I, -1, ksize) - mean_I * mean_I
+    a = cov_Ip / (var_I + eps)
+    b = mean_p - a * mean_I
+
+    size = (guide.shape[1], guide.shape[0])
+    a = cv2.resize(cv2.boxFilter(a, -1, ksize), size, interpolation=cv2.INTER_LINEAR)
+    b = cv2.resize(cv2.boxFilter(b, -1, ksize), size, interpolation=cv2.INTER_LINEAR)
+    out = a * (guide.astype(np.float32) / 255) + b
+    return np.clip(out * 255 + 0.5, 0, 255).astype(np.uint8)
+
+def denoise_colored(img, h, template_size, search_size, mode=None):
+    """``cv2.fastNlMeansDenoisingColored`` (luma and colour strength ``h``) in one of ``CLEAN_MODES``."""
+    mode = mode or DEFAULT_CLEAN_MODE
+    if mode not in CLEAN_MODES:
+        raise ValueError(f"Invalid mode: {mode}")
+    height, width = img.shape[:2]
+    if mode == "auto":
+        mode = "tiled" if height * width >= TILED_MIN_PIXELS and TILE_WORKERS > 1 else "full"
+
+    if mode == "preview":
+        scale = PREVIEW_MAX_SIDE / max(height, width)
+        if scale < 1:
+            small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            denoised = cv2.fastNlMeansDenoisingColored(small, None, h, h, template_size, search_size)
+            return _guided_upsample(small, denoised, img)
+        mode = "full"
+    if mode == "tiled" and max(height, width) > TILE_SIZE:
+        return _denoise_tiled(img, h, template_size, search_size)
+    return cv2.fastNlMeansDenoisingColored(img, None, h, h, template_size, search_size)
+
+# CLEANING PIPELINE
+
+# Background removal runs detection and GrabCut with the long side at most this
+# many pixels (except in "full" mode) and upsamples the mask against the original
+GRABCUT_MAX_SIDE = int(os.environ.get("IMAGE_MATCH_GRABCUT_SIDE", 640))
+
+# Encoders for cleaned images: extension and imencode parameters. PNG level 3
+# is close to level 9 in size at a fraction of the encode time; WebP and JPEG
+# trade exactness for much smaller files.
+CLEAN_OUTPUT_FORMATS = {
+    "png": (CLEAN_OUTPUT_EXTENSIONS["png"], [cv2.IMWRITE_PNG_COMPRESSION, 3]),
+    "webp": (CLEAN_OUTPUT_EXTENSIONS["webp"], [cv2.IMWRITE_WEBP_QUALITY, 90]),
+    "jpeg": (CLEAN_OUTPUT_EXTENSIONS["jpeg"], [cv2.IMWRITE_JPEG_QUALITY, 92])
+}
+
+class CleanPipeline:
+    """One decoded image run through a chain of cleaning steps in memory.
+
+    Tone steps are not applied straight away. Per-channel LUTs (gamma) and
+    HSV value-channel lifts are folded into one 256x256 table indexed by
+    ``(brightest channel, channel value)`` and applied in a single pass before
+    the next spatial step or the encode. A value lift scales a pixel's
+    channels by ``new_v / v``, which is what an HSV round trip with H and S
+    unchanged does, so no HSV conversion is needed. This holds because every
+    folded LUT is monotonic.
+    """
+
+    def __init__(self, img: np.ndarray, mode: str = None, content_hash: str = None):
+        self._img = img
+        self.mode = mode
+        self.content_hash = content_hash
+        self.alpha = None  # set by background removal, written as a PNG/WebP alpha channel
+        self._tone = None
+        self._value_pending = False
+
+    @property
+    def image(self) -> np.ndarray:
+        self._flush()
+        return self._img
+
+    # Tone steps (deferred)
+
+    def _table(self):
+        if self._tone is None:
+            self._tone = np.tile(np.arange(256, dtype=np.uint8), (256, 1))
+        return self._tone
+
+    def channel_lut(self, lut: np.ndarray):
+        """Map every channel through a monotonic 256-entry table."""
+        self._tone = lut[self._table()]
+
+    def value_lut(self, lut: np.ndarray):
+        """Map the HSV value channel through a 256-entry table, keeping hue and saturation."""
+        table = self._table()
+        brightest = table[np.arange(256), np.arange(256)].astype(np.float32)
+        target = lut[brightest.astype(np.uint8)].astype(np.float32)
+        scale = target / np.maximum(brightest, 1)
+        scaled = np.clip(table * scale[:, None] + 0.5, 0, 255).astype(np.uint8)
+        # Black has no hue or saturation, so a lift turns it grey
+        scaled[brightest == 0] = lut[0]
+        self._tone = scaled
+        self._value_pending = True
+
+    def _flush(self):
+        if self._tone is None:
+            return
+        if self._value_pending:
+            brightest = self._img.max(axis=2).astype(np.intp)
+            self._img = self._tone.ravel()[brightest[..., None] * 256 + self._img]
+        else:
+            self._img = cv2.LUT(self._img, self._tone[255])
+        self._tone = None
+        self._value_pending = False
+
+    # Spatial steps
+
+    def denoise(self, h, template_size, search_size):
+        self._img = denoise_colored(self.image, h, template_size, search_size, self.mode)
+
+    def clahe(self, clip_limit):
+        lab = cv2.cvtColor(self.image, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab)
+        l = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=(8, 8)).apply(l)
+        self._img = cv2.cvtColor(cv2.merge((l, a, b)), cv2.COLOR_LAB2BGR)
+
+    def filter(self, kernel):
+        self._img = cv2.filter2D(self.image, -1, kernel)
+
+    def bilateral(self, diameter):
+        self._img = cv2.bilateralFilter(self.image, d=diameter, sigmaColor=75, sigmaSpace=75)
+
+    def unsharp(self, sigma, amount, blur_amount):
+        gaussian = cv2.GaussianBlur(self.image, (0, 0), sigma)
+        self._img = cv2.addWeighted(self._img, amount, gaussian, blur_amount, 0)
+
+    def cut_out(self, alpha):
+        """Mark background as transparent; repeated cut-outs keep the intersection."""
+        self.alpha = alpha if self.alpha is None else np.minimum(self.alpha, alpha)
+
+    def encoded_image(self, output_format: str) -> np.ndarray:
+        img = self.image
+        if self.alpha is None:
+            return img
+        if output_format == "jpeg":
+            # No alpha channel in JPEG: composite onto white
+            alpha = self.alpha[..., None].astype(np.float32) / 255
+            return (img * alpha + 255 * (1 - alpha) + 0.5).astype(np.uint8)
+        return np.dstack([img, self.alpha])
+
+def _gamma_lut(gamma: float) -> np.ndarray:
+    inv_gamma = 1.0 / gamma
+    return np.array([((i / 255.0) ** inv_gamma) * 255 for i in np.arange(0, 256)]).astype("uint8")
+
+def _lift_lut(amount: int) -> np.ndarray:
+    return np.clip(np.arange(256) + amount, 0, 255).astype(np.uint8)
+
+def _enhance_steps(pipe: CleanPipeline, intensity: float):
+    pipe.denoise(int(10 * intensity), 7, 21)
+    pipe.clahe(3.0 * intensity)
+    pipe.filter(np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]]) * intensity)
+    pipe.value_lut(_lift_lut(int(20 * intensity)))
+
+def _remove_background_steps(pipe: CleanPipeline, intensity: float):
+    img = pipe.image
+    height, width = img.shape[:2]
+    scale = 1.0 if pipe.mode == "full" else min(1.0, GRABCUT_MAX_SIDE / max(height, width))
+    small = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else img
+
+    boxes = _cached_face_boxes(pipe.content_hash, width, height)
+    if boxes is not None:
+        boxes = [tuple(int(round(v * scale)) for v in box) for box in boxes]
+    mask = _grabcut_mask(small, boxes, scale)
+
+    if scale < 1:
+        # Edge-aware upsample: the mask follows edges of the full-resolution image
+        alpha = _guided_upsample(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), mask * 255,
+                                 cv2.cvtColor(img, cv2.COLOR_BGR2GRAY))
+    else:
+        alpha = mask * 255
+    pipe.cut_out(alpha)
+
+def _brighten_steps(pipe: CleanPipeline, intensity: float):
+    pipe.denoise(int(15 * intensity), 10, 30)
+    pipe.clahe(4.0 * intensity)
+    # Gamma from the brightness after CLAHE
+    avg_brightness = np.mean(cv2.cvtColor(pipe.image, cv2.COLOR_BGR2GRAY))
+    pipe.channel_lut(_gamma_lut(1.0 + (1 - avg_brightness / 255) * 1.5 * intensity))
+    pipe.value_lut(_lift_lut(int(40 * intensity)))
+
+def _denoise_steps(pipe: CleanPipeline, intensity: float):
+    pipe.denoise(int(15 * intensity), 7, 21)
+    pipe.bilateral(int(9 * intensity))
+
+def _sharpen_steps(pipe: CleanPipeline, intensity: float):
+    pipe.unsharp(3 * intensity, 1.5 * intensity, -0.5 * intensity)
+
+CLEAN_STEPS = {
+    "enhance": _enhance_steps,
+    "remove_bg": _remove_background_steps,
+    "brighten": _brighten_steps,
+    "denoise": _denoise_steps,
+    "sharpen": _sharpen_steps
+}
+
+def _cached_face_boxes(content_hash, width, height):
+    """Face boxes from an earlier detection of the same image, or None if never detected."""
+    faces = embedding_cache.get(content_hash) if content_hash else None
+    if faces is None:
+        return None
+    areas = [face["facial_area"] for face in faces]
+    # A whole-image area is the no-face fallback, not a detection
+    return [(a["x"], a["y"], a["w"], a["h"]) for a in areas if a["w"] < width or a["h"] < height]
+
+def _grabcut_mask(img: np.ndarray, boxes=None, scale: float = 1.0) -> np.ndarray:
+    """0/1 foreground mask of ``img`` seeded from face boxes (detected here when None).
+
+    Pixel thresholds are tuned for full resolution and are scaled with ``scale``.
+    """
+    height, width = img.shape[:2]
+    
+    # Detect faces
+    if boxes is None:
         try:
-            font_large = ImageFont.truetype("arial.ttf", 60)
-            font_med = ImageFont.truetype("arial.ttf", 40)
-            font_small = ImageFont.truetype("arial.ttf", 30)
+            boxes = [(face.facial_area.x, face.facial_area.y, face.facial_area.w, face.facial_area.h)
+                     for face in model_registry.detect(img)]
         except:
-            font_large = ImageFont.load_default()
-            font_med = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-        
-        orig_img = Image.open(orig_path).resize((400, 400))
-        cleaned_img = Image.open(cleaned_path).resize((400, 400))
-        report.paste(orig_img, (100, 200))
-        report.paste(cleaned_img, (600, 200))
-        
-        draw.text((100, 50), "IMAGE CLEAN PRO - ENHANCEMENT REPORT", fill="black", font=font_large)
-        draw.text((100, 130), f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", fill="gray", font=font_small)
-        draw.text((100, 650), f"Operation: {result.get('operation', 'Unknown')}", fill="black", font=font_large)
-        draw.text((100, 730), "Original (Left) vs Processed (Right)", fill="black", font=font_med)
-        
-        report.save(output_path, quality=95, dpi=(300,300))
-    except Exception as e:
-        print(f"Clean report image failed: {e}")
+            boxes = []
+    
+    mask = np.zeros(img.shape[:2], np.uint8)
+    
+    has_person = False
+    
+    # For each face, mark face and body
+    for x, y, w, h in boxes:
+        if w <= 0 or h <= 0:
+            continue
+        
+        has_person = True
+        
+        # Face definite foreground
+        cv2.rectangle(mask, (x, y, x+w, y+h), cv2.GC_FGD, -1)
+        
+        # Body estimation: ellipse for dress shape
+        center = (int(x + w/2), int(y + h/2))
+        axes = (int(w * 1.5), int(h * 4))
+        if axes[0] > 0 and axes[1] > 0:
+            cv2.ellipse(mask, center, axes, 0, 0, 360, cv2.GC_PR_FGD, -1)
+    
+    # If no person detected, fallback to center rect
+    if not has_person:
+        rect = (width//4, height//4, width//2, height//2)
+        bgdModel = np.zeros((1,65), np.float64)
+        fgdModel = np.zeros((1,65), np.float64)
+        cv2.grabCut(img, mask, rect, bgdModel, fgdModel, 5, cv2.GC_INIT_WITH_RECT)
+    else:
+        # Dress shape detection using edges
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        edges = cv2.Canny(blurred, 30, 100)
+        dilated_edges = cv2.dilate(edges, np.ones((3,3), np.uint8), iterations=1)
+        
+        # Find contours for dress/body shapes
+        contours, _ = cv2.findContours(dilated_edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        # Fill large contours (people/dress)
+        for cnt in contours:
+            area = cv2.contourArea(cnt)
+            if area > 5000 * scale * scale:
+                cv2.fillPoly(mask, [cnt], cv2.GC_PR_FGD)
+        
+        # Edges to background
+        border = max(1, int(round(20 * scale)))
+        mask[0:border, :] = cv2.GC_BGD
+        mask[:, 0:border] = cv2.GC_BGD
+        mask[height-border:height, :] = cv2.GC_BGD
+        mask[:, width-border:width] = cv2.GC_BGD
+        
+        # GrabCut
+        bgdModel = np.zeros((1,65), np.float64)
+        fgdModel = np.zeros((1,65), np.float64)
+        cv2.grabCut(img, mask, None, bgdModel, fgdModel, 8, cv2.GC_INIT_WITH_MASK)
+    
+    # Final mask
+    return np.where((mask==cv2.GC_BGD)|(mask==cv2.GC_PR_BGD), 0, 1).astype('uint8')
+
+def clean_pipeline(operations, source, output_path: str, intensity: float = 0.5,
+                   mode: str = None, output_format: str = "png"):
+    """Run ``operations`` (names from ``options.CLEAN_OPERATIONS``, in order) on ``source``.
 
-def generate_clean_report_pdf(report_img_path, result, output_path):
+    ``source`` is an artifact path or the upload's bytes (decoded without
+    touching disk). The image is decoded once, every step runs in memory and
+    the result is encoded once in ``output_format`` (a ``CLEAN_OUTPUT_FORMATS``
+    key) and stored in ``artifact_store`` as ``output_path``.
+    """
+    for operation in operations:
+        if operation not in CLEAN_STEPS:
+            raise ValueError(f"Invalid operation: {operation}")
+    if output_format not in CLEAN_OUTPUT_FORMATS:
+        raise ValueError(f"Invalid output format: {output_format}")
+    # Tone steps are folded into one table applied by the next spatial step or the
+    # encode, so their cost shows up there rather than under their own stage
     try:
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.image(report_img_path, x=10, y=10, w=190)
-        pdf.set_font("Arial", 'B', 16)
-        pdf.cell(0, 20, f"Image Clean Pro Report - {datetime.now().strftime('%Y-%m-%d')}", ln=1, align='C')
-        pdf.cell(0, 15, f"Operation: {result.get('operation', 'Unknown')}", ln=1)
-        pdf.output(output_path)
+        with stage("clean"):
+            with stage("clean.decode"):
+                data = source if isinstance(source, (bytes, bytearray)) else artifact_store.read(source)
+                pipe = CleanPipeline(decode_image(data), mode, hashlib.sha256(data).hexdigest())
+            for operation in operations:
+                with stage(f"clean.{operation}"):
+                    CLEAN_STEPS[operation](pipe, intensity)
+            with stage("clean.encode"):
+                extension, params = CLEAN_OUTPUT_FORMATS[output_format]
+                _, encoded = cv2.imencode(extension, pipe.encoded_image(output_format), params)
+            with stage("clean.store"):
+                artifact_store.put(output_path, encoded)
     except Exception as e:
-        print(f"Clean PDF failed: {e}")
\ No newline at end of file
+        print(f"Cleaning failed ({'+'.join(operations)}): {e}")
+
+def clean_image(operation: str, input_path: str, output_path: str, intensity: float = 0.5, mode: str = None):
+    """Run one of ``options.CLEAN_OPERATIONS`` on ``input_path``; ``mode`` is one of ``CLEAN_MODES``."""
+    clean_pipeline([operation], input_path, output_path, intensity, mode)
+
+def advanced_enhance(input_path: str, output_path: str, intensity: float = 0.5, mode: str = None):
+    clean_image("enhance", input_path, output_path, intensity, mode)
+
+def remove_background(input_path: str, output_path: str):
+    clean_image("remove_bg", input_path, output_path)
+
+def brighten_dark_image(input_path: str, output_path: str, intensity: float = 0.5, mode: str = None):
+    clean_image("brighten", input_path, output_path, intensity, mode)
+
+def denoise_image(input_path: str, output_path: str, intensity: float = 0.5, mode: str = None):
+    clean_image("denoise", input_path, output_path, intensity, mode)
+
+def sharpen_image(input_path: str, output_path: str, intensity: float = 0.5):
+    clean_image("sharpen", input_path, output_path, intensity)
@@ -0,0 +1,271 @@
+# backend/vector_index.py
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from inference import INFERENCE_BACKEND
+
+DIM = 512
+ROW_BYTES = DIM * 4
+
+
+class FaceIndex:
+    """On-disk gallery of Facenet512 embeddings for 1:N search.
+
+    Vectors are L2-normalised float32 rows in ``vectors.f32``; row ``i`` belongs
+    to gallery id ``i`` from the SQLite metadata table, so enrolment is a single
+    positional write and any process can read the file through ``np.memmap``.
+
+    Small galleries are searched exactly with one matrix product. Once the
+    gallery reaches ``ivf_min_size`` an IVF (inverted file) index is trained
+    with k-means: each row is assigned to its nearest centroid in ``lists.i32``
+    and a query only scores the rows of its ``nprobe`` closest lists. New rows
+    are assigned incrementally; the centroids are retrained whenever the
+    gallery has doubled since the last training.
+    """
+
+    def __init__(self, directory="gallery", ivf_min_size=5000, nprobe=8):
+        self.directory = directory
+        self.ivf_min_size = ivf_min_size
+        self.nprobe = nprobe
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.lists_path = os.path.join(directory, "lists.i32")
+        self.centroids_path = os.path.join(directory, "centroids.npz")
+        self.db_path = os.path.join(directory, "gallery.db")
+        self._lock = threading.Lock()
+        self._vectors = None
+        self._centroids = None
+        self._trained_size = 0
+        self._centroids_mtime = None
+        self._ready = False
+
+    # Storage
+
+    def _setup(self):
+        if self._ready:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for path in (self.vectors_path, self.lists_path):
+            if not os.path.exists(path):
+                open(path, "ab").close()
+        conn = sqlite3.connect(self.db_path)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS gallery (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                label TEXT,
+                image_path TEXT,
+                enrolled_at TEXT,
+                deleted INTEGER DEFAULT 0
+            )
+        ''')
+        conn.commit()
+        conn.close()
+        self._ready = True
+
+    def _connect(self):
+        self._setup()
+        return sqlite3.connect(self.db_path)
+
+    def _write_at(self, path, offset, data: bytes):
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def _rows(self) -> int:
+        """Rows in the vector file, including the zeroed rows of removed entries."""
+        self._setup()
+        return os.path.getsize(self.vectors_path) // ROW_BYTES
+
+    def size(self) -> int:
+        """Enrolled entries that have not been removed."""
+        conn = self._connect()
+        try:
+            return conn.execute("SELECT COUNT(*) FROM gallery WHERE deleted = 0").fetchone()[0]
+        finally:
+            conn.close()
+
+    def _load(self):
+        """Memory-map the vectors (re-mapping when another process appended rows)."""
+        n = self._rows()
+        if self._vectors is None or self._vectors.shape[0] != n:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(n, DIM)) if n else np.zeros((0, DIM), np.float32)
+        if os.path.exists(self.centroids_path):
+            mtime = os.path.getmtime(self.centroids_path)
+            if mtime != self._centroids_mtime:
+                with np.load(self.centroids_path) as ivf:
+                    self._centroids = ivf["centroids"]
+                    self._trained_size = int(ivf["trained_size"])
+                self._centroids_mtime = mtime
+        else:
+            self._centroids = None
+            self._trained_size = 0
+        return self._vectors
+
+    def _lists(self, n):
+        lists = np.fromfile(self.lists_path, dtype=np.int32)
+        if lists.shape[0] < n:
+            lists = np.concatenate([lists, np.full(n - lists.shape[0], -1, np.int32)])
+        return lists[:n]
+
+    # IVF training
+
+    def _train(self, vectors, iterations=10, sample_size=20000):
+        n = vectors.shape[0]
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[rng.choice(n, min(n, sample_size), replace=False)])
+        centroids = sample[rng.choice(sample.shape[0], nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        lists = np.empty(n, np.int32)
+        for start in range(0, n, 65536):
+            block = np.asarray(vectors[start:start + 65536])
+            lists[start:start + 65536] = np.argmax(block @ centroids.T, axis=1)
+        tmp = self.lists_path + ".tmp"
+        lists.tofile(tmp)
+        os.replace(tmp, self.lists_path)
+        np.savez(self.centroids_path + ".tmp.npz", centroids=centroids, trained_size=n)
+        os.replace(self.centroids_path + ".tmp.npz", self.centroids_path)
+        self._centroids = None
+        self._centroids_mtime = None
+
+    # Public API
+
+    def add(self, embedding, label, image_path=None) -> int:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(DIM)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+        conn = self._connect()
+        c = conn.execute(
+            "INSERT INTO gallery (label, image_path, enrolled_at) VALUES (?, ?, ?)",
+            (label, image_path, datetime.now().isoformat())
+        )
+        conn.commit()
+        conn.close()
+        gallery_id = c.lastrowid
+        row = gallery_id - 1
+
+        with self._lock:
+            self._load()
+            list_id = -1
+            if self._centroids is not None:
+                list_id = int(np.argmax(self._centroids @ vector))
+            self._write_at(self.lists_path, row * 4, np.int32(list_id).tobytes())
+            self._write_at(self.vectors_path, row * ROW_BYTES, vector.tobytes())
+
+            n = row + 1
+            if n >= self.ivf_min_size and n >= 2 * self._trained_size:
+                self._train(self._load())
+        return gallery_id
+
+    def remove(self, gallery_id) -> bool:
+        conn = self._connect()
+        c = conn.execute("UPDATE gallery SET deleted = 1 WHERE id = ? AND deleted = 0", (gallery_id,))
+        conn.commit()
+        conn.close()
+        if c.rowcount == 0:
+            return False
+        # Zero the row so it can never score above an empty match
+        with self._lock:
+            self._write_at(self.vectors_path, (gallery_id - 1) * ROW_BYTES, bytes(ROW_BYTES))
+        return True
+
+    def image_paths(self):
+        """Stored paths of the enrolled images that have not been removed."""
+        conn = self._connect()
+        try:
+            rows = conn.execute("SELECT image_path FROM gallery WHERE deleted = 0 AND image_path IS NOT NULL").fetchall()
+        finally:
+            conn.close()
+        # Enrolment records the artifact URL, which is the stored name behind a leading slash
+        return {row[0].lstrip("/") for row in rows}
+
+    def search(self, embedding, k=5):
+        """Top-k gallery entries by cosine similarity, plus the strategy used."""
+        query = np.asarray(embedding, dtype=np.float32).reshape(DIM)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+        with self._lock:
+            vectors = self._load()
+            centroids = self._centroids
+        n = vectors.shape[0]
+        if n == 0:
+            return [], "exact"
+
+        if centroids is None or n < self.ivf_min_size:
+            strategy = "exact"
+            candidates = None
+            scores = np.asarray(vectors) @ query
+        else:
+            strategy = "ivf"
+            probe = np.argsort(centroids @ query)[-self.nprobe:]
+            lists = self._lists(n)
+            candidates = np.nonzero(np.isin(lists, probe) | (lists < 0))[0]
+            if candidates.shape[0] == 0:
+                # Every probed list is empty; fall back to scoring the whole gallery
+                strategy = "exact"
+                candidates = None
+                scores = np.asarray(vectors) @ query
+            else:
+                scores = np.asarray(vectors[candidates]) @ query
+
+        top = min(k, scores.shape[0])
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        rows = best if candidates is None else candidates[best]
+        scored = [(int(row) + 1, float(scores[i])) for row, i in zip(rows, best) if scores[i] > 0]
+        if not scored:
+            return [], strategy
+
+        conn = self._connect()
+        placeholders = ",".join("?" * len(scored))
+        meta = {
+            row[0]: row[1:]
+            for row in conn.execute(
+                f"SELECT id, label, image_path FROM gallery WHERE deleted = 0 AND id IN ({placeholders})",
+                [gallery_id for gallery_id, _ in scored]
+            )
+        }
+        conn.close()
+        matches = [
+            {
+                "gallery_id": gallery_id,
+                "label": meta[gallery_id][0],
+                "image": meta[gallery_id][1],
+                "score": round(max(0.0, min(1.0, score)) * 100, 2)
+            }
+            for gallery_id, score in scored if gallery_id in meta
+        ]
+        return matches, strategy
+
+
+# Shared gallery index; each inference backend enrols into its own gallery
+face_index = FaceIndex("gallery" if INFERENCE_BACKEND == "deepface" else f"gallery_{INFERENCE_BACKEND}")
+
+
+def gallery_image_paths():
+    """Enrolled image paths across every backend's gallery in the working directory."""
+    paths = set()
+    for name in os.listdir("."):
+        if (name == "gallery" or name.startswith("gallery_")) and os.path.isfile(os.path.join(name, "gallery.db")):
+            paths |= FaceIndex(name).image_paths()
+    return paths
+
+
+def enroll_embedding(embedding, label, image_path=None) -> int:
+    return face_index.add(embedding, label, image_path)
+
+
+def search_embedding(embedding, k=5):
+    return face_index.search(embedding, k)
@@ -0,0 +1,184 @@
+# backend/workers.py
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import collect, observe, replay
+from models import model_registry
+
+
+class PoolBusyError(Exception):
+    """Raised when the pool already holds ``max_pending`` jobs.
+
+    The API answers it with 503 and Retry-After rather than 429: the limit is
+    server capacity shared by all clients, not a per-client rate.
+    """
+
+
+class JobTimeoutError(Exception):
+    """Raised when a job does not finish within its timeout."""
+
+
+def _run_job(submitted, fn, *args):
+    observe("pool.wait", time.time() - submitted)
+    return fn(*args)
+
+
+def _warm_up():
+    # Import the image pipeline as well, so the first request pays for neither
+    import utils
+    model_registry.load()
+    return model_registry.status()
+
+
+def _warm_up_worker():
+    """Process pool initializer; a failure must not break the pool, jobs then load on demand."""
+    try:
+        _warm_up()
+    except Exception as e:
+        print(f"Worker warm-up failed: {e}")
+
+
+# Seconds between attempts to warm the models again after a failed warm-up
+WARM_RETRY_SECONDS = 30
+
+
+class WorkerPool:
+    """Bounded executor for CPU-bound image work, so handlers never block the event loop.
+
+    Configured from the environment:
+      IMAGE_MATCH_POOL         "thread" (default) or "process"; threads are the
+                               default because OpenCV, NumPy and the inference
+                               runtimes release the GIL in their heavy calls, so
+                               threads run in parallel on one resident copy of
+                               the models, while every process loads its own
+      IMAGE_MATCH_WORKERS      worker count (default: CPU count)
+      IMAGE_MATCH_MAX_PENDING  running + queued jobs before rejecting (default: 4 per worker)
+      IMAGE_MATCH_JOB_TIMEOUT  seconds a request waits for its job (default: 120)
+      IMAGE_MATCH_WARM_MODELS  "1" (default) loads the models when the pool starts;
+                               "0" defers them to the first job that needs them
+
+    Thread workers share the resident model registry of the web worker. Process
+    workers are spawned (not forked, which is unsafe once TensorFlow is loaded)
+    and each warm their own registry. A failed warm-up is retried every
+    ``WARM_RETRY_SECONDS`` when ``status`` is polled, so readiness recovers
+    once the models can load.
+    """
+
+    def __init__(self, kind=None, max_workers=None, max_pending=None, timeout=None, warm=None):
+        self.kind = kind or os.environ.get("IMAGE_MATCH_POOL", "thread")
+        if self.kind not in ("thread", "process"):
+            raise ValueError(f"Unknown pool kind: {self.kind}")
+        self.max_workers = max_workers or int(os.environ.get("IMAGE_MATCH_WORKERS", os.cpu_count() or 1))
+        self.max_pending = max_pending or int(os.environ.get("IMAGE_MATCH_MAX_PENDING", self.max_workers * 4))
+        self.timeout = timeout or float(os.environ.get("IMAGE_MATCH_JOB_TIMEOUT", 120))
+        self.warm = warm if warm is not None else os.environ.get("IMAGE_MATCH_WARM_MODELS", "1") == "1"
+        self._executor = None
+        self._warm = None
+        self._warm_started = 0.0
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.kind == "process":
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_up_worker if self.warm else None
+            )
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="image-worker")
+        if self.warm:
+            self._submit_warm_up()
+
+    def _submit_warm_up(self):
+        self._warm_started = time.monotonic()
+        self._warm = self._executor.submit(_warm_up)
+
+    def _retry_warm_up(self):
+        """Warm the models again once a failed attempt is ``WARM_RETRY_SECONDS`` old."""
+        if self._executor is None or self._warm is None or not self._warm.done():
+            return
+        error = self._warm.exception()
+        if error is not None and time.monotonic() - self._warm_started >= WARM_RETRY_SECONDS:
+            print(f"Model warm-up failed, retrying: {error}")
+            self._submit_warm_up()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def status(self) -> dict:
+        if self.warm:
+            self._retry_warm_up()
+            ready = self._warm is not None and self._warm.done() and self._warm.exception() is None
+        else:
+            # Models load on demand, so the pool is ready as soon as it accepts jobs
+            ready = self._executor is not None
+        return {
+            "ready": ready,
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "models": self._warm.result() if self._warm is not None and ready else model_registry.status()
+        }
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn, *args, timeout=None):
+        """Run ``fn(*args)`` on the pool and await its result.
+
+        Raises PoolBusyError when the queue is full (served as 503 with
+        Retry-After) and JobTimeoutError when the job outlives ``timeout``. The
+        slot is only released by the job's own future: a job that times out or
+        whose caller is cancelled before it starts is dropped, one already
+        running keeps its slot until it returns, so the queue limit reflects
+        real occupancy.
+
+        The job's stage timings are buffered where it runs (thread or child
+        process) and replayed here, into this process's metrics and the
+        current request's Server-Timing.
+        """
+        if self._executor is None:
+            self.start()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise PoolBusyError(f"{self._pending} jobs pending")
+            self._pending += 1
+        try:
+            future = self._executor.submit(collect, _run_job, time.time(), fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            # Shielded, so giving up on the wait never touches the pool future
+            ok, result, events = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                                        timeout or self.timeout)
+        except asyncio.CancelledError:
+            future.cancel()  # only succeeds if the job has not started yet
+            raise
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise JobTimeoutError(f"{getattr(fn, '__name__', 'job')} exceeded {timeout or self.timeout}s")
+        replay(events)
+        if not ok:
+            raise result
+        return result
+
+
+# Shared pool for the web worker
+worker_pool = WorkerPool()